@@ -0,0 +1,74 @@
+//
+// Decompression of configuration files content stored in file_blobs table
+//
+
+#ifndef RCDB_CPP_FILEBLOB_H
+#define RCDB_CPP_FILEBLOB_H
+
+#include <cstdint>
+#include <stdexcept>
+#include <string>
+
+#include <zlib.h>
+
+#ifdef RCDB_LZMA
+#include <lzma.h>
+#endif
+
+namespace rcdb {
+
+    /**
+     * Decompresses content of a file blob (see python/rcdb/file_archiver.py)
+     *
+     * @param compression  'zlib', 'lzma' or 'none' (file_blobs.compression)
+     * @param data         compressed data (file_blobs.data)
+     * @param length       length of compressed data in bytes
+     * @param size         size of decompressed content in bytes (file_blobs.size)
+     *
+     * 'zlib' requires linking with zlib (-lz).
+     * 'lzma' requires RCDB_LZMA define and linking with liblzma (-llzma)
+     */
+    inline std::string DecompressFileBlob(const std::string& compression, const char* data, size_t length, size_t size)
+    {
+        if (compression == "none") {
+            return std::string(data, length);
+        }
+
+        if (size == 0) {
+            return std::string();
+        }
+
+        if (compression == "zlib") {
+            std::string content(size, '\0');
+            uLongf contentLength = size;
+            int status = uncompress((Bytef *) &content[0], &contentLength, (const Bytef *) data, length);
+            if (status != Z_OK) {
+                throw std::runtime_error("zlib can't decompress file blob. Error code: " + std::to_string(status));
+            }
+            content.resize(contentLength);
+            return content;
+        }
+
+#ifdef RCDB_LZMA
+        if (compression == "lzma") {
+            std::string content(size, '\0');
+            uint64_t memoryLimit = UINT64_MAX;
+            size_t inPosition = 0;
+            size_t outPosition = 0;
+            lzma_ret status = lzma_stream_buffer_decode(&memoryLimit, 0, nullptr,
+                                                        (const uint8_t *) data, &inPosition, length,
+                                                        (uint8_t *) &content[0], &outPosition, size);
+            if (status != LZMA_OK) {
+                throw std::runtime_error("lzma can't decompress file blob. Error code: " + std::to_string(status));
+            }
+            content.resize(outPosition);
+            return content;
+        }
+#endif
+
+        throw std::runtime_error("File blob compression '" + compression + "' is not supported. "
+                                 "(lzma requires RCDB_LZMA define and liblzma)");
+    }
+}
+
+#endif //RCDB_CPP_FILEBLOB_H
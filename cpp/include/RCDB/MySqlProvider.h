@@ -15,6 +15,7 @@
 #include "MySqlConnectionInfo.h"
 #include "Exceptions.h"
 #include "StringUtils.h"
+#include "FileBlob.h"
 
 namespace rcdb {
     class MySqlProvider : public DataProvider {
@@ -245,7 +246,9 @@ namespace rcdb {
                 uint64_t id = stoul(row[0]);
                 string path(row[1]);     // files.path AS files_path
                 string sha256(row[2]);   // files.sha256 AS files_sha256
-                string content(row[3]);  // files.content AS files_content
+
+                // files.content is NULL if the content is compressed in file_blobs table (schema version 3)
+                string content = row[3] ? string(row[3]) : GetFileBlobContent(sha256);  // files.content
 
                 std::unique_ptr<RcdbFile> file(new RcdbFile(id, path, sha256, content));
                 return file;
@@ -255,6 +258,36 @@ namespace rcdb {
         }
 
 
+        /// Gets decompressed file content from file_blobs table by sha256
+        std::string GetFileBlobContent(const std::string &sha256) {
+            using namespace std;
+
+            // sha256 is base64 string, it is safe to put it to query
+            string query = "SELECT compression, size, data FROM file_blobs WHERE sha256 = '" + sha256 + "'";
+
+            if (mysql_query(_connection.get(), query.c_str())) {
+                throw logic_error(mysql_error(_connection.get()));
+            }
+
+            unique_ptr<MYSQL_RES, void (*)(MYSQL_RES *)>
+                    result(mysql_store_result(_connection.get()), &mysql_free_result);
+
+            if (!result) {
+                throw logic_error(mysql_error(_connection.get()));
+            }
+
+            MYSQL_ROW row = mysql_fetch_row(result.get());
+            if (!row) {
+                throw runtime_error("File blob with sha256='" + sha256 + "' is not found in the database");
+            }
+
+            unsigned long *lengths = mysql_fetch_lengths(result.get());   // data is binary, it may have zeroes
+            string compression(row[0]);
+            size_t size = stoul(row[1]);
+            return DecompressFileBlob(compression, row[2], lengths[2], size);
+        }
+
+
         void Test() {
             std::unique_ptr<MYSQL, void (*)(MYSQL *)> con(mysql_init(NULL), &mysql_close);
 
@@ -11,6 +11,7 @@
 #include <memory>
 #include "DataProvider.h"
 #include "RcdbFile.h"
+#include "FileBlob.h"
 
 namespace rcdb {
     class SqLiteProvider : public DataProvider {
@@ -139,7 +140,11 @@ namespace rcdb {
                 const uint64_t id = _getFileQuery.getColumn(0).getInt64();
                 const std::string path(_getFileQuery.getColumn(1).getText());     // files.path AS files_path
                 const std::string sha256(_getFileQuery.getColumn(2).getText());   // files.sha256 AS files_sha256
-                const std::string content(_getFileQuery.getColumn(3).getText());  // files.content AS files_content
+
+                // files.content is NULL if the content is compressed in file_blobs table (schema version 3)
+                const std::string content = _getFileQuery.isColumnNull(3) ?
+                                            GetFileBlobContent(sha256) :
+                                            std::string(_getFileQuery.getColumn(3).getText());  // files.content
 
                 std::unique_ptr<RcdbFile> file(new RcdbFile(id, path, sha256, content));
                 return file;
@@ -148,6 +153,31 @@ namespace rcdb {
             return std::unique_ptr<RcdbFile>(); //Empty ptr
         }
 
+        /** Gets decompressed file content from file_blobs table by sha256 */
+        std::string GetFileBlobContent(const std::string& sha256)
+        {
+            // The query is prepared on the first use. Databases before schema version 3 don't have file_blobs
+            if (!_getFileBlobQuery) {
+                _getFileBlobQuery.reset(new SQLite::Statement(_db, "SELECT compression, size, data "
+                                                                   "FROM file_blobs WHERE sha256 = ?"));
+            }
+
+            SQLite::Statement& query = *_getFileBlobQuery;
+            query.reset();
+            query.clearBindings();
+            query.bind(1, sha256);
+
+            if (!query.executeStep()) {
+                throw std::runtime_error("File blob with sha256='" + sha256 + "' is not found in the database");
+            }
+
+            const std::string compression(query.getColumn(0).getText());
+            const size_t size = (size_t) query.getColumn(1).getInt64();
+            SQLite::Column data = query.getColumn(2);
+            const char* dataPtr = (const char*) data.getBlob();     // getBlob() must go before getBytes()
+            return DecompressFileBlob(compression, dataPtr, (size_t) data.getBytes(), size);
+        }
+
 
         /** Gets conditions by name and run (@see GetRun and SetRun) */
         virtual std::vector<std::string> GetFileNames(uint64_t runNumber)  override
@@ -270,6 +300,7 @@ namespace rcdb {
         SQLite::Statement _getConditionQuery;
         SQLite::Statement _getFileQuery;
         SQLite::Statement _getFileNamesQuery;
+        std::unique_ptr<SQLite::Statement> _getFileBlobQuery;
     };
 }
 
@@ -0,0 +1,37 @@
+package org.rcdb
+
+import java.util.zip.Inflater
+
+/**
+ * Decompresses content of a configuration file stored in file_blobs table (see python/rcdb/file_archiver.py)
+ *
+ * @param compression 'zlib' or 'none' (file_blobs.compression). JDK has no lzma, such blobs are not supported
+ * @param data compressed data (file_blobs.data)
+ * @param size size of decompressed content in bytes (file_blobs.size)
+ */
+fun decompressFileBlob(compression: String, data: ByteArray, size: Int): String {
+    val bytes = when (compression) {
+        "none" -> data
+        "zlib" -> {
+            val inflater = Inflater()
+            try {
+                inflater.setInput(data)
+                val result = ByteArray(size)
+                var length = 0
+                while (length < size && !inflater.finished()) {
+                    val count = inflater.inflate(result, length, size - length)
+                    if (count == 0 && (inflater.needsInput() || inflater.needsDictionary())) {
+                        break
+                    }
+                    length += count
+                }
+                if (length < size) result.copyOf(length) else result
+            }
+            finally {
+                inflater.end()
+            }
+        }
+        else -> throw UnsupportedOperationException("File blob compression '$compression' is not supported")
+    }
+    return String(bytes, Charsets.UTF_8)
+}
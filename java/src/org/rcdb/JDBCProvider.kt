@@ -17,6 +17,7 @@ open class JDBCProvider(val connectionString: String) {
     protected var prsCondition      : PreparedStatement? = null
     protected var prsFileNames      : PreparedStatement? = null
     protected var prsFile           : PreparedStatement?=null
+    protected var prsFileBlob       : PreparedStatement?=null
 
     private var stopwatch = Stopwatch()
 
@@ -151,4 +152,43 @@ open class JDBCProvider(val connectionString: String) {
 
         return null //Empty ptr
     }
-}
\ No newline at end of file
+
+    /** Gets configuration file of the run by its path. Returns null if there is no such file */
+    fun getFile(runNumber:Long, path:String): RcdbFile?
+    {
+        val ps = prsFile!!
+        // 1 - files.path = ?
+        // 2 - run_number = ?
+        ps.setString(1, path)
+        ps.setLong(2, runNumber)
+
+        val rs = ps.executeQuery()!!
+        if (rs.next()) {
+            val sha256 = rs.getString("files_sha256")
+
+            // files.content is NULL if the content is compressed in file_blobs table (schema version 3)
+            val content = rs.getString("files_content") ?: getFileBlobContent(sha256)
+            return RcdbFile(rs.getLong("files_id"), rs.getString("files_path"), sha256, content)
+        }
+
+        return null
+    }
+
+    /** Gets decompressed file content from file_blobs table by sha256 */
+    fun getFileBlobContent(sha256:String): String
+    {
+        // The statement is prepared on the first use. Databases before schema version 3 don't have file_blobs
+        if (prsFileBlob == null) {
+            prsFileBlob = connection!!.prepareStatement("SELECT compression, size, data FROM file_blobs WHERE sha256 = ?")
+        }
+
+        val ps = prsFileBlob!!
+        ps.setString(1, sha256)
+        val rs = ps.executeQuery()!!
+        if (!rs.next()) {
+            throw SQLException("File blob with sha256='$sha256' is not found in the database")
+        }
+
+        return decompressFileBlob(rs.getString("compression"), rs.getBytes("data"), rs.getInt("size"))
+    }
+}
@@ -184,4 +184,15 @@ class Condition
 
         return dateTime;
     }
-}
\ No newline at end of file
+}
+
+
+/**
+ * Configuration file of a run
+ */
+class RcdbFile(
+        val id: Long,               /// DB id
+        val path: String,           /// Path of the file
+        val sha256: String,         /// sha256 of the content (base64)
+        val content: String         /// Content of the file
+)
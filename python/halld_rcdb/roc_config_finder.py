@@ -61,16 +61,16 @@ class HallDFilesGrabInfo(object):
         if com_ver and com_dir:
             mask = self.MASK_FORMAT.format(name, com_ver)
             self.com_files_mask = os.path.join(self.com_dir, mask)
-            self.com_files = glob.glob(self.com_files_mask)
+            self.com_files = sorted(glob.glob(self.com_files_mask))     # glob order depends on the file system
             self.com_files_by_roc = self._map_by_roc(self.com_files)
 
             if user_ver and user_dir:
                 mask = self.MASK_FORMAT.format(name, user_ver)
                 self.user_files_mask = os.path.join(self.user_dir, mask)
-                self.user_files = glob.glob(self.user_files_mask)
+                self.user_files = sorted(glob.glob(self.user_files_mask))
                 self.user_files_by_roc = self._map_by_roc(self.user_files)
 
-            for roc_name in self.com_files_by_roc.keys():
+            for roc_name in sorted(self.com_files_by_roc.keys()):
                 if roc_name in self.user_files_by_roc:
                     self.final_files.append(self.user_files_by_roc[roc_name])
 
@@ -0,0 +1,122 @@
+"""
+Finds, reads and hashes ROC configuration files of many runs in a thread pool and saves them by one DB writer
+
+The configuration area is on NFS, so globbing ROC directories and reading hundreds of .cnf files of a run
+is I/O latency bound. Worker threads do this for many runs concurrently. The caller thread is the only one
+that uses the database: it takes results in the order runs were given and saves files of each run
+by one db.add_configuration_files call. So results are the same as if runs were processed one by one.
+
+    jobs = [(run.number, main_config_content), ...]   # or (run_number, HallDMainConfigParseResult)
+    saved_count_by_run = add_runs_roc_files(db, jobs, threads=16)
+
+Workers don't touch the DB session. At most 2*threads runs are read ahead of the writer,
+so memory doesn't grow if the DB is slower than the file system.
+"""
+
+import logging
+import os
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+
+from rcdb.file_archiver import read_file_sha256
+from rcdb.log_format import BraceMessage as Lf
+from rcdb.model import ConfigurationFile
+from .roc_config_finder import find_roc_configuration_files
+from .run_config_parser import HallDMainConfigParseResult, parse_content
+
+log = logging.getLogger('rcdb.halld.roc_files_pipeline')
+
+DEFAULT_THREADS = 8
+
+
+def find_roc_file_paths(parse_result):
+    """ Paths of readable ROC configuration files of the run
+
+    :param parse_result: parsed main config file of the run
+    :type parse_result: HallDMainConfigParseResult
+    :return: list of paths, without repeats, in a deterministic order
+    :rtype: list[str]
+    """
+    paths = OrderedDict()
+    for info in find_roc_configuration_files(parse_result):
+        log.debug(Lf("Adding roc configuration files for '{}'", info.name))
+        for file_path in info.final_files:
+            if os.path.isfile(file_path) and os.access(file_path, os.R_OK):
+                log.debug(Lf("Adding roc configuration files for '{}'", file_path))
+                paths[file_path] = True
+    return list(paths.keys())
+
+
+def read_files(paths, pool=None):
+    """ Reads and hashes files
+
+    :param paths: paths of the files
+    :param pool: ThreadPool to read files concurrently. None - read them in this thread
+    :return: OrderedDict {path: (content, sha256)} in order of paths
+    """
+    if pool is None:
+        results = [read_file_sha256(path) for path in paths]
+    else:
+        results = pool.map(read_file_sha256, paths)
+    return OrderedDict(zip(paths, results))
+
+
+def read_run_roc_files(main_config):
+    """ Finds and reads ROC configuration files of one run. Is called in worker threads
+
+    :param main_config: HallDMainConfigParseResult or content of the main config file
+    :return: OrderedDict {path: (content, sha256)}
+    """
+    if isinstance(main_config, HallDMainConfigParseResult):
+        parse_result = main_config
+    else:
+        parse_result = parse_content(main_config)
+    if not parse_result:
+        return OrderedDict()
+    return read_files(find_roc_file_paths(parse_result))
+
+
+def add_runs_roc_files(db, jobs, threads=DEFAULT_THREADS, importance=ConfigurationFile.IMPORTANCE_LOW):
+    """ Finds, reads and saves ROC configuration files of many runs
+
+    :param db: RCDBProvider. Is used only by the caller thread
+    :param jobs: iterable of (run_number, main_config), main_config is HallDMainConfigParseResult or content
+                 of the main config file. The iterable may be a generator that reads the DB
+    :param threads: number of threads that read files. 1 - everything is done in the caller thread
+    :param importance: importance of saved files
+    :return: OrderedDict {run_number: number of saved files}. Runs that failed are not in it
+    """
+    saved_count_by_run = OrderedDict()
+
+    def save(run_number, get_files):
+        try:
+            files = get_files()
+            db.add_configuration_files(run_number, list(files.keys()), importance=importance, read_files=files)
+        except Exception as ex:
+            log.error(Lf("Run {}: ROC configuration files are not saved. Error: '{}'", run_number, ex))
+            return
+        saved_count_by_run[run_number] = len(files)
+        log.info(Lf("Run {}: {} ROC configuration files are saved", run_number, len(files)))
+
+    if threads <= 1:
+        for run_number, main_config in jobs:
+            save(run_number, lambda: read_run_roc_files(main_config))
+        return saved_count_by_run
+
+    pool = ThreadPool(threads)
+    try:
+        pending = deque()      # (run_number, AsyncResult) in the order of jobs
+        for run_number, main_config in jobs:
+            pending.append((run_number, pool.apply_async(read_run_roc_files, (main_config,))))
+            if len(pending) >= 2 * threads:
+                run_number, async_result = pending.popleft()
+                save(run_number, async_result.get)
+
+        while pending:
+            run_number, async_result = pending.popleft()
+            save(run_number, async_result.get)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return saved_count_by_run
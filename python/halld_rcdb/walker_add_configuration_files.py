@@ -10,6 +10,7 @@ import sys
 from rcdb import ConfigurationProvider
 from rcdb.model import ConfigurationFile, RCDB_MAX_RUN
 from . import roc_config_finder
+from . import roc_files_pipeline
 from . import run_config_parser
 
 if __name__ == "__main__":
@@ -20,6 +21,8 @@ if __name__ == "__main__":
     parser.add_argument("--run-start", default=0)
     parser.add_argument("--run-end", default=RCDB_MAX_RUN)
     parser.add_argument('--save', action='store_true')
+    parser.add_argument('--threads', type=int, default=roc_files_pipeline.DEFAULT_THREADS,
+                        help="Number of threads that read ROC configuration files (with --save)")
 
     args = parser.parse_args()
 
@@ -28,23 +31,33 @@ if __name__ == "__main__":
 
     print("Walking from run {}, to run {} ".format(args.run_start, args.run_end))
 
-    # get all runs
-    runs = db.get_runs(args.run_start, args.run_end)
-    for run in runs:
-        rtvs_value = run.get_condition_value("rtvs")
-        if not rtvs_value:
-            print("Skipping run {} not 'rtvs' condition".format(run.number))
-            continue
+    def get_main_configs():
+        """(run number, main config content) of runs. Is called by the DB writer thread of the pipeline"""
+        for run in db.get_runs(args.run_start, args.run_end):
+            rtvs_value = run.get_condition_value("rtvs")
+            if not rtvs_value:
+                print("Skipping run {} not 'rtvs' condition".format(run.number))
+                continue
 
-        rtvs = json.loads(rtvs_value)
-        config = rtvs['%(config)']
+            rtvs = json.loads(rtvs_value)
+            config = rtvs['%(config)']
 
-        run_config_file = db.get_file(run, config)
-        if not run_config_file:
-            print("Skipping run {} not 'main_config_file' is null or empty".format(run.number))
-            continue
+            run_config_file = db.get_file(run, config)
+            if not run_config_file:
+                print("Skipping run {} not 'main_config_file' is null or empty".format(run.number))
+                continue
+
+            yield run.number, run_config_file.content
+
+    if args.save:
+        # Files of many runs are found and read concurrently, one thread saves them
+        saved_count_by_run = roc_files_pipeline.add_runs_roc_files(db, get_main_configs(), threads=args.threads)
+        for run_number, saved_count in saved_count_by_run.items():
+            print("Done run {}: {} files".format(run_number, saved_count))
+        sys.exit(0)
 
-        parse_result = run_config_parser.parse_content(run_config_file.content)
+    for run_number, main_config_content in get_main_configs():
+        parse_result = run_config_parser.parse_content(main_config_content)
 
         if not parse_result:
             continue
@@ -56,9 +69,5 @@ if __name__ == "__main__":
             for file_path in info.final_files:
                 if os.path.isfile(file_path) and os.access(file_path, os.R_OK):
                     print("   {}".format(file_path))
-                    if args.save:
-                        db.add_configuration_file(run.number,
-                                                  file_path,
-                                                  importance=ConfigurationFile.IMPORTANCE_LOW)
 
-        print("Done run {}\n".format(run.number))
+        print("Done run {}\n".format(run_number))
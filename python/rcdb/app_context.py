@@ -6,11 +6,18 @@ class RcdbApplicationContext(object):
 
     def __init__(self, home, connection_str):
         self.home = home
-        self.db = RCDBProvider(connection_str)
+        self._db = None
         self.config = {}
         self.verbose = False
         self.connection_str = connection_str
 
+    @property
+    def db(self):
+        """RCDBProvider. Connects on the first use, so commands like 'upgrade' may connect differently"""
+        if self._db is None:
+            self._db = RCDBProvider(self.connection_str)
+        return self._db
+
     def set_config(self, key, value):
         self.config[key] = value
         if self.verbose:
@@ -78,6 +78,73 @@ def files(context, run, is_long):
         click.echo(file.path)
 
 
+@cli.command()
+@click.option('--rebuild', 'is_rebuild', is_flag=True, help='Creates or recreates the pivot table')
+@click.option('--verify', 'is_verify', is_flag=True, help='Compares the pivot table with conditions')
+@click.option('--drop', 'is_drop', is_flag=True, help='Removes the pivot table')
+@pass_rcdb_context
+def pivot(context, is_rebuild, is_verify, is_drop):
+    """
+    Manages materialized pivot table of condition values.
+    select_values uses it (if it exists and is in sync) instead of joining conditions table
+    """
+    db = context.db
+    assert isinstance(db, RCDBProvider)
+
+    if is_drop:
+        db.drop_pivot()
+        click.echo("Pivot table is dropped")
+        return
+
+    if is_rebuild:
+        db.rebuild_pivot()
+        click.echo("Pivot table is rebuilt")
+
+    connection = db.session.connection()
+    if not db.pivot.exists(connection):
+        click.echo("No pivot table. Use --rebuild to create it")
+        return
+
+    click.echo("Pivot table is {}".format("in sync" if db.pivot.is_fresh(connection) else "stale"))
+
+    if is_verify:
+        differences = db.verify_pivot()
+        for run_number, name, pivot_value, value in differences:
+            click.echo("run {} '{}': pivot={} conditions={}".format(run_number, name, pivot_value, value))
+        click.echo("{} differences found".format(len(differences)))
+
+
+@cli.command()
+@pass_rcdb_context
+def upgrade(context):
+    """Upgrades the database SQL schema to the version of this RCDB"""
+    from rcdb.schema_upgrade import upgrade_schema
+
+    db = RCDBProvider(context.connection_str, check_version=False)
+    versions = upgrade_schema(db)
+    if versions:
+        click.echo("Schema is upgraded to version {}".format(versions[-1]))
+    else:
+        click.echo("Schema is up to date")
+
+
+@cli.command('migrate-files')
+@click.option('--compression', type=click.Choice(['zlib', 'lzma', 'none']), default='zlib',
+              help='Compression of the content')
+@click.option('--chunk-size', default=100, help='Number of files in one transaction')
+@pass_rcdb_context
+def migrate_files(context, compression, chunk_size):
+    """
+    Moves content of configuration files added before SQL schema version 3 to compressed blobs.
+    Files with the same content share one blob. Can be stopped and started again
+    """
+    from rcdb.provider import ConfigurationProvider
+
+    db = ConfigurationProvider(context.connection_str)
+    migrated_count, blobs_count = db.migrate_configuration_files(compression, chunk_size)
+    click.echo("{} files are migrated to {} new blobs".format(migrated_count, blobs_count))
+
+
 def cat():
     pass
 
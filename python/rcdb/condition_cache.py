@@ -0,0 +1,91 @@
+"""
+LRU read cache of condition values
+
+Analysis jobs call get_condition or run.get_condition_value for a few conditions of thousands of runs.
+Without the cache each call is a query. The cache is opt-in:
+
+    db.enable_condition_cache(max_size=100000, ttl=300)
+    db.prefetch_conditions(["event_count", "beam_current"], run_min=30000, run_max=40000)    # one query
+    for run_number in range(30000, 40001):
+        cnd = db.get_condition(run_number, "event_count")        # from memory
+
+Entries are keyed by (run number, condition type id). A missing condition is cached too (as None),
+so runs without a value don't go to the database again. Entries live 'ttl' seconds, then the value
+is selected again (conditions written by other processes become visible). When there are more than
+'max_size' entries, the least recently used are removed.
+
+Writes of conditions by the same provider (add_conditions, add_conditions_bulk, upsert_conditions)
+remove entries of the written runs. A rollback of a batch clears the cache.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class ConditionCache(object):
+    """ LRU cache of Condition objects by (run_number, condition_type_id)
+
+    :param max_size: maximum number of entries
+    :param ttl: seconds an entry lives. None - forever
+    """
+
+    def __init__(self, max_size=100000, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()     # (run_number, condition_type_id) => (expiration time, Condition or None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, run_number, condition_type_id):
+        """ Gets cached condition
+
+        :return: (True, Condition or None) if the entry is cached, (False, None) otherwise
+        """
+        key = (run_number, condition_type_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        expiration, condition = entry
+        if expiration is not None and expiration < time.time():
+            del self._entries[key]
+            self.misses += 1
+            return False, None
+
+        # Move to the end as the most recently used
+        del self._entries[key]
+        self._entries[key] = entry
+        self.hits += 1
+        return True, condition
+
+    def put(self, run_number, condition_type_id, condition):
+        """Caches the condition. condition=None means the run has no such condition"""
+        key = (run_number, condition_type_id)
+        if key in self._entries:
+            del self._entries[key]
+        expiration = time.time() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (expiration, condition)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate_runs(self, run_numbers):
+        """ Removes entries of the runs
+
+        :return: [Condition] - removed conditions
+        """
+        run_numbers = set(run_numbers)
+        if not run_numbers or not self._entries:
+            return []
+        removed = []
+        for key in [key for key in self._entries if key[0] in run_numbers]:
+            condition = self._entries.pop(key)[1]
+            if condition is not None:
+                removed.append(condition)
+        return removed
+
+    def clear(self):
+        self._entries.clear()
@@ -21,3 +21,7 @@ class QueryFormatError(Exception):
 
 class SqlSchemaVersionError(Exception):
     pass
+
+
+class WriteBehindQueueFull(Exception):
+    pass
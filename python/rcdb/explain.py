@@ -0,0 +1,59 @@
+"""
+Getting SQL text and the database query plan of select_runs/select_values queries
+
+    result = db.select_values(['event_count'], "@is_production", explain=True)
+    print(result.explain["sql"])
+    print(result.explain["params"])
+    for row in result.explain["plan"]:
+        print(row)
+
+SQLite plan is from 'EXPLAIN QUERY PLAN', MySQL plan is from 'EXPLAIN'. It is possible to see if
+the query uses indexes or scans the whole table (SQLite 'SCAN TABLE conditions', MySQL type='ALL')
+"""
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Executable, ClauseElement
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN <statement> construct"""
+
+    def __init__(self, statement, prefix="EXPLAIN"):
+        self.statement = statement
+        self.prefix = prefix
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    return element.prefix + " " + compiler.process(element.statement, **kw)
+
+
+def get_explain_prefix(dialect):
+    if dialect.name == 'sqlite':
+        return "EXPLAIN QUERY PLAN"
+    return "EXPLAIN"
+
+
+def explain_query(connection, query):
+    """ Gets SQL text, bound parameters and the database plan of the query
+
+    :param connection: SQLAlchemy connection
+    :param query: SQLAlchemy select statement
+    :return: dict with keys:
+        "sql" - SQL text
+        "params" - dict of bound parameters
+        "plan_columns" - names of the plan columns
+        "plan" - list of plan rows (tuples)
+    """
+    compiled = query.compile(dialect=connection.dialect)
+    result = connection.execute(Explain(query, get_explain_prefix(connection.dialect)))
+    try:
+        plan_columns = list(result.keys())
+        plan = [tuple(row) for row in result]
+    finally:
+        result.close()
+
+    return {"sql": str(compiled),
+            "params": dict(compiled.params),
+            "plan_columns": plan_columns,
+            "plan": plan}
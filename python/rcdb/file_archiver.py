@@ -1,5 +1,18 @@
 import hashlib
 import base64
+import sys
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None     # python 2 doesn't have lzma. Contents compressed with lzma can't be read
+
+# Compression of configuration files content in file_blobs table
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_LZMA = "lzma"
+DEFAULT_COMPRESSION = COMPRESSION_ZLIB
 
 
 def get_file_hash(afile, hasher, block_size=65536):
@@ -18,7 +31,36 @@ def get_file_sha256(fname):
     http://stackoverflow.com/questions/9660079/why-base64-a-sha1-sha256-hash
     """
     with open(fname, 'rb') as afile:
-        return base64.b64encode(get_file_hash(afile, hashlib.sha256()))
+        return _to_text(base64.b64encode(get_file_hash(afile, hashlib.sha256())))
+
+
+def read_file_sha256(fname, block_size=65536):
+    """Reads the file and gets its base64 encoded sha256 in one pass
+
+    :return: (file content, sha256) The sha256 is the same as get_file_sha256 gives.
+             The content is the text as reading the file in text mode gives (see file_bytes_to_text)
+    """
+    hasher = hashlib.sha256()
+    blocks = []
+    with open(fname, 'rb') as afile:
+        buf = afile.read(block_size)
+        while len(buf) > 0:
+            hasher.update(buf)
+            blocks.append(buf)
+            buf = afile.read(block_size)
+    return file_bytes_to_text(b"".join(blocks)), _to_text(base64.b64encode(hasher.digest()))
+
+
+def file_bytes_to_text(data):
+    """ Bytes of the file to the content text
+
+    Newlines are converted as in the text mode (universal newlines). Bytes that are not valid UTF-8
+    (e.g. latin-1 text in CODA/ROC files) are replaced with U+FFFD instead of failing.
+    Python 2 str is bytes, it is returned as is
+    """
+    if sys.version_info[0] == 3:
+        return data.decode('utf-8', 'replace').replace('\r\n', '\n').replace('\r', '\n')
+    return data
 
 
 def get_string_sha256(str_to_convert):
@@ -32,4 +74,54 @@ def get_string_sha256(str_to_convert):
     """
     hasher = hashlib.sha256()
     hasher.update(bytearray(str_to_convert.encode('ascii')))
-    return base64.b64encode(hasher.digest())
\ No newline at end of file
+    return _to_text(base64.b64encode(hasher.digest()))
+
+
+def _to_text(b64_hash):
+    """b64encode returns bytes in python 3. files.sha256 is a string"""
+    if sys.version_info[0] == 3:
+        return b64_hash.decode('ascii')
+    return b64_hash
+
+
+def content_to_bytes(content):
+    """File content (str) to bytes that are compressed. Python 2 str is already bytes"""
+    if isinstance(content, bytes):
+        return content
+    return content.encode('utf-8')
+
+
+def bytes_to_content(data):
+    """Decompressed bytes back to file content (str)"""
+    if sys.version_info[0] == 3:
+        return data.decode('utf-8', 'replace')
+    return data
+
+
+def compress(data, compression=DEFAULT_COMPRESSION):
+    """ Compresses bytes
+
+    :param compression: COMPRESSION_ZLIB, COMPRESSION_LZMA or COMPRESSION_NONE
+    """
+    if compression == COMPRESSION_ZLIB:
+        return zlib.compress(data, 9)
+    if compression == COMPRESSION_LZMA:
+        if lzma is None:
+            raise ValueError("lzma compression is not available in this python. Use zlib")
+        return lzma.compress(data)     # .xz format, C++ reader decodes it with liblzma
+    if compression == COMPRESSION_NONE:
+        return data
+    raise ValueError("Unknown compression '{}'".format(compression))
+
+
+def decompress(data, compression):
+    """Decompresses bytes compressed by compress()"""
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if compression == COMPRESSION_LZMA:
+        if lzma is None:
+            raise ValueError("The content is compressed with lzma which is not available in this python")
+        return lzma.decompress(data)
+    if compression == COMPRESSION_NONE:
+        return bytes(data)
+    raise ValueError("Unknown compression '{}'".format(compression))
\ No newline at end of file
@@ -3,6 +3,7 @@ __doc__ = """
 Lexer for Python AST.
 
 """
+import threading
 from collections import namedtuple
 
 import ply.lex
@@ -374,8 +375,18 @@ class _IndentParser(object):
                 yield token
 
 
+_ply_lexer = None
+_ply_lexer_lock = threading.Lock()
+
+
 def get_lexer():
-    return _IndentParser(ply.lex.lex())
+    """Returns a new lexer. The PLY lexer tables are built only once per process, next calls clone it"""
+    global _ply_lexer
+    if _ply_lexer is None:
+        with _ply_lexer_lock:
+            if _ply_lexer is None:
+                _ply_lexer = ply.lex.lex()
+    return _IndentParser(_ply_lexer.clone())
 
 
 def tokenize(text):
@@ -0,0 +1,187 @@
+"""
+Where RCDBProvider.add_log_record writes log records
+
+    SessionLogSink  - (default) adds LogRecord to the session, it is committed with do_commit=True or the next commit
+    BufferedLogSink - keeps records in memory and inserts them with one executemany before the session commits,
+                      on flush() or when max_records are buffered
+    FileLogSink     - appends records to a local file (JSON lines) instead of the database.
+                      Is for high rate ingestion. The file can be loaded to the database later by load_log_file
+
+Usage:
+    db.set_log_sink(BufferedLogSink())
+    db.set_log_sink(FileLogSink("/tmp/rcdb_logs.jsonl"))
+
+set_log_sink flushes and detaches the previous sink. disconnect() flushes the sink
+"""
+
+import datetime
+import json
+import logging
+
+from sqlalchemy import event
+
+from rcdb.log_format import BraceMessage as Lf
+from rcdb.model import LogRecord
+
+log = logging.getLogger("rcdb.log_sink")
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _to_rows(records):
+    """LogRecord attribute names to 'logs' table column names (related_run_number is 'related_run' column)"""
+    rows = []
+    for record in records:
+        row = dict(record)
+        row["related_run"] = row.pop("related_run_number")
+        rows.append(row)
+    return rows
+
+
+class LogSink(object):
+    """Base class of log sinks"""
+
+    def attach(self, db):
+        """Is called when the sink is set to the provider"""
+        pass
+
+    def detach(self, db):
+        """Is called when the sink is replaced or the provider disconnects. Flushes records"""
+        self.flush(db)
+
+    def add(self, db, values, do_commit):
+        """ Writes the record
+
+        :param db: RCDBProvider
+        :param values: dict with LogRecord columns: table_ids, description, related_run_number, created, user_name
+        :param do_commit: add_log_record was asked to commit
+        """
+        raise NotImplementedError()
+
+    def flush(self, db):
+        """Writes buffered records (if any)"""
+        pass
+
+
+class SessionLogSink(LogSink):
+    """Adds LogRecord objects to the provider session. Is the default sink"""
+
+    def add(self, db, values, do_commit):
+        record = LogRecord()
+        for key, value in values.items():
+            setattr(record, key, value)
+        db.session.add(record)
+        if do_commit:
+            db._commit()
+
+
+class BufferedLogSink(LogSink):
+    """ Keeps records in memory and inserts them with one executemany
+
+    Records are inserted in the same transaction before the session commits, on flush()
+    or when max_records records are buffered. do_commit of add_log_record is ignored:
+    the records are committed with the next commit of the session (or flush() and db.session.commit()).
+    If the transaction is rolled back, the buffered records are dropped as are the ones already inserted
+    """
+
+    def __init__(self, max_records=1000):
+        self.max_records = max_records
+        self.records = []
+        self._listeners = []
+
+    def attach(self, db):
+        def before_commit(session):
+            self.flush(db)
+
+        def after_rollback(session):
+            self.records = []
+
+        self._listeners = [("before_commit", before_commit), ("after_rollback", after_rollback)]
+        for name, listener in self._listeners:
+            event.listen(db.session, name, listener)
+
+    def detach(self, db):
+        for name, listener in self._listeners:
+            event.remove(db.session, name, listener)
+        self._listeners = []
+        if self.records:
+            self.flush(db)
+            db.session.commit()
+
+    def add(self, db, values, do_commit):
+        self.records.append(values)
+        if len(self.records) >= self.max_records:
+            self.flush(db)
+
+    def flush(self, db):
+        if not self.records:
+            return
+        records, self.records = self.records, []
+        db.session.connection().execute(LogRecord.__table__.insert(), _to_rows(records))
+
+
+class FileLogSink(LogSink):
+    """ Appends records to the local file as JSON lines
+
+    :param path: the file path
+    :param flush_every: flush the file every N records (1 - every record)
+    """
+
+    def __init__(self, path, flush_every=1):
+        self.path = path
+        self.flush_every = flush_every
+        self._file = None
+        self._not_flushed = 0
+
+    def attach(self, db):
+        self._file = open(self.path, "a")
+
+    def detach(self, db):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def add(self, db, values, do_commit):
+        if self._file is None:
+            self.attach(db)
+        record = dict(values)
+        record["created"] = record["created"].strftime(_TIME_FORMAT)
+        self._file.write(json.dumps(record) + "\n")
+        self._not_flushed += 1
+        if self._not_flushed >= self.flush_every:
+            self.flush(db)
+
+    def flush(self, db):
+        if self._file is not None:
+            self._file.flush()
+            self._not_flushed = 0
+
+
+def read_log_file(path):
+    """Reads records written by FileLogSink. Returns list of dicts with LogRecord columns"""
+    records = []
+    with open(path) as log_file:
+        for line in log_file:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                record["created"] = datetime.datetime.strptime(record["created"], _TIME_FORMAT)
+                records.append(record)
+    return records
+
+
+def load_log_file(db, path):
+    """ Inserts records written by FileLogSink to the database
+
+    :return: number of records
+    """
+    records = read_log_file(path)
+    if records:
+        try:
+            db.session.connection().execute(LogRecord.__table__.insert(), _to_rows(records))
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+    log.debug(Lf("{} log records are loaded from '{}'", len(records), path))
+    return len(records)
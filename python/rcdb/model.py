@@ -2,14 +2,18 @@ import datetime
 
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.schema import Column, ForeignKey, Table
-from sqlalchemy.types import Integer, String, Text, DateTime, Enum, Float, Boolean, UnicodeText
+from sqlalchemy.schema import Column, ForeignKey, Table, Index
+from sqlalchemy.types import Integer, String, Text, DateTime, Enum, Float, Boolean, UnicodeText, LargeBinary
+from sqlalchemy.dialects.mysql import LONGBLOB
 from sqlalchemy.orm import sessionmaker, reconstructor, object_session
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.sql.expression import desc
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.sql.expression import func
 
+from rcdb import file_archiver
+from rcdb.errors import NoConditionTypeFound
+
 Base = declarative_base()
 
 RCDB_MAX_RUN = 18446744073709551615   # 2**64 - 1
@@ -55,7 +59,7 @@ class Run(ModelBase):
     """Run end time"""
 
     #
-    conditions = relationship("Condition", back_populates="run")
+    conditions = relationship("Condition", back_populates="run", order_by="Condition.id")
     """Conditions associated with the run"""
 
     def __init__(self):
@@ -91,12 +95,30 @@ class Run(ModelBase):
         :rtype: Condition or None
         """
         if self._conditions_by_name is None:
+            # Without loaded conditions, use the condition cache of the provider if it is on
+            provider = self._get_cached_provider()
+            if provider is not None:
+                try:
+                    return provider.get_condition(self.number, condition_name)
+                except NoConditionTypeFound:
+                    return None
+
             self._conditions_by_name = self.get_conditions_by_name()
 
         return self._conditions_by_name[condition_name] \
             if condition_name in self._conditions_by_name.keys() \
             else None
 
+    def _get_cached_provider(self):
+        """Provider of the session if its condition cache is on, None otherwise"""
+        session = object_session(self)
+        if session is None:
+            return None
+        provider = session.info.get("rcdb.provider")
+        if provider is None or provider.condition_cache is None:
+            return None
+        return provider
+
     def get_condition_value(self, condition_name):
         """ Gets the condition value if such name condition exist for the run. Null otherwise
 
@@ -126,15 +148,61 @@ class ConfigurationFile(ModelBase):
     id = Column(Integer, primary_key=True)
     path = Column(Text, nullable=False)
     sha256 = Column(String(44), nullable=False)
-    content = Column(Text(), nullable=False)
+    _content = Column('content', Text(), nullable=True)
+    """Not compressed content of files added before SQL schema version 3. Is None for files stored in blobs"""
     description = Column(String(255), nullable=True)
     importance = Column(Integer, nullable=False, default=0, server_default='0')
     runs = relationship("Run", secondary=_files_have_runs_association, back_populates="files")
+    blob = relationship("FileBlob", primaryjoin="foreign(ConfigurationFile.sha256) == FileBlob.sha256",
+                        viewonly=True, uselist=False)
+    """FileBlob: compressed content shared by all files with this sha256"""
+
+    @property
+    def content(self):
+        """File content. Is decompressed from the blob if the file has no content in files table"""
+        if self._content is not None:
+            return self._content
+        blob = self.blob
+        return blob.content if blob is not None else None
+
+    @content.setter
+    def content(self, value):
+        self._content = value
 
     def __repr__(self):
         return "<ConfigurationFile id='{0}', path='{1}'>".format(self.id, self.path)
 
 
+class FileBlob(Base):
+    """
+    Compressed content of configuration files. Is keyed by sha256 of the content
+    and is shared by all files (paths and runs) with the same content
+    """
+    __tablename__ = 'file_blobs'
+    sha256 = Column(String(44), primary_key=True, autoincrement=False)
+    compression = Column(String(8), nullable=False)
+    """'zlib', 'lzma' or 'none'. See rcdb.file_archiver"""
+    size = Column(Integer, nullable=False)
+    """Size of not compressed content in bytes"""
+    data = Column(LargeBinary().with_variant(LONGBLOB(), 'mysql'), nullable=False)
+
+    @property
+    def content(self):
+        return file_archiver.bytes_to_content(file_archiver.decompress(self.data, self.compression))
+
+    @staticmethod
+    def make_values(sha256, content, compression=file_archiver.DEFAULT_COMPRESSION):
+        """Column values of the blob with the content"""
+        data = file_archiver.content_to_bytes(content)
+        return {"sha256": sha256,
+                "compression": compression,
+                "size": len(data),
+                "data": file_archiver.compress(data, compression)}
+
+    def __repr__(self):
+        return "<FileBlob sha256='{0}', compression='{1}', size='{2}'>".format(self.sha256, self.compression, self.size)
+
+
 class ConditionType(ModelBase):
     """
     Holds type and constants name of data attached to particular run.
@@ -313,6 +381,7 @@ class Condition(ModelBase):
     """
 
     __tablename__ = 'conditions'
+    __table_args__ = (Index('run_number_condition_type_id', 'run_number', 'condition_type_id', unique=True),)
     id = Column(Integer, primary_key=True)
 
     text_value = Column(Text, nullable=True, default=None)
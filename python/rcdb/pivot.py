@@ -0,0 +1,231 @@
+"""
+Materialized pivot table of condition values
+
+select_values joins 'conditions' table once per selected condition. With many conditions this is many self joins.
+The pivot table keeps the same data in a wide form: one row per run and one column per condition type:
+
+    condition_values_pivot
+    run_number | c1 | c2 | c3 ...        (c<condition_type.id>)
+
+The table is optional. It is created (and later rebuilt) by 'rcdb pivot --rebuild' or ConditionsPivot.rebuild().
+If it exists, the provider keeps it current: add_conditions writes values to it in the same transaction
+and create_condition_type adds a column for the new type
+(inside db.batch() it marks the pivot stale instead, ALTER TABLE would commit the batch on MySQL).
+
+Freshness: condition_values_pivot_state holds the watermark of conditions table - max(id) - at the moment the pivot
+was last known to be in sync. max(id) is read from the primary key index, so the check is cheap on every select.
+If conditions are added by something that doesn't maintain the pivot, the watermark doesn't match and the pivot is
+not used until rebuilt. Direct SQL UPDATE or DELETE of conditions can't be detected this way; verify() compares
+the pivot with the conditions table.
+"""
+
+import datetime
+
+from sqlalchemy import Table, Column, Integer, Float, Boolean, DateTime, Text, MetaData, select, func, case, and_, text
+
+from rcdb.model import ConditionType, Condition
+
+PIVOT_TABLE_NAME = "condition_values_pivot"
+STATE_TABLE_NAME = "condition_values_pivot_state"
+
+_column_types = {
+    ConditionType.INT_FIELD: Integer,
+    ConditionType.FLOAT_FIELD: Float,
+    ConditionType.BOOL_FIELD: Boolean,
+    ConditionType.TIME_FIELD: DateTime,
+}
+
+
+def column_name(cnd_type):
+    """Name of the pivot column for the condition type"""
+    return "c{}".format(cnd_type.id)
+
+
+def make_pivot_column(cnd_type):
+    column_type = _column_types.get(cnd_type.value_type, Text)
+    return Column(column_name(cnd_type), column_type(), nullable=True)
+
+
+def make_pivot_table(cnd_types, metadata=None):
+    """Creates SQLAlchemy Table of the pivot with columns for cnd_types"""
+    if metadata is None:
+        metadata = MetaData()
+    columns = [make_pivot_column(cnd_type) for cnd_type in cnd_types]
+    return Table(PIVOT_TABLE_NAME, metadata,
+                 Column("run_number", Integer, primary_key=True, autoincrement=False),
+                 *columns)
+
+
+state_table = Table(STATE_TABLE_NAME, MetaData(),
+                    Column("id", Integer, primary_key=True, autoincrement=False),
+                    Column("conditions_max_id", Integer, nullable=False),
+                    Column("updated", DateTime))
+
+
+def _pivot_select(cnd_types):
+    """Select statement that pivots conditions table to (run_number, c1, c2, ...) rows"""
+    conditions = Condition.__table__
+    columns = [conditions.c.run_number]
+    for cnd_type in cnd_types:
+        value_column = getattr(conditions.c, cnd_type.get_value_field_name())
+        value = case([(conditions.c.condition_type_id == cnd_type.id, value_column)])
+        columns.append(func.max(value).label(column_name(cnd_type)))
+    return select(columns).group_by(conditions.c.run_number)
+
+
+def conditions_watermark(connection):
+    """ Selects the watermark of conditions table
+
+    :return: max(id) or 0 if there are no conditions
+    """
+    conditions = Condition.__table__
+    return connection.execute(select([func.coalesce(func.max(conditions.c.id), 0)])).scalar()
+
+
+class ConditionsPivot(object):
+    """Access to the pivot table. Keeps reflected table between calls. May be shared by clones of the provider"""
+
+    def __init__(self):
+        self._table = None
+
+    def refresh(self):
+        """Forgets the reflected table. Is called if the table is changed outside"""
+        self._table = None
+
+    @staticmethod
+    def exists(connection):
+        if connection.dialect.name == 'sqlite':
+            # has_table runs PRAGMA which commits the transaction in python 2 sqlite3 module
+            query = text("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = :name")
+            return connection.execute(query, name=PIVOT_TABLE_NAME).scalar() > 0
+        return connection.dialect.has_table(connection, PIVOT_TABLE_NAME)
+
+    def get_table(self, connection):
+        table = self._table     # refresh() may be called by other thread that shares the pivot
+        if table is None:
+            table = Table(PIVOT_TABLE_NAME, MetaData(), autoload=True, autoload_with=connection)
+            self._table = table
+        return table
+
+    def get_columns(self, connection, cnd_types):
+        """ Returns pivot columns for condition types
+
+        :return: list of columns or None if some of the types have no column in the table
+        """
+        table = self.get_table(connection)
+        names = [column_name(cnd_type) for cnd_type in cnd_types]
+        if not all(name in table.c for name in names):
+            # The table may have been changed by other process
+            self.refresh()
+            table = self.get_table(connection)
+            if not all(name in table.c for name in names):
+                return None
+        return [table.c[name] for name in names]
+
+    @staticmethod
+    def get_stored_watermark(connection):
+        return connection.execute(select([state_table.c.conditions_max_id]).where(state_table.c.id == 1)).scalar()
+
+    def is_fresh(self, connection):
+        """True if the pivot table exists and is in sync with conditions table"""
+        if not self.exists(connection):
+            return False
+        return self.get_stored_watermark(connection) == conditions_watermark(connection)
+
+    @staticmethod
+    def set_watermark(connection, watermark, expected_watermark=None):
+        """ Sets the watermark.
+
+        If expected_watermark is given, the watermark is set only if the stored one is equal to it
+        (so the stale pivot doesn't become fresh)
+        """
+        query = state_table.update().where(state_table.c.id == 1)
+        if expected_watermark is not None:
+            query = query.where(state_table.c.conditions_max_id == expected_watermark)
+        connection.execute(query.values(conditions_max_id=watermark, updated=datetime.datetime.now()))
+
+    def invalidate(self, connection):
+        """Marks the pivot as stale. It is not used until rebuilt"""
+        self.set_watermark(connection, -1)
+
+    def drop(self, connection):
+        metadata = MetaData()
+        make_pivot_table([], metadata)
+        state_table.tometadata(metadata)
+        metadata.drop_all(connection, checkfirst=True)
+        self.refresh()
+
+    def rebuild(self, connection, cnd_types):
+        """ (Re)creates the pivot table and fills it from conditions table
+
+        :param connection: SQLAlchemy connection. Better in a transaction
+        :param cnd_types: all condition types
+        """
+        self.drop(connection)
+
+        metadata = MetaData()
+        table = make_pivot_table(cnd_types, metadata)
+        state = state_table.tometadata(metadata)
+        metadata.create_all(connection)
+
+        watermark = conditions_watermark(connection)
+        connection.execute(table.insert().from_select([column.name for column in table.columns],
+                                                      _pivot_select(cnd_types)))
+        connection.execute(state.insert().values(id=1, conditions_max_id=watermark, updated=datetime.datetime.now()))
+        self.refresh()
+
+    def add_column(self, connection, cnd_type):
+        """Adds a column for the new condition type"""
+        column = make_pivot_column(cnd_type)
+        connection.execute("ALTER TABLE {} ADD COLUMN {} {}".format(
+            PIVOT_TABLE_NAME, column.name, column.type.compile(dialect=connection.dialect)))
+        self.refresh()
+
+    def update_run(self, connection, run_number, values_by_ct):
+        """ Writes values of one run
+
+        :param values_by_ct: {ConditionType: value}
+        :return: False if the pivot has no columns for some of the types
+        """
+        columns = self.get_columns(connection, list(values_by_ct.keys()))
+        if columns is None:
+            return False
+
+        values = {column.name: value for column, value in zip(columns, values_by_ct.values())}
+        table = self.get_table(connection)
+        result = connection.execute(table.update().where(table.c.run_number == run_number).values(**values))
+        if not result.rowcount:
+            connection.execute(table.insert().values(run_number=run_number, **values))
+        return True
+
+    def verify(self, connection, cnd_types, chunk_size=1000):
+        """ Compares the pivot table with conditions table
+
+        :return: list of differences: (run_number, condition name, pivot value, conditions value)
+        """
+        table = self.get_table(connection)
+        cnd_types = [cnd_type for cnd_type in cnd_types if column_name(cnd_type) in table.c]
+        conditions = Condition.__table__
+
+        run_numbers = sorted(set(
+            [row[0] for row in connection.execute(select([table.c.run_number]))] +
+            [row[0] for row in connection.execute(select([conditions.c.run_number]).distinct())]))
+
+        differences = []
+        empty_row = [None] * len(cnd_types)
+        for i in range(0, len(run_numbers), chunk_size):
+            run_min, run_max = run_numbers[i], run_numbers[min(i + chunk_size, len(run_numbers)) - 1]
+            columns = [table.c.run_number] + [table.c[column_name(cnd_type)] for cnd_type in cnd_types]
+            pivot_rows = {row[0]: list(row[1:]) for row in connection.execute(
+                select(columns).where(and_(table.c.run_number >= run_min, table.c.run_number <= run_max)))}
+            conditions_rows = {row[0]: list(row[1:]) for row in connection.execute(
+                _pivot_select(cnd_types).where(and_(conditions.c.run_number >= run_min,
+                                                    conditions.c.run_number <= run_max)))}
+
+            for run_number in run_numbers[i:i + chunk_size]:
+                pivot_row = pivot_rows.get(run_number, empty_row)
+                conditions_row = conditions_rows.get(run_number, empty_row)
+                for cnd_type, pivot_value, value in zip(cnd_types, pivot_row, conditions_row):
+                    if pivot_value != value:
+                        differences.append((run_number, cnd_type.name, pivot_value, value))
+        return differences
@@ -6,18 +6,19 @@ More details.
 
 import os
 import re
+import math
 import logging
 import sys
+import contextlib
 from time import mktime
-from collections import MutableSequence
+from collections import MutableSequence, OrderedDict
 
-from sqlalchemy import text
+from sqlalchemy import text, select, and_, bindparam
 from sqlalchemy.exc import OperationalError, ProgrammingError
 
 from ply.lex import LexToken
 
 import sqlalchemy.orm
-from sqlalchemy.orm import aliased
 from sqlalchemy.orm.exc import NoResultFound
 
 import rcdb
@@ -25,11 +26,25 @@ import rcdb.file_archiver
 from rcdb.alias import default_aliases
 from rcdb.log_format import BraceMessage as Lf
 from rcdb import lexer
+from rcdb import query_compiler
 from rcdb.stopwatch import StopWatchTimer
+from rcdb.run_set import RunSet
+from rcdb.pivot import ConditionsPivot, conditions_watermark
+from rcdb.explain import explain_query
+from rcdb.write_behind import WriteBehindQueue
+from rcdb.log_sink import SessionLogSink
+from rcdb.type_registry import ConditionTypeRegistry, get_registry
+from rcdb.condition_cache import ConditionCache
+from rcdb.result_cache import ResultCache, range_watermark
 from rcdb.errors import OverrideConditionTypeError, NoConditionTypeFound, \
     NoRunFoundError, OverrideConditionValueError, QueryFormatError
 from rcdb.model import *
 
+try:
+    from rcdb import vectorized as vector_eval
+except ImportError:
+    vector_eval = None   # numpy is not installed. select_values(..., vectorized=True) is not available
+
 log = logging.getLogger("rcdb.provider")
 
 # Python 2 to 3 fix
@@ -37,6 +52,12 @@ if sys.version_info[0] == 3:
     # noinspection PyUnresolvedReferences
     basestring = str,
 
+# Names that search queries may use after a dot. Everything else after a dot is rejected: attributes like
+# str.format can walk object attributes (e.g. '{0.__class__}'.format(x)) bypassing the '__' check
+_query_math_names = frozenset(name for name in dir(math) if not name.startswith('_'))
+_query_text_methods = frozenset(['startswith', 'endswith', 'lower', 'upper', 'strip', 'lstrip', 'rstrip',
+                                 'isdigit', 'isalpha', 'isalnum', 'isspace', 'find', 'count'])
+
 
 class RCDBProvider(object):
     """ RCDB data provider that uses SQLAlchemy for accessing databases """
@@ -48,9 +69,19 @@ class RCDBProvider(object):
         self.logging_enabled = True
         self.engine = None
         self.session = None
+        self.type_registry = None   # condition types shared by providers of the process. See rcdb.type_registry
         self._cnd_types_cache = None
         self._cnd_types_by_name = None
+        self._cnd_types_key = None
+        self._cnd_types_version = None
         self.aliases = default_aliases
+        self.query_plans = query_compiler.QueryPlanCache()
+        self.pivot = ConditionsPivot()
+        self.use_pivot = True     # select_values reads the pivot table if it exists and is fresh
+        self._batch_depth = 0     # > 0 inside 'with db.batch()', commits are deferred to the end of the batch
+        self.log_sink = SessionLogSink()    # where add_log_record writes records. See rcdb.log_sink
+        self.condition_cache = None         # LRU cache of get_condition. See enable_condition_cache
+        self.result_cache = None            # cache of select_values/select_runs. See enable_result_cache
 
         # username for record
         self.user_name = user_name
@@ -78,7 +109,7 @@ class RCDBProvider(object):
     # ------------------------------------------------
     # Connects to database using connection string
     # ------------------------------------------------
-    def connect(self, connection_string="mysql+pymysql://rcdb@127.0.0.1/rcdb", check_version=True):
+    def connect(self, connection_string="mysql+pymysql://rcdb@127.0.0.1/rcdb", check_version=True, engine_options=None):
         """
         Connects to database using connection string
 
@@ -92,23 +123,32 @@ class RCDBProvider(object):
         :param check_version: If False the database version is not checked a
         :param connection_string: connection string
         :type connection_string: str
+        :param engine_options: keyword arguments of sqlalchemy.create_engine like pool_size or pool_recycle
+        :type engine_options: dict
         """
+        engine_options = engine_options or {}
 
         try:
-            self.engine = sqlalchemy.create_engine(connection_string)
+            self.engine = sqlalchemy.create_engine(connection_string, **engine_options)
         except ImportError as err:
             # sql alchemy uses MySQLdb by default. But it might be not install in the system
             # in such case we fallback to mysqlconnector which is embedded in CCDB
             if connection_string.startswith("mysql://") and "No module named" in str(err) and 'MySQLdb' in str(err):
                 connection_string = connection_string.replace("mysql://", "mysql+pymysql://")
-                self.engine = sqlalchemy.create_engine(connection_string)
+                self.engine = sqlalchemy.create_engine(connection_string, **engine_options)
             else:
                 raise
 
         session_type = sessionmaker(bind=self.engine)
         self.session = session_type()
+        self.session.info["rcdb.provider"] = self     # Run.get_condition uses the condition cache of the provider
+        self.log_sink.attach(self)
+        self.query_plans.clear()
+        self.pivot.refresh()
         self._is_connected = True
         self._connection_string = connection_string
+        self.type_registry = get_registry(connection_string)
+        self._cnd_types_version = None
 
         if check_version:
             db_version = self.get_sql_schema_version()
@@ -121,12 +161,112 @@ class RCDBProvider(object):
                 raise rcdb.errors.SqlSchemaVersionError(message)
 
 
+    # ------------------------------------------------
+    # Does the database compare strings case sensitive
+    # ------------------------------------------------
+    @property
+    def is_text_case_sensitive(self):
+        """
+        MySQL compares strings case insensitive (with default collations). SQLite is case sensitive.
+
+        :return: True if string comparison in SQL is the same as in python
+        :rtype: bool
+        """
+        return self.engine is not None and self.engine.dialect.name != 'mysql'
+
+    # ------------------------------------------------
+    # Batch of changes in one transaction
+    # ------------------------------------------------
+    @contextlib.contextmanager
+    def batch(self):
+        """ Makes changes of many provider calls in one transaction
+
+            with db.batch():
+                run = db.create_run(1000)
+                db.add_run_start_time(run, start_time)
+                db.add_conditions(run, conditions)
+                db.add_configuration_file(run, path)
+
+        Methods that change the database (create_run, add_conditions, add_configuration_file, etc.)
+        don't commit inside the batch, changes are only flushed. Everything is committed once at the end of the block.
+        If an exception leaves the block, all changes of the batch are rolled back and the exception is reraised.
+        Since nothing is committed, the objects loaded or created in the batch (runs, condition types)
+        are not expired and are reused without selecting them again.
+
+        Batches may be nested, only the outermost one commits. Methods don't roll back inside a batch,
+        the batch owns the rollback: it is done when an exception leaves the outermost block.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.session.rollback()
+                self._clear_condition_cache()
+            raise
+
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            try:
+                self.session.commit()
+            except:
+                self.session.rollback()
+                self._clear_condition_cache()
+                raise
+
+    transaction = batch
+
+    @property
+    def in_batch(self):
+        """True inside 'with db.batch()' block"""
+        return self._batch_depth > 0
+
+    def _commit(self):
+        """Commits the session or only flushes it inside a batch"""
+        if self._batch_depth:
+            self.session.flush()
+        else:
+            self.session.commit()
+
+    def _rollback(self):
+        """Rolls back the session after a failed change. Inside a batch does nothing, the batch rolls back"""
+        if not self._batch_depth:
+            self.session.rollback()
+
+    # ------------------------------------------------
+    # Provider with the same engine and its own session
+    # ------------------------------------------------
+    def clone(self, session=None):
+        """ Creates connected provider of the same class that uses the same engine (connection pool)
+
+        SQLAlchemy session is not thread safe. Other threads should use clones of the provider.
+        Clones share the compiled query plans and the pivot table handle (they don't hold session objects),
+        the log sink is the default one attached to the clone session
+
+        :param session: SQLAlchemy session bound to the engine (e.g. of a scoped_session). None - create a new one
+        """
+        provider = self.__class__(user_name=self.user_name)
+        provider.engine = self.engine
+        provider.session = session if session is not None else sessionmaker(bind=self.engine)()
+        provider.session.info["rcdb.provider"] = provider
+        provider.log_sink.attach(provider)
+        provider.aliases = self.aliases
+        provider.query_plans = self.query_plans
+        provider.pivot = self.pivot
+        provider._connection_string = self._connection_string
+        provider.type_registry = self.type_registry
+        provider._is_connected = True
+        return provider
+
     # ------------------------------------------------
     # Closes connection to data
     # ------------------------------------------------
     def disconnect(self):
         """Closes connection to database"""
         self._is_connected = False
+        self.log_sink.detach(self)
+        self.disable_result_cache()
         self.session.close()
 
     # -------------------------------------------------
@@ -155,6 +295,20 @@ class RCDBProvider(object):
         """
         return self._connection_string
 
+    # -------------------------------------------------------------------
+    # Sets where log records are written
+    # -------------------------------------------------------------------
+    def set_log_sink(self, sink):
+        """ Sets where add_log_record writes records. The previous sink is flushed
+
+        :param sink: SessionLogSink (default), BufferedLogSink, FileLogSink from rcdb.log_sink
+        """
+        if self.session is not None:
+            self.log_sink.detach(self)
+        self.log_sink = sink
+        if self.session is not None:
+            sink.attach(self)
+
     # -------------------------------------------------------------------
     # Adds log record to the database
     # -------------------------------------------------------------------
@@ -170,37 +324,37 @@ class RCDBProvider(object):
         :param related_run_number: If it is possible a run number to which this record corresponds
         :type related_run_number: int
 
+        :param do_commit: Commit the record now. Buffered and file log sinks ignore it (see set_log_sink)
+
         :return:
         """
 
         if isinstance(related_run_number, Run):
             related_run_number = related_run_number.number
 
-        record = LogRecord()
-
         # table ids?
+        record_table_ids = None
         if isinstance(table_ids, Base):
-            record.table_ids = table_ids.log_id
+            record_table_ids = table_ids.log_id
         elif isinstance(table_ids, list):
             if table_ids:
                 if isinstance(table_ids[0], ModelBase):
-                    record.table_ids = list_to_db_text([item.log_id for item in table_ids])
+                    record_table_ids = list_to_db_text([item.log_id for item in table_ids])
                 elif isinstance(table_ids[0], str):
-                    record.table_ids = list_to_db_text(table_ids)
+                    record_table_ids = list_to_db_text(table_ids)
         elif isinstance(table_ids, str):
-            record.table_ids = table_ids
+            record_table_ids = table_ids
 
-        # description
-        record.description = str(description)
-        record.related_run_number = related_run_number
-
-        if self.user_name:
-            record.user_name = self.user_name
+        values = {
+            "table_ids": record_table_ids,
+            "description": str(description),
+            "related_run_number": related_run_number,
+            "created": datetime.datetime.now(),
+            "user_name": self.user_name if self.user_name else None,
+        }
 
         # save
-        self.session.add(record)
-        if do_commit:
-            self.session.commit()
+        self.log_sink.add(self, values, do_commit)
         log.info(description)
 
     # ------------------------------------------------
@@ -219,8 +373,8 @@ class RCDBProvider(object):
 
         run_number = int(run_number)
 
-        query = self.session.query(Run).filter(Run.number == run_number)
-        return query.first()
+        # Run.number is the primary key. get() takes the run from the session if it is there
+        return self.session.query(Run).get(run_number)
 
     # ------------------------------------------------
     # Gets Runs in range [rum_min, run_max]
@@ -295,7 +449,7 @@ class RCDBProvider(object):
             run = Run()
             run.number = run_number
             self.session.add(run)
-            self.session.commit()
+            self._commit()
 
         return run
 
@@ -331,16 +485,19 @@ class RCDBProvider(object):
         :return: ConditionType corresponding to name
         :rtype: ConditionType
         """
-        if self._cnd_types_by_name:
-            try:
-                return self._cnd_types_by_name[name]
-            except KeyError:
-                pass
         try:
-            return self.session.query(ConditionType).filter(ConditionType.name == name).one()
+            return self.get_condition_types_by_name()[name]
+        except KeyError:
+            pass
+
+        # The type may be created by other process after the registry was checked
+        try:
+            cnd_type = self.session.query(ConditionType).filter(ConditionType.name == name).one()
         except NoResultFound:
             message = "No ConditionType with name='{}' is found in DB".format(name)
             raise NoConditionTypeFound(message)
+        self._invalidate_condition_types()
+        return cnd_type
 
     # ------------------------------------------------
     # Returns condition type
@@ -351,11 +508,9 @@ class RCDBProvider(object):
         :return: all ConditionTypes in db
         :rtype: dict, {ConditionType}
         """
-        if self._cnd_types_by_name:
-            return self._cnd_types_by_name
-
         types = self.get_condition_types()
-        self._cnd_types_by_name = {t.name: t for t in types}
+        if self._cnd_types_by_name is None:
+            self._cnd_types_by_name = {t.name: t for t in types}
         return self._cnd_types_by_name
 
     # ------------------------------------------------
@@ -367,13 +522,35 @@ class RCDBProvider(object):
         :return: all ConditionTypes in db
         :rtype: list, [ConditionType]
         """
-        if self._cnd_types_cache is not None:
-            return self._cnd_types_cache
-        try:
-            self._cnd_types_cache = self.session.query(ConditionType).all()
+        if self.type_registry is None:
+            self.type_registry = ConditionTypeRegistry()
+        version, registry_types = self.type_registry.get_types(self.session.connection())
+
+        if version != self._cnd_types_version:
+            self._cnd_types_key = None
+        elif self._cnd_types_cache is not None and self._are_session_objects(self._cnd_types_cache):
             return self._cnd_types_cache
-        except NoResultFound:
-            return []
+
+        # Registry objects are detached. Merge gives objects of this session without selecting them
+        self._cnd_types_cache = [self.session.merge(cnd_type, load=False) for cnd_type in registry_types]
+        self._cnd_types_by_name = None
+        self._cnd_types_version = version
+        return self._cnd_types_cache
+
+    def _are_session_objects(self, objects):
+        """False if objects were expired by commit or are not in the session anymore"""
+        if not objects:
+            return True
+        state = sqlalchemy.inspect(objects[0])
+        return not state.expired and objects[0] in self.session
+
+    def _invalidate_condition_types(self):
+        """Condition types are reloaded by this and other providers of the process"""
+        self.type_registry.invalidate()
+        self._cnd_types_cache = None
+        self._cnd_types_by_name = None
+        self._cnd_types_key = None
+        self._cnd_types_version = None
 
     # ------------------------------------------------
     # Creates condition type
@@ -424,14 +601,26 @@ class RCDBProvider(object):
             ct.description = description
             try:
                 self.session.add(ct)
-                self.session.commit()
-                # clear cache
-                self._cnd_types_cache = None
-                self._cnd_types_by_name = None
+                self._commit()
+                # clear cache here and in other providers
+                self._invalidate_condition_types()
             except:
-                self.session.rollback()
+                self._rollback()
                 raise
 
+            # Add column to the pivot table (if there is one)
+            connection = self.session.connection()
+            if self.pivot.exists(connection):
+                if self._batch_depth:
+                    # ALTER TABLE commits implicitly on MySQL and would break the batch transaction.
+                    # The pivot is marked stale instead, the column is added when it is rebuilt
+                    log.info(Lf("Condition type '{}' is created in a batch. The pivot table is stale now "
+                                "and should be rebuilt", name))
+                    self.pivot.invalidate(connection)
+                else:
+                    self.pivot.add_column(connection, ct)
+                    self._commit()
+
             self.add_log_record(ct, "ConditionType created with name='{}', type='{}'"
                                 .format(name, value_type), 0)
             return ct
@@ -597,11 +786,327 @@ class RCDBProvider(object):
                 self.session.add(condition)
                 result.append(condition)
 
-        # 5. Commit changes
-        self.session.commit()
+        # 5. Keep the pivot table current and commit changes
+        changed_values = {ct: values_by_ct[ct] for ct in add_list + update_list}
+        if changed_values:
+            self._update_pivot({run_number: changed_values}, self._get_pivot_watermark())
+
+        self._commit()
+        if changed_values:
+            self._invalidate_cached_conditions([run_number])
 
         return result + ignore_list
 
+    # ------------------------------------------------
+    # Adds condition values for many runs at once
+    # ------------------------------------------------
+    def add_conditions_bulk(self, values_by_run, replace=False):
+        """ Adds conditions values for many runs in one transaction
+
+        The same as calling add_conditions for each run, but existing values are selected by one query
+        and new values are inserted and updated by executemany. All or nothing is written.
+
+        Example:
+            db.add_conditions_bulk({1000: {"event_count": 1000, "beam_current": 112.5},
+                                    1001: {"event_count": 2000}})
+
+        :param values_by_run: {run: key_values} where run is a run number or Run
+                              and key_values are the same as in add_conditions
+        :param replace: If true, function replaces existing values
+        :type replace: bool
+
+        :return: {run_number: (add_list, update_list, ignore_list)} - lists of condition types
+                 which values had been added, updated or ignored for the run
+        :rtype: dict
+        """
+
+        # All condition types!
+        ct_dict = self.get_condition_types_by_name()
+
+        # 1. Format and validate values
+        values_by_run_number = {}
+        for run, key_values in values_by_run.items():
+            run_number = run.number if isinstance(run, Run) else int(run)
+            values_by_ct = values_by_run_number.setdefault(run_number, {})
+
+            rows = key_values.items() if isinstance(key_values, dict) else key_values
+            for key, value in rows:
+                ct = key if isinstance(key, ConditionType) else ct_dict[key]
+                value = ct.convert_value(value)
+
+                if ct in values_by_ct:
+                    if ct.values_are_equal(value, values_by_ct[ct]):
+                        continue
+                    message = "add_conditions_bulk values for run '{}' contain several different values for '{}' " \
+                        .format(run_number, ct.name)
+                    raise KeyError(message)
+
+                values_by_ct[ct] = value
+
+        if not values_by_run_number:
+            return {}
+
+        runs_table = Run.__table__
+        conditions_table = Condition.__table__
+        connection = self.session.connection()
+        ct_by_id = {ct.id: ct for values_by_ct in values_by_run_number.values() for ct in values_by_ct.keys()}
+
+        try:
+            with RunSet(connection, values_by_run_number.keys()) as run_set:
+                # 2. Check runs exist
+                query = select([runs_table.c.number]).where(run_set.filter(runs_table.c.number))
+                existing_runs = set(row[0] for row in connection.execute(query))
+                for run_number in sorted(values_by_run_number.keys()):
+                    if run_number not in existing_runs:
+                        message = "No run with run_number='{}' found".format(run_number)
+                        raise NoRunFoundError(message)
+
+                # 3. Select existing values with one query
+                query = select([conditions_table.c.id, conditions_table.c.run_number,
+                                conditions_table.c.condition_type_id, conditions_table.c.text_value,
+                                conditions_table.c.int_value, conditions_table.c.float_value,
+                                conditions_table.c.bool_value, conditions_table.c.time_value]) \
+                    .where(and_(run_set.filter(conditions_table.c.run_number),
+                                conditions_table.c.condition_type_id.in_(list(ct_by_id.keys()))))
+                db_rows = connection.execute(query).fetchall()
+
+            # 4. Decide what to add, update or ignore
+            result = {run_number: ([], [], []) for run_number in values_by_run_number.keys()}
+            updates_by_field = {}
+            seen = set()
+            for db_row in db_rows:
+                ct = ct_by_id[db_row.condition_type_id]
+                values_by_ct = values_by_run_number[db_row.run_number]
+                if ct not in values_by_ct or (db_row.run_number, ct.id) in seen:
+                    continue
+                seen.add((db_row.run_number, ct.id))
+
+                add_list, update_list, ignore_list = result[db_row.run_number]
+                value = values_by_ct[ct]
+                db_value = db_row[ct.get_value_field_name()]
+
+                # if value is float, use precision
+                if ct.value_type == ConditionType.FLOAT_FIELD:
+                    value_is_differ = abs(db_value - value) >= 1e-12
+                else:
+                    value_is_differ = db_value != value
+
+                if not value_is_differ:
+                    ignore_list.append(ct)
+                    continue
+
+                if not replace:
+                    message = "Conditions {} already exists for the run_number='{}' " \
+                              "but the values are different. DB saved value='{}', new value='{}'. " \
+                              "(Add replace=True if you want to replace the old value)" \
+                        .format(ct.name, db_row.run_number, db_value, value)
+                    raise OverrideConditionValueError(message)
+
+                update_list.append(ct)
+                updates_by_field.setdefault(ct.get_value_field_name(), []).append({"b_id": db_row.id,
+                                                                                  "b_value": value})
+
+            insert_rows = []
+            now = datetime.datetime.now()
+            for run_number, values_by_ct in values_by_run_number.items():
+                add_list, update_list, ignore_list = result[run_number]
+                for ct, value in values_by_ct.items():
+                    if ct not in update_list and ct not in ignore_list:
+                        add_list.append(ct)
+                        insert_rows.append(_make_condition_row(run_number, ct, value, now))
+
+            # 5. Write everything
+            watermark_before = self._get_pivot_watermark()
+
+            if insert_rows:
+                connection.execute(conditions_table.insert(), insert_rows)
+
+            for field_name, update_rows in updates_by_field.items():
+                query = conditions_table.update() \
+                    .where(conditions_table.c.id == bindparam("b_id")) \
+                    .values({field_name: bindparam("b_value"), "created": now})
+                connection.execute(query, update_rows)
+
+            changed_values = {}
+            for run_number, (add_list, update_list, _) in result.items():
+                if add_list or update_list:
+                    changed_values[run_number] = {ct: values_by_run_number[run_number][ct]
+                                                  for ct in add_list + update_list}
+            self._invalidate_cached_conditions(changed_values.keys())
+            self._update_pivot(changed_values, watermark_before)
+
+            self._commit()
+        except:
+            self._rollback()
+            raise
+
+        return result
+
+    # ------------------------------------------------
+    # Adds or replaces condition values with one statement
+    # ------------------------------------------------
+    def upsert_conditions(self, values_by_run):
+        """ Adds or replaces conditions values of many runs without selecting existing values first
+
+        Values are written by one INSERT ... ON DUPLICATE KEY UPDATE (MySQL) or
+        INSERT ... ON CONFLICT DO UPDATE (SQLite >= 3.24) statement using the unique key
+        on conditions (run_number, condition_type_id) (SQL schema version 2). This is for frequent updates
+        like the per minute update of a running run. Other databases use add_conditions_bulk(..., replace=True)
+
+        Unlike add_conditions it doesn't tell which values were added, updated or are the same.
+
+        Example:
+            db.upsert_conditions({run: {"event_count": 1000, "beam_current": 112.5}})
+
+        :param values_by_run: {run: key_values} where run is a run number or Run
+                              and key_values are the same as in add_conditions
+        """
+        upsert_sql = self._get_upsert_sql()
+        if upsert_sql is None:
+            self.add_conditions_bulk(values_by_run, replace=True)
+            return
+
+        ct_dict = self.get_condition_types_by_name()
+        now = datetime.datetime.now()
+
+        # Format and validate values
+        rows = []
+        changed_values = {}
+        numbers_to_check = []
+        for run, key_values in values_by_run.items():
+            if isinstance(run, Run):
+                run_number = run.number
+            else:
+                run_number = int(run)
+                numbers_to_check.append(run_number)
+            values_by_ct = changed_values.setdefault(run_number, {})
+
+            for key, value in (key_values.items() if isinstance(key_values, dict) else key_values):
+                ct = key if isinstance(key, ConditionType) else ct_dict[key]
+                values_by_ct[ct] = ct.convert_value(value)
+
+            rows.extend(_make_condition_row(run_number, ct, value, now) for ct, value in values_by_ct.items())
+
+        if not rows:
+            return
+
+        connection = self.session.connection()
+        try:
+            # Runs given by numbers may not exist (and SQLite doesn't check foreign keys)
+            if numbers_to_check:
+                with RunSet(connection, numbers_to_check) as run_set:
+                    runs_table = Run.__table__
+                    query = select([runs_table.c.number]).where(run_set.filter(runs_table.c.number))
+                    existing_runs = set(row[0] for row in connection.execute(query))
+                for run_number in sorted(numbers_to_check):
+                    if run_number not in existing_runs:
+                        raise NoRunFoundError("No run with run_number='{}' found".format(run_number))
+
+            watermark_before = self._get_pivot_watermark()
+            connection.execute(upsert_sql, rows)
+            self._invalidate_cached_conditions(changed_values.keys())
+            self._update_pivot(changed_values, watermark_before)
+            self._commit()
+        except:
+            self._rollback()
+            raise
+
+    def _get_upsert_sql(self):
+        """ Gets upsert statement for the database or None if the database can't do it"""
+        dialect = self.engine.dialect
+        if dialect.name == 'mysql':
+            update_template = "{0} = VALUES({0})"
+            conflict_clause = "ON DUPLICATE KEY UPDATE"
+        elif dialect.name == 'sqlite' and dialect.dbapi.sqlite_version_info >= (3, 24, 0):
+            update_template = "{0} = excluded.{0}"
+            conflict_clause = "ON CONFLICT (run_number, condition_type_id) DO UPDATE SET"
+        else:
+            return None
+
+        value_columns = ["text_value", "int_value", "float_value", "bool_value", "time_value", "created"]
+        columns = ["run_number", "condition_type_id"] + value_columns
+        conditions_table = Condition.__table__
+        sql = "INSERT INTO conditions ({}) VALUES ({}) {} {}".format(
+            ", ".join(columns),
+            ", ".join(":" + column for column in columns),
+            conflict_clause,
+            ", ".join(update_template.format(column) for column in value_columns))
+
+        # Typed parameters, so values are converted the same way as in ORM
+        return text(sql).bindparams(*[bindparam(column, type_=conditions_table.c[column].type)
+                                      for column in columns])
+
+    def _get_pivot_watermark(self):
+        """Conditions watermark before the changes if the pivot table exists and is fresh. None otherwise"""
+        connection = self.session.connection()
+        if not self.pivot.exists(connection):
+            return None
+        watermark = conditions_watermark(connection)
+        if self.pivot.get_stored_watermark(connection) != watermark:
+            return None     # stale pivot is not maintained, it is rebuilt
+        return watermark
+
+    def _update_pivot(self, values_by_run, watermark_before):
+        """ Writes pending changes of conditions to the pivot table in the same transaction
+
+        The pivot watermark is moved only if the pivot was in sync before this change
+
+        :param values_by_run: {run_number: {ConditionType: value}}
+        :param watermark_before: result of _get_pivot_watermark before the changes
+        """
+        if watermark_before is None or not values_by_run:
+            return
+
+        connection = self.session.connection()
+        self.session.flush()
+
+        for run_number, values_by_ct in values_by_run.items():
+            if not self.pivot.update_run(connection, run_number, values_by_ct):
+                log.warning(Lf("Pivot table has no columns for some of {}. It is stale now and should be rebuilt",
+                               [ct.name for ct in values_by_ct.keys()]))
+                self.pivot.invalidate(connection)
+                return
+
+        watermark = conditions_watermark(connection)
+        self.pivot.set_watermark(connection, watermark, expected_watermark=watermark_before)
+
+    # ------------------------------------------------
+    # Materialized pivot table
+    # ------------------------------------------------
+    def rebuild_pivot(self):
+        """ Creates or recreates the pivot table of condition values (see rcdb.pivot) """
+        try:
+            self.pivot.rebuild(self.session.connection(), self.get_condition_types())
+            self.session.commit()
+        except:
+            self.session.rollback()
+            raise
+
+    def drop_pivot(self):
+        """ Removes the pivot table. select_values then works only with conditions table"""
+        try:
+            self.pivot.drop(self.session.connection())
+            self.session.commit()
+        except:
+            self.session.rollback()
+            raise
+
+    def verify_pivot(self):
+        """ Compares the pivot table with conditions table
+
+        :return: list of differences: (run_number, condition name, pivot value, conditions value)
+        """
+        return self.pivot.verify(self.session.connection(), self.get_condition_types())
+
+    def _get_pivot_columns(self, cnd_types):
+        """Columns of the pivot table for the types if the pivot can be used or None"""
+        if not self.use_pivot or not cnd_types:
+            return None
+        connection = self.session.connection()
+        if not self.pivot.is_fresh(connection):
+            return None
+        return self.pivot.get_columns(connection, cnd_types)
+
     # ------------------------------------------------
     # Gets condition
     # ------------------------------------------------
@@ -630,10 +1135,84 @@ class RCDBProvider(object):
             assert isinstance(key, str)
             ct = self.get_condition_type(key)
 
+        if self.condition_cache is not None:
+            is_cached, condition = self.condition_cache.get(run_number, ct.id)
+            if is_cached:
+                return condition
+
         query = self.session.query(Condition). \
             filter(Condition.type == ct, Condition.run_number == run_number)
 
-        return query.first()
+        condition = query.first()
+        if self.condition_cache is not None:
+            self.condition_cache.put(run_number, ct.id, condition)
+        return condition
+
+    # ------------------------------------------------
+    # Condition read cache
+    # ------------------------------------------------
+    def enable_condition_cache(self, max_size=100000, ttl=60.0):
+        """ Turns on LRU cache of get_condition (and run.get_condition) results. See rcdb.condition_cache
+
+        :param max_size: maximum number of cached (run, condition type) values
+        :param ttl: seconds a cached value lives. Values written by other processes are seen after ttl
+        :return: ConditionCache (the same as db.condition_cache)
+        """
+        if self.condition_cache is None:
+            self.condition_cache = ConditionCache(max_size, ttl)
+        return self.condition_cache
+
+    def disable_condition_cache(self):
+        """Turns off and drops the condition cache"""
+        self.condition_cache = None
+
+    def prefetch_conditions(self, keys, run_min, run_max):
+        """ Loads conditions of runs from run_min to run_max (inclusive) to the condition cache with one query
+
+        Turns on the cache with default settings if it is off. Runs that have no value of a condition type
+        are cached too, so get_condition doesn't go to the database for them.
+
+        :param keys: condition names or ConditionType objects
+        :param run_min: the first run number
+        :param run_max: the last run number
+        :return: the number of cached values (including missing ones)
+        """
+        cache = self.enable_condition_cache()
+        cnd_types = [key if isinstance(key, ConditionType) else self.get_condition_type(key) for key in keys]
+        if not cnd_types:
+            return 0
+        type_ids = [ct.id for ct in cnd_types]
+
+        query = self.session.query(Run.number, Condition) \
+            .outerjoin(Condition, and_(Condition.run_number == Run.number, Condition.condition_type_id.in_(type_ids))) \
+            .filter(Run.number >= run_min, Run.number <= run_max)
+
+        conditions_by_run = {}
+        for run_number, condition in query:
+            by_type = conditions_by_run.setdefault(run_number, {})
+            if condition is not None:
+                by_type.setdefault(condition.condition_type_id, condition)
+
+        for run_number, by_type in conditions_by_run.items():
+            for type_id in type_ids:
+                cache.put(run_number, type_id, by_type.get(type_id))
+
+        log.debug(Lf("Prefetched {} conditions of {} runs [{}, {}]",
+                     len(type_ids), len(conditions_by_run), run_min, run_max))
+        return len(conditions_by_run) * len(type_ids)
+
+    def _invalidate_cached_conditions(self, run_numbers):
+        """Removes cached conditions of the runs which values are changed"""
+        if self.condition_cache is None:
+            return
+        for condition in self.condition_cache.invalidate_runs(run_numbers):
+            # Values may be changed by SQL bypassing the session, the objects are reloaded when used
+            if condition in self.session:
+                self.session.expire(condition)
+
+    def _clear_condition_cache(self):
+        if self.condition_cache is not None:
+            self.condition_cache.clear()
 
     # ------------------------------------------------
     # Gets file
@@ -660,50 +1239,38 @@ class RCDBProvider(object):
 
         return query.first()
 
-    def select_runs(self, search_str="", run_min=0, run_max=sys.maxsize, sort_desc=False):
-        """ Searches RCDB for runs with e
+    # ------------------------------------------------
+    # Gets compiled plan of the search string
+    # ------------------------------------------------
+    def get_search_plan(self, search_str):
+        """ Parses and compiles search string or takes the compiled plan from the cache
+
+        The plan is cached by the search string, the set of aliases and the set of condition types
 
-        :param sort_desc: if True result runs will by sorted descendant by run_number, ascendant if False
-        :param run_min: minimum run to search
-        :param run_max: maximum run to search
         :param search_str: Search pattern
         :type search_str: str
-        :return: List of runs matching criteria
-        :rtype: RunSelectionResult
+        :return: compiled query plan
+        :rtype: query_compiler.QueryPlan
         """
-        start_time_stamp = int(mktime(datetime.datetime.now().timetuple()) * 1000)
-        preparation_sw = StopWatchTimer()
-
-        if run_min > run_max:
-            run_min, run_max = run_max, run_min
-
-        # PHASE 0 - Maybe there is no query?!
-        if not search_str or not search_str.strip():
-            # If no query, just use get_runs function and return the result
-            preparation_sw.stop()
-            query_sw = StopWatchTimer()
-            sel_runs = self.get_runs(run_min, run_max, sort_desc)
-            query_sw.stop()
+        search_str = str(search_str)
+        all_cnd_types_by_name = self.get_condition_types_by_name()
 
-            result = RunSelectionResult(sel_runs, self)
-            result.sort_desc = sort_desc
-            result.filter_condition_names = []
-            result.filter_condition_types = []
-            result.performance["preparation"] = preparation_sw.elapsed
-            result.performance["query"] = query_sw.elapsed
-            result.performance["selection"] = 0
-            result.performance["start_time_stamp"] = start_time_stamp
+        if self._cnd_types_key is None:
+            self._cnd_types_key = tuple(sorted((ct.id, ct.name, ct.value_type)
+                                               for ct in all_cnd_types_by_name.values()))
 
-            return result
+        aliases_key = tuple((alias.name, alias.expression) for alias in self.aliases)
+        plan_key = (search_str, aliases_key, self._cnd_types_key, self.is_text_case_sensitive)
 
-        # get all condition types
-        all_cnt_types = self.get_condition_types()
-        all_cnd_types_by_name = {cnd.name: cnd for cnd in all_cnt_types}
-        all_cnd_names = [str(key) for key in all_cnd_types_by_name.keys()]
+        plan = self.query_plans.get(plan_key)
+        if plan is None:
+            plan = self._compile_search_plan(search_str, all_cnd_types_by_name)
+            self.query_plans.put(plan_key, plan)
+        return plan
 
-        # PHASE 1: getting what to search from search_str
+    def _compile_search_plan(self, search_str, all_cnd_types_by_name):
+        """Creates QueryPlan for get_search_plan"""
 
-        search_str = str(search_str)
         if '__' in search_str:
             raise QueryFormatError("Query contains restricted symbol: '__'")
 
@@ -716,83 +1283,156 @@ class RCDBProvider(object):
         search_str = search_str.replace('\r', ' ')
 
         tokens = [token for token in lexer.tokenize(search_str)]
+        search_tree = query_compiler.parse(tokens)
+
+        # search is evaluated over a selected row where 0 column is run number
+        name_template = "values[{}]"
+        index_offset = 1
 
+        plan = query_compiler.QueryPlan()
+        names = plan.names
         target_cnd_types = []
-        names = []
-        aliased_cnd_types = []
-        aliased_cnd = []
-        names_count = 0
-        for token in tokens:
+        for i, token in enumerate(tokens):
             if token.type in lexer.rcdb_query_restricted:
                 raise QueryFormatError("Query contains restricted symbol: '{}'".format(token.value))
 
             if token.type != "NAME":
                 continue
 
+            if i > 0 and tokens[i - 1].type == 'DOT':
+                # attribute or function name like math.sqrt or daq_run.startswith
+                owner = tokens[i - 2] if i > 1 else None
+                if owner is not None and owner.type == 'NAME' and owner.value == 'math':
+                    allowed_names = _query_math_names
+                else:
+                    allowed_names = _query_text_methods
+                if token.value not in allowed_names:
+                    raise QueryFormatError("Name '{}' is not allowed after '.'".format(token.value))
+                continue
+
             if token.value == 'math':
                 continue
 
             if token.value == 'startswith':
                 continue
 
-            if token.value not in all_cnd_names:
+            if token.value not in all_cnd_types_by_name:
                 message = "Name '{}' is not found in ConditionTypes".format(token.value)
                 raise QueryFormatError(message)
-            else:
-                cnd_name = token.value
-                cnd_type = all_cnd_types_by_name[token.value]
-                target_cnd_types.append(cnd_type)
-
-                token.value = "value[{}].value".format(names_count)
-                names_count += 1
 
+            cnd_name = token.value
+            if cnd_name not in names:
+                cnd_type = all_cnd_types_by_name[cnd_name]
                 names.append(cnd_name)
-                aliased_cnd.append(aliased(Condition))
-                aliased_cnd_types.append(aliased(ConditionType))
+                target_cnd_types.append(cnd_type)
+                plan.value_tables.append(Condition.__table__.alias(cnd_name + "_table"))
 
-        # PHASE 2: Database query
-        query = self.session.query()
+            token.value = name_template.format(names.index(cnd_name) + index_offset)
 
-        if not names_count:
-            return None
+        # Generate SQL filter
+        sql_columns = {}
+        for name, cnd_type, value_table in zip(names, target_cnd_types, plan.value_tables):
+            value_column = getattr(value_table.c, cnd_type.get_value_field_name())
+            sql_columns[name] = (value_column, cnd_type)
+
+        plan.search_tree = search_tree
+        plan.sql_filter, plan.is_exact_filter = query_compiler.to_sql_filter(search_tree, sql_columns,
+                                                                             self.is_text_case_sensitive)
 
+        # Compile python code for the parts that can't be done by the database
         search_eval = " ".join([token.value for token in tokens if isinstance(token, LexToken)])
+        if search_eval and not plan.is_exact_filter:
+            plan.compiled_search_eval = compile(search_eval, '<string>', 'eval')
 
-        for (i, alias_cnd) in enumerate(aliased_cnd):
-            query = query.add_entity(alias_cnd).filter(alias_cnd.condition_type_id == target_cnd_types[i].id)
-            if i != 0:
-                query = query.filter(alias_cnd.run_number == aliased_cnd[0].run_number)
+        return plan
 
-        query = query.filter(aliased_cnd[0].run_number >= run_min, aliased_cnd[0].run_number <= run_max) \
-            .join(aliased_cnd[0].run)
+    def select_runs(self, search_str="", run_min=0, run_max=sys.maxsize, sort_desc=False, explain=False):
+        """ Searches RCDB for runs with e
 
-        # apply sorting
-        if not sort_desc:
-            query = query.order_by(aliased_cnd[0].run_number)
-        else:
-            query = query.order_by(desc(aliased_cnd[0].run_number))
+        :param sort_desc: if True result runs will by sorted descendant by run_number, ascendant if False
+        :param run_min: minimum run to search
+        :param run_max: maximum run to search
+        :param explain: If True, result.explain is filled with SQL and the database query plan (see rcdb.explain)
+                        and result.performance has detailed timings and row counts
+        :param search_str: Search pattern
+        :type search_str: str
+        :return: List of runs matching criteria
+        :rtype: RunSelectionResult
+        """
+        start_time_stamp = int(mktime(datetime.datetime.now().timetuple()) * 1000)
+        preparation_sw = StopWatchTimer()
+
+        if run_min > run_max:
+            run_min, run_max = run_max, run_min
+
+        # PHASE 0 - Maybe there is no query?!
+        if not search_str or not search_str.strip():
+            # If no query, just use get_runs function and return the result
+            preparation_sw.stop()
+            query_sw = StopWatchTimer()
+            sel_runs = self.get_runs(run_min, run_max, sort_desc)
+            query_sw.stop()
+
+            result = RunSelectionResult(sel_runs, self)
+            result.sort_desc = sort_desc
+            result.filter_condition_names = []
+            result.filter_condition_types = []
+            result.performance["preparation"] = preparation_sw.elapsed
+            result.performance["query"] = query_sw.elapsed
+            result.performance["selection"] = 0
+            result.performance["start_time_stamp"] = start_time_stamp
+
+            return result
+
+        # Maybe the same query over the same data was done before?
+        cache_key = watermark = None
+        if self.result_cache is not None and not explain:
+            cache_key = self._get_result_cache_key("runs", search_str, [], run_min, run_max, sort_desc, False)
+            watermark = range_watermark(self.session.connection(), run_min, run_max)
+            cached = self.result_cache.get(cache_key, watermark)
+            if cached is not None:
+                run_numbers, names, type_names = cached
+                preparation_sw.stop()
+                result = RunSelectionResult(self._load_runs(run_numbers), self)
+                result.filter_condition_names = list(names)
+                result.filter_condition_types = self._get_cached_condition_types(type_names)
+                result.sort_desc = sort_desc
+                result.performance["preparation"] = preparation_sw.elapsed
+                result.performance["start_time_stamp"] = start_time_stamp
+                result.performance["cached"] = True
+                return result
+
+        # PHASE 1 and 2: getting what to search from search_str and building the query.
+        # Only run numbers and values are selected. Runs must have all conditions of the search
+        plan, query, _, _, target_cnd_types = \
+            self._build_values_query([], search_str, run_min, run_max, sort_desc, None, require_all=True)
+
+        names = list(plan.names)
+        if not names:
+            return None
 
         preparation_sw.stop()
         query_sw = StopWatchTimer()
 
-        values = query.all()
+        result = self.session.connection().execute(query)
 
         query_sw.stop()
 
         selection_sw = StopWatchTimer()
+        profile = {}
+        if explain:
+            result = self._fetch_profiled(result, profile)
 
         # PHASE 3: Selecting runs
-        compiled_search_eval = compile(search_eval, '<string>', 'eval')
-
-        sel_runs = []
+        run_numbers = [values[0] for values in self._select_values_rows(plan, result, False)]
 
-        for value in values:
-            if isinstance(value, Condition):
-                value = (value,)
-            run = value[0].run
-            if eval(compiled_search_eval):
-                sel_runs.append(run)
+        load_runs_sw = StopWatchTimer()
+        sel_runs = self._load_runs(run_numbers)
+        load_runs_sw.stop()
 
+        if cache_key is not None:
+            self.result_cache.put(cache_key, watermark,
+                                  (run_numbers, names, [cnd_type.name for cnd_type in target_cnd_types]))
         selection_sw.stop()
         result = RunSelectionResult(sel_runs, self)
         result.filter_condition_names = names
@@ -803,10 +1443,27 @@ class RCDBProvider(object):
         result.performance["selection"] = selection_sw.elapsed
         result.performance["start_time_stamp"] = start_time_stamp
 
+        if explain:
+            profile["eval"] = selection_sw.elapsed - profile["fetch"] - load_runs_sw.elapsed
+            profile["load_runs"] = load_runs_sw.elapsed
+            profile["selected_rows"] = len(sel_runs)
+            result.performance.update(profile)
+            result.explain = explain_query(self.session.connection(), query)
+
         return result
 
+    def _load_runs(self, run_numbers):
+        """Loads runs by one query. Returns them in the order of run_numbers"""
+        runs_by_number = {}
+        if run_numbers:
+            with RunSet(self.session.connection(), run_numbers) as run_set:
+                for run in self.session.query(Run).filter(run_set.filter(Run.number)):
+                    runs_by_number[run.number] = run
+
+        return [runs_by_number[run_number] for run_number in run_numbers]
+
     def select_values(self, val_names=None, search_str="", run_min=0, run_max=sys.maxsize, sort_desc=False,
-                      insert_run_number=True, runs=None):
+                      insert_run_number=True, runs=None, vectorized=False, explain=False):
         """ Searches RCDB for runs with e
         
         :param val_names: list of conditions names to select
@@ -815,6 +1472,10 @@ class RCDBProvider(object):
         :param run_max: maximum run to search        
         :param runs: May be a list of runs to search from. In this case run_min and run_max are not used
         :param insert_run_number: If True the first column of the result will be a run number
+        :param vectorized: If True, the part of the search that is not done by the database is evaluated
+                           with numpy array operations instead of row by row python eval. Requires numpy
+        :param explain: If True, result.explain is filled with SQL and the database query plan (see rcdb.explain)
+                        and result.performance has detailed timings and row counts
         :param search_str: Search pattern
         :type search_str: str
         :return: List of runs matching criteria
@@ -824,161 +1485,337 @@ class RCDBProvider(object):
         total_sw = StopWatchTimer()
         preparation_sw = StopWatchTimer()
 
-        if run_min > run_max:
-            run_min, run_max = run_max, run_min
+        if vectorized and vector_eval is None:
+            raise ImportError("numpy is required for select_values(..., vectorized=True)")
 
-        # get all condition types
-        all_cnd_types_by_name = self.get_condition_types_by_name()
-        all_cnd_names = [str(key) for key in all_cnd_types_by_name.keys()]
+        # Check if val_names are given
+        if not val_names:
+            val_names = []
 
-        # PHASE 1: getting what to search from search_str
+        # Maybe the same query over the same data was done before?
+        cache_key = watermark = None
+        if self.result_cache is not None and runs is None and not explain:
+            cache_key = self._get_result_cache_key("values", search_str, val_names, run_min, run_max, sort_desc,
+                                                   insert_run_number)
+            watermark = range_watermark(self.session.connection(), min(run_min, run_max), max(run_min, run_max))
+            cached = self.result_cache.get(cache_key, watermark)
+            if cached is not None:
+                result_table, names, type_names = cached
+                preparation_sw.stop()
+                total_sw.stop()
+                result = RcdbSelectionResult([list(row) for row in result_table], self)
+                result.filter_condition_names = list(names)
+                result.filter_condition_types = self._get_cached_condition_types(type_names)
+                result.sort_desc = sort_desc
+                result.selected_conditions = ['run'] + val_names if insert_run_number else [] + val_names
+                result.performance["preparation"] = preparation_sw.elapsed
+                result.performance["start_time_stamp"] = start_time_stamp
+                result.performance["total"] = total_sw.elapsed
+                result.performance["cached"] = True
+                return result
+
+        run_set = self._make_run_set(runs)
+        try:
+            # PHASE 1 and 2: parse search_str and build the query
+            plan, mighty_query, names, val_indexes, target_cnd_types = \
+                self._build_values_query(val_names, search_str, run_min, run_max, sort_desc, run_set)
 
-        search_str = str(search_str)
-        if '__' in search_str:
-            raise QueryFormatError("Query contains restricted symbol: '__'")
+            preparation_sw.stop()
+            query_sw = StopWatchTimer()
 
-        for alias in self.aliases:
-            al_name = "@" + alias.name
-            if al_name in search_str:
-                search_str = search_str.replace(al_name, '(' + alias.expression + ')')
+            result = self.session.connection().execute(mighty_query)
 
-        search_str = search_str.replace('\n', ' ')
-        search_str = search_str.replace('\r', ' ')
+            query_sw.stop()
 
-        tokens = [token for token in lexer.tokenize(search_str)]
+            selection_sw = StopWatchTimer()
+            profile = {}
+            if explain:
+                result = self._fetch_profiled(result, profile)
 
-        target_cnd_types = []
-        names = ["run"]
-        for token in tokens:
-            if token.type in lexer.rcdb_query_restricted:
-                raise QueryFormatError("Query contains restricted symbol: '{}'".format(token.value))
+            # PHASE 3: Selecting runs
+            result_table = []
 
-            if token.type != "NAME":
-                continue
+            for values in self._select_values_rows(plan, result, vectorized):
+                run = values[0]
+                result_row = [run] if insert_run_number else []
+                for i in val_indexes:
+                    val = values[i]
+                    result_row.append(val)
+                result_table.append(result_row)
 
-            if token.value == 'math':
-                continue
+            selection_sw.stop()
 
-            if token.value == 'startswith':
-                continue
+            if explain:
+                profile["explain"] = explain_query(self.session.connection(), mighty_query)
+        finally:
+            if run_set is not None:
+                run_set.close()
 
-            if token.value not in all_cnd_names:
-                message = "Name '{}' is not found in ConditionTypes".format(token.value)
-                raise QueryFormatError(message)
-            else:
-                cnd_name = token.value
-                if cnd_name not in names:
-                    cnd_type = all_cnd_types_by_name[token.value]
-                    isinstance(cnd_type, ConditionType)
+        if cache_key is not None:
+            self.result_cache.put(cache_key, watermark,
+                                  ([list(row) for row in result_table], names,
+                                   [cnd_type.name for cnd_type in target_cnd_types]))
+
+        total_sw.stop()
+        result = RcdbSelectionResult(result_table, self)
+        result.filter_condition_names = names
+        result.filter_condition_types = target_cnd_types
+        result.sort_desc = sort_desc
+        result.selected_conditions = ['run'] + val_names if insert_run_number else [] + val_names
+        result.performance["preparation"] = preparation_sw.elapsed
+        result.performance["query"] = query_sw.elapsed
+        result.performance["selection"] = selection_sw.elapsed
+        result.performance["start_time_stamp"] = start_time_stamp
+        result.performance["total"] = total_sw.elapsed
 
-                    target_cnd_types.append(cnd_type)
+        if explain:
+            result.explain = profile.pop("explain")
+            profile["eval"] = selection_sw.elapsed - profile["fetch"]
+            profile["selected_rows"] = len(result_table)
+            result.performance.update(profile)
 
-                    token.value = "values[{}]".format(len(names))
-                    names.append(cnd_name)
-                else:
-                    # we already has such name. We have to set token.value right
-                    token.value = "values[{}]".format(names.index(cnd_name))  # +1 because run_num is alwais 0
+        return result
 
-        # result values table
-        val_indexes = []
+    # ------------------------------------------------
+    # Result cache
+    # ------------------------------------------------
+    def enable_result_cache(self, max_size=256, path=None):
+        """ Turns on the cache of select_values and select_runs results. See rcdb.result_cache
+
+        A cached result is returned while conditions and runs of its run range are not changed
+
+        :param max_size: maximum number of results kept in memory
+        :param path: SQLite file to keep results on disk too (it can be shared by processes). None - memory only
+        :return: ResultCache (the same as db.result_cache)
+        """
+        if self.result_cache is None:
+            self.result_cache = ResultCache(max_size, path)
+        return self.result_cache
+
+    def disable_result_cache(self):
+        """Turns off the result cache"""
+        if self.result_cache is not None:
+            self.result_cache.close()
+            self.result_cache = None
+
+    def _get_result_cache_key(self, kind, search_str, val_names, run_min, run_max, sort_desc, insert_run_number):
+        """Key of a select_values or select_runs result in the result cache"""
+        search_str = str(search_str or "").replace('\n', ' ').replace('\r', ' ').strip()
+        aliases_key = tuple((alias.name, alias.expression) for alias in self.aliases)
+        return (self._connection_string, kind, search_str, tuple(val_names), min(run_min, run_max),
+                max(run_min, run_max), bool(sort_desc), bool(insert_run_number), aliases_key,
+                self.is_text_case_sensitive)
+
+    def _get_cached_condition_types(self, type_names):
+        cnd_types_by_name = self.get_condition_types_by_name()
+        return [cnd_types_by_name[name] for name in type_names]
+
+    @staticmethod
+    def _fetch_profiled(result, profile):
+        """ Fetches all rows of the result measuring the time. So fetching and python selection are measured apart
+
+        :param profile: dict to put "fetch" time and "fetched_rows" count
+        :return: list of rows
+        """
+        fetch_sw = StopWatchTimer()
+        rows = result.fetchall()
+        fetch_sw.stop()
+        profile["fetch"] = fetch_sw.elapsed
+        profile["fetched_rows"] = len(rows)
+        return rows
+
+    def select_values_iter(self, val_names=None, search_str="", run_min=0, run_max=sys.maxsize, sort_desc=False,
+                           insert_run_number=True, runs=None, vectorized=False, chunk_size=1000):
+        """ The same as select_values but yields result rows as they come from the database
+
+        The query is executed with a server side cursor (where the database driver supports it) and rows
+        are fetched and filtered by chunks. So the memory doesn't grow with the size of the run range.
+        Don't run other queries with this provider until the iteration is finished.
+
+        Example:
+            for row in db.select_values_iter(['event_count', 'beam_current'], "@is_production"):
+                print(row)
+
+        :param val_names: list of conditions names to select
+        :param sort_desc: if True result runs will by sorted descendant by run_number, ascendant if False
+        :param run_min: minimum run to search
+        :param run_max: maximum run to search
+        :param runs: May be a list of runs to search from. In this case run_min and run_max are not used
+        :param insert_run_number: If True the first column of the result will be a run number
+        :param vectorized: If True, chunks are filtered with numpy (see select_values)
+        :param chunk_size: number of rows fetched from the database at once
+        :param search_str: Search pattern
+        :type search_str: str
+        :return: generator of result rows
+        """
+        if vectorized and vector_eval is None:
+            raise ImportError("numpy is required for select_values_iter(..., vectorized=True)")
 
-        # Check if val_names are given
         if not val_names:
             val_names = []
 
+        run_set = self._make_run_set(runs)
+        try:
+            plan, mighty_query, names, val_indexes, target_cnd_types = \
+                self._build_values_query(val_names, search_str, run_min, run_max, sort_desc, run_set)
+        except Exception:
+            if run_set is not None:
+                run_set.close()
+            raise
+
+        return self._iter_values_rows(plan, mighty_query, val_indexes, insert_run_number, vectorized, chunk_size,
+                                      run_set)
+
+    def _iter_values_rows(self, plan, mighty_query, val_indexes, insert_run_number, vectorized, chunk_size,
+                          run_set):
+        """Generator for select_values_iter. Is separated so that query errors are raised on the call"""
+
+        result = None
+        try:
+            result = self.session.connection().execute(mighty_query.execution_options(stream_results=True))
+            while True:
+                chunk = result.fetchmany(chunk_size)
+                if not chunk:
+                    break
+
+                for values in self._select_values_rows(plan, chunk, vectorized):
+                    result_row = [values[0]] if insert_run_number else []
+                    for i in val_indexes:
+                        result_row.append(values[i])
+                    yield result_row
+        finally:
+            if result is not None:
+                result.close()
+            if run_set is not None:
+                run_set.close()
+
+    def _make_run_set(self, runs):
+        """ Creates RunSet to filter queries by the list of runs
+
+        :param runs: list of Run objects or run numbers or None
+        :return: rcdb.run_set.RunSet or None if runs is empty
+        """
+        if not runs:
+            return None
+        numbers = [run.number if isinstance(run, Run) else int(run) for run in runs]
+        return RunSet(self.session.connection(), numbers)
+
+    def _build_values_query(self, val_names, search_str, run_min, run_max, sort_desc, run_set, require_all=False):
+        """ Builds SQL query for select_values and select_runs
+
+        If require_all is False, runs are selected even if they don't have some conditions (the value is None).
+        If True, only runs that have all the conditions are selected
+
+        :return: (plan, query, names, val_indexes, target_cnd_types). names are names of the query columns,
+                 val_indexes are indexes of val_names columns
+        """
+        if run_min > run_max:
+            run_min, run_max = run_max, run_min
+
+        # get all condition types
+        all_cnd_types_by_name = self.get_condition_types_by_name()
+
+        # PHASE 1: getting what to search from search_str
+        plan = self.get_search_plan(search_str)
+        target_cnd_types = plan.get_cnd_types(all_cnd_types_by_name)
+        names = ["run"] + plan.names
+        value_tables = list(plan.value_tables)
+
+        # result values table
+        val_indexes = []
+
+        conditions_table = Condition.__table__
         for name in val_names:
             if name in names:
                 val_indexes.append(names.index(name))
             else:
                 cnd_type = all_cnd_types_by_name[name]
                 target_cnd_types.append(cnd_type)
+                value_tables.append(conditions_table.alias(name + "_table"))
                 val_indexes.append(len(names))
                 names.append(name)
 
         # PHASE 2: Database query
-        query = self.session.query()
+        runs_table = Run.__table__
 
         # do we have a list of runs?
-        if runs:
-            runs = [run.number if isinstance(run, Run) else int(run) for run in runs]
-            where_clause = " WHERE runs.number in ({})".format(','.join([str(run) for run in runs]))
+        if run_set is not None:
+            where_clause = run_set.filter(runs_table.c.number)
         else:
-            where_clause = " WHERE runs.number >= :run_min AND runs.number <=:run_max"
+            where_clause = and_(runs_table.c.number >= run_min, runs_table.c.number <= run_max)
+
+        # use the pivot table if possible
+        pivot_columns = None if require_all else self._get_pivot_columns(target_cnd_types)
+        if pivot_columns is not None:
+            return plan, self._build_pivot_query(plan, pivot_columns, target_cnd_types, where_clause, sort_desc), \
+                names, val_indexes, target_cnd_types
 
         # build query
-        query = "SELECT  runs.number run" + os.linesep
-        query_joins = " FROM runs " + os.linesep
-        for ct in target_cnd_types:
+        columns = [runs_table.c.number.label("run")]
+        joins = runs_table
+        for ct, cnd_table in zip(target_cnd_types, value_tables):
             assert isinstance(ct, ConditionType)
-            table_name = ct.name + "_table"
-            value_str = "  ,{}.{} {}{}".format(table_name, ct.get_value_field_name(), ct.name, os.linesep)
-            if not value_str in query:
-                query += value_str  # safe for duplicate entries which trigger DB errors
+            value_column = getattr(cnd_table.c, ct.get_value_field_name())
+            columns.append(value_column.label(ct.name))
 
             # Now joins region
-            join_str = "  LEFT JOIN conditions {0} " \
-                       "  ON {0}.run_number = runs.number AND {0}.condition_type_id = {1}{2}" \
-                .format(table_name, ct.id, os.linesep)
+            on_clause = and_(cnd_table.c.run_number == runs_table.c.number, cnd_table.c.condition_type_id == ct.id)
+            if require_all:
+                joins = joins.join(cnd_table, on_clause)
+            else:
+                joins = joins.outerjoin(cnd_table, on_clause)
 
-            if join_str not in query_joins:
-                query_joins += join_str  # safe for duplicate entries which trigger DB errors
+        # Let the database do as much filtering as possible
+        if plan.sql_filter is not None:
+            where_clause = and_(where_clause, plan.sql_filter)
 
-        mighty_query = query + os.linesep \
-                       + query_joins + os.linesep \
-                       + where_clause
+        mighty_query = select(columns).select_from(joins).where(where_clause)
 
         if not sort_desc:
-            mighty_query = mighty_query + os.linesep + "ORDER BY runs.number"
+            mighty_query = mighty_query.order_by(runs_table.c.number)
         else:
-            mighty_query = mighty_query + os.linesep + "ORDER BY runs.number DESC"
+            mighty_query = mighty_query.order_by(desc(runs_table.c.number))
 
-        preparation_sw.stop()
-        query_sw = StopWatchTimer()
+        return plan, mighty_query, names, val_indexes, target_cnd_types
 
-        sql = text(mighty_query)
-        if runs:
-            result = self.session.connection().execute(sql)  # runs are already in query
-        else:
-            result = self.session.connection().execute(sql, run_max=run_max, run_min=run_min)
+    def _build_pivot_query(self, plan, pivot_columns, target_cnd_types, where_clause, sort_desc):
+        """The same as query of _build_values_query but selects values from the pivot table"""
+        runs_table = Run.__table__
+        pivot_table = pivot_columns[0].table
 
-        query_sw.stop()
+        columns = [runs_table.c.number.label("run")]
+        columns.extend(column.label(ct.name) for column, ct in zip(pivot_columns, target_cnd_types))
+        joins = runs_table.outerjoin(pivot_table, pivot_table.c.run_number == runs_table.c.number)
 
-        search_eval = " ".join([token.value for token in tokens if isinstance(token, LexToken)])
+        # The search filter for pivot columns
+        sql_columns = {name: (column, ct) for name, column, ct in zip(plan.names, pivot_columns, target_cnd_types)}
+        sql_filter, _ = query_compiler.to_sql_filter(plan.search_tree, sql_columns, self.is_text_case_sensitive)
+        if sql_filter is not None:
+            where_clause = and_(where_clause, sql_filter)
 
-        selection_sw = StopWatchTimer()
+        query = select(columns).select_from(joins).where(where_clause)
+        if not sort_desc:
+            return query.order_by(runs_table.c.number)
+        return query.order_by(desc(runs_table.c.number))
 
-        # PHASE 3: Selecting runs
-        if search_eval:
-            # did user set search string at all?
-            compiled_search_eval = compile(search_eval, '<string>', 'eval')
-        else:
-            compiled_search_eval = None
+    def _select_values_rows(self, plan, rows, vectorized):
+        """Yields rows that pass the part of the search which is not done by the database"""
 
-        result_table = []
+        compiled_search_eval = plan.compiled_search_eval
 
-        for values in result:
-            run = values[0]
-            if not search_eval or eval(compiled_search_eval):
-                result_row = [run] if insert_run_number else []
-                for i in val_indexes:
-                    val = values[i]
-                    result_row.append(val)
-                result_table.append(result_row)
-
-        selection_sw.stop()
-        total_sw.stop()
-        result = RcdbSelectionResult(result_table, self)
-        result.filter_condition_names = names
-        result.filter_condition_types = target_cnd_types
-        result.sort_desc = sort_desc
-        result.selected_conditions = ['run'] + val_names if insert_run_number else [] + val_names
-        result.performance["preparation"] = preparation_sw.elapsed
-        result.performance["query"] = query_sw.elapsed
-        result.performance["selection"] = selection_sw.elapsed
-        result.performance["start_time_stamp"] = start_time_stamp
-        result.performance["total"] = total_sw.elapsed
+        if compiled_search_eval is not None and vectorized:
+            rows = list(rows)
+            try:
+                cnd_types = plan.get_cnd_types(self.get_condition_types_by_name())
+                selected = vector_eval.evaluate(plan.search_tree, rows, plan.names, cnd_types, index_offset=1)
+                rows = [values for values, is_selected in zip(rows, selected) if is_selected]
+                compiled_search_eval = None
+            except vector_eval.NotVectorizable:
+                log.debug("Search can't be vectorized. Using python eval")
 
-        return result
+        for values in rows:
+            if compiled_search_eval is None or eval(compiled_search_eval):
+                yield values
 
 
 class RcdbSelectionResult(MutableSequence):
@@ -991,6 +1828,7 @@ class RcdbSelectionResult(MutableSequence):
         self.selected_conditions = []
         self.db = db
         self.sort_desc = False
+        self.explain = None    # SQL and the query plan if select function was called with explain=True
 
         js_now = int(mktime(datetime.datetime.now().timetuple()) * 1000)
         self.performance = {"preparation": 0,
@@ -1044,6 +1882,7 @@ class RunSelectionResult(RcdbSelectionResult):
         self.selected_conditions = []
         self.db = db
         self.sort_desc = False
+        self.explain = None    # SQL and the query plan if select function was called with explain=True
 
         js_now = int(mktime(datetime.datetime.now().timetuple()) * 1000)
         self.performance = {"preparation": 0,
@@ -1102,115 +1941,132 @@ class RunSelectionResult(RcdbSelectionResult):
                 # noinspection PyUnusedLocal
                 return [[] for run in self.runs]
 
-        target_cnd_names = condition_names
-
         sw = StopWatchTimer()
 
-        all_cnt_types = self.db.get_condition_types()
-        all_cnd_types_by_name = {cnd.name: cnd for cnd in all_cnt_types}
-
-        # getting target conditions types and sorting them by id
-        target_cnd_types = [all_cnd_types_by_name[cnd_name] for cnd_name in target_cnd_names]
-        ct_id_to_user_defined_order = {}
-        for cnd_type in target_cnd_types:
-            for i in range(0, len(condition_names)):
-                if cnd_type.name == condition_names[i]:
-                    ct_id_to_user_defined_order[cnd_type.id] = i
-                    break
-
-        target_cnd_types = sorted(target_cnd_types, key=lambda x: x.id)
-        target_cnd_types_len = len(target_cnd_types)
-
-        ids = [ct.id for ct in target_cnd_types]
-
-        runs_asc = self.runs if not self.sort_desc else list(reversed(self.runs))
-
-        run_numbers = [r.number for r in runs_asc]
-
-        query = self.db.session.query(Condition) \
-            .filter(Condition.condition_type_id.in_(ids), Condition.run_number.in_(run_numbers)) \
-            .order_by(Condition.run_number, Condition.condition_type_id)
-
-        conditions = query.all()
+        all_cnd_types_by_name = self.db.get_condition_types_by_name()
+        target_cnd_types = [all_cnd_types_by_name[cnd_name] for cnd_name in condition_names]
+
+        # Result columns of each condition type. Group types by the value column they are stored in
+        columns_by_type_id = {}
+        type_ids_by_field = {}
+        for column_index, cnd_type in enumerate(target_cnd_types):
+            columns_by_type_id.setdefault(cnd_type.id, []).append(column_index)
+            type_ids = type_ids_by_field.setdefault(cnd_type.get_value_field_name(), [])
+            if cnd_type.id not in type_ids:
+                type_ids.append(cnd_type.id)
+
+        # Preallocated columns of values. Runs are kept in the order of self.runs
+        run_numbers = [r.number for r in self.runs]
+        row_indexes_by_run = {}
+        for i, run_number in enumerate(run_numbers):
+            row_indexes_by_run.setdefault(run_number, []).append(i)   # the same run may be in self.runs twice
+        columns = [[None] * len(run_numbers) for _ in target_cnd_types]
+
+        # Select only (run_number, condition_type_id, value) without ORM objects
+        conditions_table = Condition.__table__
+        connection = self.db.session.connection()
+        with RunSet(connection, run_numbers) as run_set:
+            for field_name, type_ids in type_ids_by_field.items():
+                query = select([conditions_table.c.run_number,
+                                conditions_table.c.condition_type_id,
+                                getattr(conditions_table.c, field_name)]) \
+                    .where(and_(conditions_table.c.condition_type_id.in_(type_ids),
+                                run_set.filter(conditions_table.c.run_number)))
+
+                for run_number, type_id, value in connection.execute(query):
+                    row_indexes = row_indexes_by_run[run_number]
+                    for column_index in columns_by_type_id[type_id]:
+                        column = columns[column_index]
+                        for row_index in row_indexes:
+                            column[row_index] = value
 
         # performance measurement
         sw.stop()
         self.performance["get_conditions"] = sw.elapsed
         sw = StopWatchTimer()
 
-        # create empty rows
-        rows = []
-
-        def get_empty_row(run_number=0):
-            """Creates empty rows properly
-            :param run_number: run number to add
-            """
-            if insert_run_number:
-                # noinspection PyTypeChecker
-                return [run_number] + ([None] * target_cnd_types_len)
-            else:
-                return [None] * target_cnd_types_len
+        if insert_run_number:
+            rows = [list(row) for row in zip(run_numbers, *columns)]
+        else:
+            rows = [list(row) for row in zip(*columns)]
 
-        type_index = 0
-        prev_run = conditions[0].run_number
+        # performance measure
+        sw.stop()
+        self.performance["tabling_values"] = sw.elapsed
 
-        row = get_empty_row(runs_asc[0].number)
-        run_index = 0
+        return rows
 
-        while runs_asc[run_index].number != prev_run:
-            rows.append(row)
-            run_index += 1
-            row = get_empty_row(runs_asc[run_index].number)
 
-        for condition in conditions:
-            assert isinstance(condition, Condition)
+class ConfigurationProvider(RCDBProvider):
+    """
+    RCDB data provider that uses SQLAlchemy for accessing databases
+    """
 
-            type_id = condition.condition_type_id
-            if condition.run_number != prev_run:
-                prev_run = condition.run_number
+    def __init__(self, connection_string=None, user_name="", check_version=True):
+        self.write_behind = None
+        """:type: WriteBehindQueue"""
+        self.file_compression = rcdb.file_archiver.DEFAULT_COMPRESSION
+        """Compression of new configuration files content: 'zlib', 'lzma' or 'none'"""
+        super(ConfigurationProvider, self).__init__(connection_string, user_name, check_version)
 
-                while runs_asc[run_index].number != prev_run:
-                    rows.append(row)
-                    run_index += 1
-                    row = get_empty_row(runs_asc[run_index].number)
+    # ------------------------------------------------
+    # Write-behind mode
+    # ------------------------------------------------
+    def enable_write_behind(self, interval=5.0, flush_size=500, max_size=10000, spill_path=None):
+        """ Turns on write-behind mode: upsert_conditions puts values to the queue
+        that is written to the database by a background thread. See rcdb.write_behind
+
+        :param interval: seconds between flushes
+        :param flush_size: the queue is flushed before the interval, if this number of values are waiting
+        :param max_size: maximum number of values in the queue
+        :param spill_path: the file to save values to, if the database is unreachable
+        :return: WriteBehindQueue (the same as db.write_behind)
+        """
+        if self.write_behind is not None:
+            return self.write_behind
 
-                type_index = 0
+        writer = self.clone()     # the thread has its own session
 
-            while type_index < target_cnd_types_len and type_id != target_cnd_types[type_index].id:
-                type_index += 1
-                if type_index == target_cnd_types_len:
-                    type_index = 0
+        def write(values_by_run):
+            ct_dict = writer.get_condition_types_by_name()
+            writer.upsert_conditions({run_number: [(ct_dict.get(name) or writer.get_condition_type(name), value)
+                                                   for name, value in key_values]
+                                      for run_number, key_values in values_by_run.items()})
 
-            cell_index = ct_id_to_user_defined_order[target_cnd_types[type_index].id]
-            if insert_run_number:
-                row[cell_index + 1] = condition.value
-            else:
-                row[cell_index] = condition.value
+        self.write_behind = WriteBehindQueue(write, interval, flush_size, max_size, spill_path)
+        self.write_behind.start()
+        return self.write_behind
 
-        # We have always have to
-        rows.append(row)
-        run_index += 1
+    def disable_write_behind(self):
+        """ Stops the background thread and writes the queued values
 
-        # It may happen that we run out of selected conditions, because condition is not set for all runs after
-        # for example we have run=> condition   1=>x, 2=>y, 3=>None, 4=>None. DB will select only x and y conditions
-        # and 2 rows [[1],[2]], while it should [[1],[2],[None],[None]]. So we have to put missing rows in the end
-        while run_index < len(runs_asc):
-            rows.append(get_empty_row(runs_asc[run_index].number))
-            run_index += 1
+        :return: True if values are written, False if the database is unreachable (see WriteBehindQueue.flush)
+        """
+        if self.write_behind is None:
+            return True
+        try:
+            return self.write_behind.close()
+        finally:
+            self.write_behind = None
 
-        # performance measure
-        sw.stop()
-        self.performance["tabling_values"] = sw.elapsed
+    def upsert_conditions(self, values_by_run):
+        """ Adds or replaces conditions values of many runs. See RCDBProvider.upsert_conditions
 
-        if self.sort_desc:
-            rows.reverse()
-        return rows
+        In write-behind mode values are validated, put to the queue and written later by the background thread
+        """
+        if self.write_behind is None:
+            return super(ConfigurationProvider, self).upsert_conditions(values_by_run)
 
+        for run, key_values in values_by_run.items():
+            run_number = run.number if isinstance(run, Run) else int(run)
+            for key, value in (key_values.items() if isinstance(key_values, dict) else key_values):
+                ct = key if isinstance(key, ConditionType) else self.get_condition_type(key)
+                self.write_behind.put(run_number, ct.name, ct.convert_value(value))
 
-class ConfigurationProvider(RCDBProvider):
-    """
-    RCDB data provider that uses SQLAlchemy for accessing databases
-    """
+    def disconnect(self):
+        """Writes values of write-behind queue and closes connection to database"""
+        self.disable_write_behind()
+        super(ConfigurationProvider, self).disconnect()
 
     # ------------------------------------------------
     #
@@ -1230,7 +2086,7 @@ class ConfigurationProvider(RCDBProvider):
         log.debug(Lf("Setting start time '{}' to run '{}'", dtm, run.number))
 
         run.start_time = dtm
-        self.session.commit()
+        self._commit()
 
     # ------------------------------------------------
     #
@@ -1247,7 +2103,7 @@ class ConfigurationProvider(RCDBProvider):
 
         log.debug(Lf("Setting end time '{}' to run '{}'", dtm, run.number))
         run.end_time = dtm
-        self.session.commit()
+        self._commit()
 
     # ------------------------------------------------
     #
@@ -1262,21 +2118,19 @@ class ConfigurationProvider(RCDBProvider):
         :param run: Run number
         """
 
-        def get_content():
-            if content:
-                return content
-            with open(path) as io_file:
-                return io_file.read()
-
         log.debug("Processing configuration file")
 
         if content is None:
             log.debug(Lf("|- Content is None, assuming using file '{}'", path))
-            check_sum = rcdb.file_archiver.get_file_sha256(path)
+            # The file is read and hashed in one pass
+            content, check_sum = rcdb.file_archiver.read_file_sha256(path)
         else:
             log.debug(Lf("|- Content is NOT none, using it to put to DB", path))
             check_sum = rcdb.file_archiver.get_string_sha256(content)
 
+        def get_content():
+            return content
+
         if not isinstance(run, Run):  # run is given as run number not Run object
             run = self.create_run(run)
 
@@ -1287,64 +2141,258 @@ class ConfigurationProvider(RCDBProvider):
                 .filter(ConfigurationFile.runs.contains(run)) \
                 .filter(ConfigurationFile.path == path) \
                 .order_by(desc(ConfigurationFile.id))  # we want latest
-            if query.count():
+            conf_file = query.first()
+            if conf_file is not None:
                 # There are file to overwrite!
-                conf_file = query.first()
+                self._get_or_create_blob(check_sum, get_content)
                 conf_file.sha256 = check_sum
                 conf_file.path = path
-                conf_file.content = get_content()
+                conf_file.content = None     # content is in the blob
                 conf_file.importance = importance
                 log.debug(Lf("|- File '{}' is getting overwritten", path))
 
-                self.session.commit()
+                self._commit()
                 return conf_file
 
         # Overwrite = false or is not possible
         # Look, do we have a file with such name and checksumm?
-        file_query = self.session.query(ConfigurationFile) \
-            .filter(ConfigurationFile.sha256 == check_sum, ConfigurationFile.path == path)
+        conf_file = self.session.query(ConfigurationFile) \
+            .filter(ConfigurationFile.sha256 == check_sum, ConfigurationFile.path == path) \
+            .first()
 
-        if not file_query.count():
+        if conf_file is None:
             # no such file found!
             log.debug(Lf("|- File '{}' not found in DB", path))
 
-            # create file.
+            # create file. The content is in the blob that may be already stored for other path
+            self._get_or_create_blob(check_sum, get_content)
             conf_file = ConfigurationFile()
             conf_file.sha256 = check_sum
             conf_file.path = path
-            conf_file.content = get_content()
             conf_file.importance = importance
 
-            # put it to DB and associate with run
+            # put it to DB and associate with run. Flush gives conf_file.id for the log record
             self.session.add(conf_file)
-            self.session.commit()
-
             conf_file.runs.append(run)
+            self.session.flush()
 
             # save and exit
-            self.session.commit()
-            self.add_log_record(conf_file, "File added to DB. Path: '{}'. Run: '{}'".format(path, run), run.number)
+            self.add_log_record(conf_file, "File added to DB. Path: '{}'. Run: '{}'".format(path, run), run.number,
+                                do_commit=False)
+            self._commit()
             return conf_file
 
-        # such file already exists! Get it from database
-        conf_file = file_query.first()
+        # such file already exists!
         log.debug(Lf("|- File '{}' found in DB by id: '{}'", path, conf_file.id))
 
-        # maybe... we even have this file in run conf?
-        if conf_file not in run.files:
+        # maybe... we even have this file in run conf? (checked without loading all run.files)
+        association = ConfigurationFile.runs.property.secondary
+        is_associated = self.session.query(association.c.files_id) \
+            .filter(association.c.files_id == conf_file.id, association.c.run_number == run.number) \
+            .first() is not None
+        if not is_associated:
             conf_file.runs.append(run)
             # run_conf.files.append(conf_file)
-            self.session.commit()  # save and exit
-            self.add_log_record(conf_file, "File associated. Path: '{}'. Run: '{}'".format(path, run), run.number)
+            self.add_log_record(conf_file, "File associated. Path: '{}'. Run: '{}'".format(path, run), run.number,
+                                do_commit=False)
+            self._commit()  # save and exit
         else:
             log.debug(Lf("|- File already associated with run'{}'", run))
 
         return conf_file
 
+    # ------------------------------------------------
+    # Adds many configuration files to the run
+    # ------------------------------------------------
+    def add_configuration_files(self, run, paths, importance=0, read_files=None):
+        """ Adds many configuration files to run configuration in one transaction
+
+        Does the same as add_configuration_file (without overwrite) for each path, but faster:
+        each file is read and hashed in one pass, existing (sha256, path) files are found by one query,
+        new blobs, files and run associations are inserted in one transaction
+
+        :param run: Run number or Run object
+        :param paths: Paths of files to read. Repeated paths are added once
+        :param importance: 0 - HIGH importance, 1 - LOWER importance. Is used to show in WEB interface
+        :param read_files: {path: (content, sha256)} of files that are already read by
+                           file_archiver.read_file_sha256 (e.g. by other threads). Other paths are read here
+        :return: [ConfigurationFile] in order of paths
+        """
+        paths = list(OrderedDict.fromkeys(paths))
+        if not paths:
+            return []
+
+        # Read files before the transaction is started
+        content_by_path = {}
+        sha256_by_path = {}
+        for path in paths:
+            if read_files and path in read_files:
+                content_by_path[path], sha256_by_path[path] = read_files[path]
+            else:
+                content_by_path[path], sha256_by_path[path] = rcdb.file_archiver.read_file_sha256(path)
+
+        association = ConfigurationFile.runs.property.secondary
+        with self.batch():
+            if not isinstance(run, Run):  # run is given as run number not Run object
+                run = self.create_run(run)
+
+            # Files with these paths and if they are associated with the run. Legacy content is not loaded
+            query = self.session.query(ConfigurationFile, association.c.run_number) \
+                .outerjoin(association, and_(association.c.files_id == ConfigurationFile.id,
+                                             association.c.run_number == run.number)) \
+                .filter(ConfigurationFile.path.in_(paths)) \
+                .options(sqlalchemy.orm.defer("_content"))
+
+            existing = {}    # (sha256, path) => (ConfigurationFile, is associated with the run)
+            for conf_file, run_number in query:
+                if sha256_by_path[conf_file.path] != conf_file.sha256:
+                    continue    # other content of the path
+                key = (conf_file.sha256, conf_file.path)
+                previous = existing.get(key)
+                if previous is None or (run_number is not None and not previous[1]):
+                    existing[key] = (conf_file, run_number is not None)
+
+            # New blobs
+            new_sha256s = set(sha256 for path, sha256 in sha256_by_path.items() if (sha256, path) not in existing)
+            if new_sha256s:
+                stored_sha256s = set(row[0] for row in self.session.query(FileBlob.sha256)
+                                     .filter(FileBlob.sha256.in_(new_sha256s)))
+                blob_values = []
+                for path in paths:
+                    sha256 = sha256_by_path[path]
+                    if sha256 in new_sha256s and sha256 not in stored_sha256s:
+                        stored_sha256s.add(sha256)
+                        blob_values.append(FileBlob.make_values(sha256, content_by_path[path], self.file_compression))
+                if blob_values:
+                    self.session.connection().execute(FileBlob.__table__.insert(), blob_values)
+
+            # New files. Flush gives their ids
+            result = []
+            new_files = []
+            to_associate = []
+            for path in paths:
+                key = (sha256_by_path[path], path)
+                if key in existing:
+                    conf_file, is_associated = existing[key]
+                    if is_associated:
+                        log.debug(Lf("|- File '{}' already associated with run '{}'", path, run))
+                    else:
+                        to_associate.append(conf_file)
+                        self.add_log_record(conf_file, "File associated. Path: '{}'. Run: '{}'".format(path, run),
+                                            run.number, do_commit=False)
+                else:
+                    conf_file = ConfigurationFile()
+                    conf_file.sha256 = key[0]
+                    conf_file.path = path
+                    conf_file.importance = importance
+                    self.session.add(conf_file)
+                    new_files.append(conf_file)
+                    to_associate.append(conf_file)
+                result.append(conf_file)
+            self.session.flush()
+
+            for conf_file in new_files:
+                self.add_log_record(conf_file, "File added to DB. Path: '{}'. Run: '{}'".format(conf_file.path, run),
+                                    run.number, do_commit=False)
+
+            if to_associate:
+                self.session.connection().execute(association.insert(),
+                                                  [{"files_id": conf_file.id, "run_number": run.number}
+                                                   for conf_file in to_associate])
+                # Collections loaded before the insert are stale
+                self.session.expire(run, ["files"])
+                for conf_file in to_associate:
+                    self.session.expire(conf_file, ["runs"])
+
+        log.debug(Lf("|- {} files of run '{}' processed, {} associated", len(paths), run, len(to_associate)))
+        return result
+
+    def _get_or_create_blob(self, check_sum, get_content):
+        """Gets FileBlob by sha256 or adds a new one with compressed get_content()"""
+        blob = self.session.query(FileBlob).get(check_sum)
+        if blob is None:
+            log.debug(Lf("|- New blob '{}', compression '{}'", check_sum, self.file_compression))
+            blob = FileBlob(**FileBlob.make_values(check_sum, get_content(), self.file_compression))
+            self.session.add(blob)
+        return blob
+
+    # ------------------------------------------------
+    # Moves content of old files to blobs
+    # ------------------------------------------------
+    def migrate_configuration_files(self, compression=None, chunk_size=100):
+        """ Moves content of files added before SQL schema version 3 from files table to compressed blobs
+
+        Files with the same content (sha256) share one blob. Every chunk of files is committed,
+        so the migration may be stopped and started again
+
+        :param compression: 'zlib', 'lzma' or 'none'. Default is self.file_compression
+        :param chunk_size: number of files in one transaction
+        :return: (number of migrated files, number of created blobs)
+        """
+        if compression is None:
+            compression = self.file_compression
+
+        files_table = ConfigurationFile.__table__
+        blobs_table = FileBlob.__table__
+        migrated_count = 0
+        blobs_count = 0
+
+        while True:
+            connection = self.session.connection()
+            try:
+                rows = connection.execute(select([files_table.c.id, files_table.c.sha256, files_table.c.content])
+                                          .where(files_table.c.content != None)     # noqa: E711 SQL IS NOT NULL
+                                          .order_by(files_table.c.id)
+                                          .limit(chunk_size)).fetchall()
+                if not rows:
+                    break
+
+                sha256s = set(row[1] for row in rows)
+                existing = set(blob_row[0] for blob_row in connection.execute(
+                    select([blobs_table.c.sha256]).where(blobs_table.c.sha256.in_(sha256s))))
+
+                new_blobs = {}
+                for file_id, sha256, content in rows:
+                    if sha256 not in existing and sha256 not in new_blobs:
+                        new_blobs[sha256] = FileBlob.make_values(sha256, content, compression)
+                if new_blobs:
+                    connection.execute(blobs_table.insert(), list(new_blobs.values()))
+
+                connection.execute(files_table.update()
+                                   .where(files_table.c.id.in_([row[0] for row in rows]))
+                                   .values(content=None))
+                self.session.commit()
+            except:
+                self.session.rollback()
+                raise
+
+            migrated_count += len(rows)
+            blobs_count += len(new_blobs)
+            log.debug(Lf("Migrated {} files, created {} blobs", migrated_count, blobs_count))
+
+        self.session.expire_all()     # loaded ConfigurationFile objects have content that is None now
+        return migrated_count, blobs_count
+
+
+def _make_condition_row(run_number, cnd_type, value, created):
+    """Values of 'conditions' table row for Core insert. Not used value columns get default values"""
+    row = {"run_number": run_number,
+           "condition_type_id": cnd_type.id,
+           "created": created,
+           "text_value": None,
+           "int_value": 0,
+           "float_value": 0.0,
+           "bool_value": False,
+           "time_value": None}
+    row[cnd_type.get_value_field_name()] = value
+    return row
+
 
 def destroy_schema(db):
     assert isinstance(db, RCDBProvider)
+    db.drop_pivot()
     rcdb.model.Base.metadata.drop_all(db.engine)
+    db._invalidate_condition_types()
 
 
 def destroy_all_create_schema(db):
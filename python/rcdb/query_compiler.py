@@ -0,0 +1,637 @@
+"""
+Compiles RCDB search queries to SQL WHERE clauses
+
+A search query like "event_count > 500000 and run_type in ['hd_all.tsg']" is tokenized by rcdb.lexer.
+Here the token stream is parsed to a small expression tree which then is translated to a SQLAlchemy
+clause over the typed value columns of conditions (int_value, float_value, text_value, ...).
+
+Not everything can be expressed in SQL. Function calls (math.*, startswith), substring search
+('COSMIC' in daq_run), division and some other constructs are left for the python eval. In this case
+the translated clause is only a necessary condition: the database does preliminary filtering while the
+final selection is done by python eval of the full search query. Such translation is called 'inexact'.
+"""
+
+import ast
+import sys
+import threading
+from collections import OrderedDict
+
+from ply.lex import LexToken
+from sqlalchemy import and_, or_, not_, true, false, literal
+
+from rcdb.model import ConditionType
+
+_number_value_types = (ConditionType.INT_FIELD, ConditionType.FLOAT_FIELD, ConditionType.BOOL_FIELD)
+_text_value_types = (ConditionType.STRING_FIELD, ConditionType.JSON_FIELD, ConditionType.BLOB_FIELD)
+
+# Python 2 orders None before any number (None < 1 is True) while SQL comparisons with NULL are never true
+_none_is_orderable = sys.version_info[0] < 3
+
+NUMBER_KIND = 'number'
+TEXT_KIND = 'text'
+TIME_KIND = 'time'
+
+_number_token_types = ('FLOATNUMBER', 'DECIMALINTEGER', 'HEXINTEGER', 'OCTINTEGER', 'BININTEGER')
+_compare_token_types = {
+    'LANG': '<',
+    'RANG': '>',
+    'DEQ': '==',
+    'GEQ': '>=',
+    'LEQ': '<=',
+    'NEQ': '!=',
+    'NEQ2': '!=',
+}
+
+
+# --------------------------------------------
+# Expression tree nodes
+# --------------------------------------------
+class Name(object):
+    """Condition name"""
+    def __init__(self, name):
+        self.name = name
+
+
+class Literal(object):
+    """Number or string literal"""
+    def __init__(self, value):
+        self.value = value
+
+
+class Sequence(object):
+    """List or tuple of literals like [1, 2, 3]. Is used as the right side of 'in' """
+    def __init__(self, items):
+        self.items = items
+
+
+class BoolOp(object):
+    """'and' or 'or' of several operands"""
+    def __init__(self, op, operands):
+        self.op = op
+        self.operands = operands
+
+
+class Not(object):
+    """'not' operand"""
+    def __init__(self, operand):
+        self.operand = operand
+
+
+class Compare(object):
+    """Comparison, might be chained like 1 < a < 5. comparisons is a list of (op, right_node)"""
+    def __init__(self, left, comparisons):
+        self.left = left
+        self.comparisons = comparisons
+
+
+class BinOp(object):
+    """Arithmetic binary operation"""
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+class Neg(object):
+    """Unary minus"""
+    def __init__(self, operand):
+        self.operand = operand
+
+
+class Attribute(object):
+    """Attribute access like math.pi or daq_run.startswith"""
+    def __init__(self, value, attr):
+        self.value = value
+        self.attr = attr
+
+
+class Call(object):
+    """Function call like math.sqrt(a)"""
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+
+class Opaque(object):
+    """Part of expression that is valid, but is not understood by the compiler (subscripts, string methods, etc.)"""
+    pass
+
+
+class _UnsupportedSyntax(Exception):
+    pass
+
+
+class _NotTranslatable(Exception):
+    pass
+
+
+# --------------------------------------------
+# Parser
+# --------------------------------------------
+class _Parser(object):
+    """Recursive descent parser of the rcdb.lexer token stream. Follows python operators precedence"""
+
+    def __init__(self, tokens):
+        self.tokens = [token for token in tokens if isinstance(token, LexToken)]
+        self.pos = 0
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index].type if index < len(self.tokens) else None
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, token_type):
+        if self.peek() != token_type:
+            raise _UnsupportedSyntax()
+        return self.next()
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise _UnsupportedSyntax()
+        return node
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.next()
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else BoolOp('or', operands)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.peek() == 'AND':
+            self.next()
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else BoolOp('and', operands)
+
+    def parse_not(self):
+        if self.peek() == 'NOT':
+            self.next()
+            return Not(self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_arith()
+        comparisons = []
+        while True:
+            token_type = self.peek()
+            if token_type in _compare_token_types:
+                self.next()
+                op = _compare_token_types[token_type]
+            elif token_type == 'IN':
+                self.next()
+                op = 'in'
+            elif token_type == 'NOT' and self.peek(1) == 'IN':
+                self.next()
+                self.next()
+                op = 'not in'
+            else:
+                break
+            comparisons.append((op, self.parse_arith()))
+        return Compare(left, comparisons) if comparisons else left
+
+    def parse_arith(self):
+        node = self.parse_term()
+        while self.peek() in ('PLUS', 'MINUS'):
+            op = self.next().value
+            node = BinOp(op, node, self.parse_term())
+        return node
+
+    def parse_term(self):
+        node = self.parse_factor()
+        while self.peek() in ('STAR', 'SLASH', 'DBL_SLASH', 'MOD'):
+            op = self.next().value
+            node = BinOp(op, node, self.parse_factor())
+        return node
+
+    def parse_factor(self):
+        if self.peek() == 'MINUS':
+            self.next()
+            operand = self.parse_factor()
+            if isinstance(operand, Literal) and not isinstance(operand.value, str):
+                return Literal(-operand.value)
+            return Neg(operand)
+        if self.peek() == 'PLUS':
+            self.next()
+            return self.parse_factor()
+        return self.parse_power()
+
+    def parse_power(self):
+        node = self.parse_atom()
+        if self.peek() == 'DBL_STAR':
+            self.next()
+            node = BinOp('**', node, self.parse_factor())
+        return node
+
+    def parse_atom(self):
+        token_type = self.peek()
+
+        if token_type == 'NAME':
+            node = Name(self.next().value)
+            while self.peek() in ('DOT', 'LPAREN', 'LSQ'):
+                trailer_type = self.peek()
+                if trailer_type == 'DOT':
+                    self.next()
+                    node = Attribute(node, self.expect('NAME').value)
+                elif trailer_type == 'LPAREN':
+                    node = Call(node, self.parse_call_arguments())
+                else:
+                    self.skip_trailer()
+                    node = Opaque()
+            return node
+
+        if token_type in _number_token_types:
+            try:
+                return Literal(ast.literal_eval(self.next().value))
+            except (ValueError, SyntaxError):
+                raise _UnsupportedSyntax()
+
+        if token_type == 'STRINGLITERAL':
+            value = ''
+            while self.peek() == 'STRINGLITERAL':
+                try:
+                    part = ast.literal_eval(self.next().value)
+                except (ValueError, SyntaxError):
+                    raise _UnsupportedSyntax()
+                if not isinstance(part, str):
+                    raise _UnsupportedSyntax()  # bytes or python 2 unicode
+                value += part
+            if self.peek() in ('DOT', 'LSQ'):
+                while self.peek() in ('DOT', 'LPAREN', 'LSQ'):
+                    self.skip_trailer()
+                return Opaque()
+            return Literal(value)
+
+        if token_type == 'LPAREN':
+            self.next()
+            if self.peek() == 'RPAREN':
+                self.next()
+                return Sequence([])
+            items = [self.parse_or()]
+            is_tuple = False
+            while self.peek() == 'COMMA':
+                self.next()
+                is_tuple = True
+                if self.peek() == 'RPAREN':
+                    break
+                items.append(self.parse_or())
+            self.expect('RPAREN')
+            return Sequence(items) if is_tuple else items[0]
+
+        if token_type == 'LSQ':
+            self.next()
+            items = []
+            while self.peek() != 'RSQ':
+                items.append(self.parse_or())
+                if self.peek() != 'COMMA':
+                    break
+                self.next()
+            self.expect('RSQ')
+            return Sequence(items)
+
+        raise _UnsupportedSyntax()
+
+    def parse_call_arguments(self):
+        """Parses (arg1, arg2, ...) of a function call"""
+        self.expect('LPAREN')
+        args = []
+        while self.peek() != 'RPAREN':
+            args.append(self.parse_or())
+            if self.peek() != 'COMMA':
+                break
+            self.next()
+        self.expect('RPAREN')
+        return args
+
+    def skip_trailer(self):
+        """Skips .name, (...) or [...] after an atom"""
+        token_type = self.next().type
+        if token_type == 'DOT':
+            self.expect('NAME')
+            return
+
+        closing = 'RPAREN' if token_type == 'LPAREN' else 'RSQ'
+        depth = 1
+        while depth:
+            if self.peek() is None:
+                raise _UnsupportedSyntax()
+            inner_type = self.next().type
+            if inner_type in ('LPAREN', 'LSQ'):
+                depth += 1
+            elif inner_type in ('RPAREN', 'RSQ'):
+                depth -= 1
+        if inner_type != closing:
+            raise _UnsupportedSyntax()
+
+
+def parse(tokens):
+    """ Parses tokens of rcdb.lexer to an expression tree
+
+    :param tokens: tokens got from rcdb.lexer.tokenize
+    :return: root node of expression tree or None if the expression contains syntax the compiler doesn't support
+    """
+    try:
+        return _Parser(tokens).parse()
+    except _UnsupportedSyntax:
+        return None
+
+
+# --------------------------------------------
+# SQL translation
+# --------------------------------------------
+class _SqlTranslator(object):
+    """Translates expression tree to SQLAlchemy clauses
+
+    Every generated predicate is two-valued (never NULL) and mimics python semantic of None values:
+    None == x is False, None != x is True and operations like None > x (which raise in python)
+    exclude the run
+    """
+
+    def __init__(self, columns, case_sensitive_text):
+        self.columns = columns
+        self.case_sensitive_text = case_sensitive_text
+
+    def kind_of(self, value_type):
+        if value_type in _number_value_types:
+            return NUMBER_KIND
+        if value_type in _text_value_types:
+            return TEXT_KIND
+        return TIME_KIND
+
+    def operand(self, node):
+        """Translates value expression. Returns (sql_expression, kind, [used columns])"""
+
+        if isinstance(node, Name):
+            if node.name not in self.columns:
+                raise _NotTranslatable()
+            column, cnd_type = self.columns[node.name]
+            return column, self.kind_of(cnd_type.value_type), [column]
+
+        if isinstance(node, Literal):
+            if isinstance(node.value, bool):
+                raise _NotTranslatable()
+            kind = TEXT_KIND if isinstance(node.value, str) else NUMBER_KIND
+            return literal(node.value), kind, []
+
+        if isinstance(node, Neg):
+            expression, kind, used_columns = self.operand(node.operand)
+            if kind != NUMBER_KIND:
+                raise _NotTranslatable()
+            return -expression, kind, used_columns
+
+        if isinstance(node, BinOp) and node.op in ('+', '-', '*'):
+            # Division is not translated as SQL integer division differs from python one
+            left, left_kind, left_columns = self.operand(node.left)
+            right, right_kind, right_columns = self.operand(node.right)
+            if left_kind != NUMBER_KIND or right_kind != NUMBER_KIND:
+                raise _NotTranslatable()
+            if node.op == '+':
+                expression = left + right
+            elif node.op == '-':
+                expression = left - right
+            else:
+                expression = left * right
+            return expression, NUMBER_KIND, left_columns + right_columns
+
+        raise _NotTranslatable()
+
+    def compare(self, left_node, op, right_node):
+        """Translates one comparison. Returns (clause, is_exact)"""
+
+        if op in ('in', 'not in'):
+            return self.compare_in(left_node, op, right_node)
+
+        left, left_kind, left_columns = self.operand(left_node)
+        right, right_kind, right_columns = self.operand(right_node)
+        if left_kind != right_kind or left_kind == TIME_KIND:
+            raise _NotTranslatable()
+
+        is_text = left_kind == TEXT_KIND
+        used_columns = left_columns + right_columns
+        not_null = [column.isnot(None) for column in used_columns]
+
+        if op in ('<', '>', '<=', '>='):
+            if is_text:
+                raise _NotTranslatable()   # Collations make string ordering database dependent
+            if op == '<':
+                clause = left < right
+            elif op == '>':
+                clause = left > right
+            elif op == '<=':
+                clause = left <= right
+            else:
+                clause = left >= right
+            name_columns = [column for node, column in ((left_node, left), (right_node, right))
+                            if isinstance(node, Name)]
+            if _none_is_orderable and name_columns:
+                # Keep runs where a compared condition is None for python eval to decide
+                other_not_null = [column.isnot(None) for column in used_columns
+                                  if not any(column is name_column for name_column in name_columns)]
+                clause = or_(*([column.is_(None) for column in name_columns] + [clause]))
+                return and_(*(other_not_null + [clause])), False
+            return and_(*(not_null + [clause])), True
+
+        if op == '==':
+            # Case insensitive databases select more rows than python would. It is still a valid prefilter
+            is_exact = not is_text or self.case_sensitive_text
+            clause = and_(*(not_null + [left == right]))
+            if isinstance(left_node, Name) and isinstance(right_node, Name):
+                # None == None is True in python
+                clause = or_(and_(left.is_(None), right.is_(None)), clause)
+            return clause, is_exact
+
+        # op == '!='
+        if is_text and not self.case_sensitive_text:
+            raise _NotTranslatable()
+        if isinstance(left_node, Name) and isinstance(right_node, Literal):
+            return or_(left.is_(None), left != right), True
+        if isinstance(right_node, Name) and isinstance(left_node, Literal):
+            return or_(right.is_(None), left != right), True
+        if isinstance(left_node, Name) or isinstance(right_node, Name):
+            raise _NotTranslatable()       # None != None is False in python. Don't go there
+        return and_(*(not_null + [left != right])), True
+
+    def compare_in(self, left_node, op, right_node):
+        if not isinstance(right_node, Sequence):
+            raise _NotTranslatable()       # 'abc' in text_condition is substring search
+
+        left, kind, used_columns = self.operand(left_node)
+        if kind == TIME_KIND:
+            raise _NotTranslatable()
+
+        values = []
+        for item in right_node.items:
+            if not isinstance(item, Literal) or isinstance(item.value, bool):
+                raise _NotTranslatable()
+            item_kind = TEXT_KIND if isinstance(item.value, str) else NUMBER_KIND
+            if item_kind != kind:
+                raise _NotTranslatable()
+            values.append(item.value)
+
+        is_text = kind == TEXT_KIND
+        if op == 'in':
+            if not values:
+                return false(), True
+            clause = and_(*([column.isnot(None) for column in used_columns] + [left.in_([literal(v) for v in values])]))
+            return clause, not is_text or self.case_sensitive_text
+
+        # op == 'not in'
+        if is_text and not self.case_sensitive_text:
+            raise _NotTranslatable()
+        if not values:
+            return true(), True
+        if isinstance(left_node, Name):
+            return or_(left.is_(None), left.notin_([literal(v) for v in values])), True
+        return and_(*([column.isnot(None) for column in used_columns] + [left.notin_([literal(v) for v in values])])), True
+
+    def truth(self, node):
+        """Translates python truth value testing of a value expression. Returns (clause, is_exact)"""
+        expression, kind, used_columns = self.operand(node)
+        if isinstance(node, Literal):
+            return (true() if node.value else false()), True
+
+        not_null = [column.isnot(None) for column in used_columns]
+        if kind == NUMBER_KIND:
+            return and_(*(not_null + [expression != literal(0)])), True
+        if kind == TEXT_KIND:
+            if not self.case_sensitive_text:
+                raise _NotTranslatable()  # MySQL PAD SPACE makes ' ' equal to ''
+            return and_(*(not_null + [expression != literal('')])), True
+        return and_(*not_null), True
+
+    def predicate(self, node):
+        """ Translates node as a boolean expression
+
+        :return: (clause, is_exact). clause is None if nothing could be translated
+        """
+        try:
+            if isinstance(node, BoolOp):
+                return self.bool_op(node)
+
+            if isinstance(node, Not):
+                clause, is_exact = self.predicate(node.operand)
+                if clause is None or not is_exact:
+                    return None, False
+                return not_(clause), True
+
+            if isinstance(node, Compare):
+                clauses = []
+                is_exact = True
+                left = node.left
+                for op, right in node.comparisons:
+                    clause, is_pair_exact = self.compare(left, op, right)
+                    clauses.append(clause)
+                    is_exact = is_exact and is_pair_exact
+                    left = right
+                return (clauses[0] if len(clauses) == 1 else and_(*clauses)), is_exact
+
+            return self.truth(node)
+
+        except _NotTranslatable:
+            return None, False
+
+    def bool_op(self, node):
+        clauses = []
+        is_exact = True
+        for operand in node.operands:
+            clause, is_operand_exact = self.predicate(operand)
+            if clause is None:
+                if node.op == 'or':
+                    return None, False   # one can't filter anything if any part of 'or' is unknown
+                is_exact = False         # for 'and' the rest is still a necessary condition
+                continue
+            clauses.append(clause)
+            is_exact = is_exact and is_operand_exact
+
+        if not clauses:
+            return None, False
+
+        if len(clauses) == 1:
+            return clauses[0], is_exact
+
+        return (and_(*clauses) if node.op == 'and' else or_(*clauses)), is_exact
+
+
+def to_sql_filter(tree, columns, case_sensitive_text=True):
+    """ Translates expression tree to SQLAlchemy WHERE clause
+
+    :param tree: root node returned by parse()
+    :param columns: dict {condition_name: (value_column, ConditionType)}.
+                    value_column is the appropriate int_value, float_value, ... column of the joined condition
+    :param case_sensitive_text: False if database string comparison is case insensitive (MySQL).
+                                In this case text (in)equality is not considered exact
+    :return: (clause, is_exact). clause is None if nothing could be translated to SQL.
+             If is_exact is True, the clause selects exactly the same runs as python eval of the query would
+    """
+    if tree is None:
+        return None, False
+
+    return _SqlTranslator(columns, case_sensitive_text).predicate(tree)
+
+
+# --------------------------------------------
+# Compiled query plans
+# --------------------------------------------
+class QueryPlan(object):
+    """ Everything that is derived from a search string and doesn't depend on a particular query call
+
+    Plans may be shared by providers of different sessions and threads (e.g. the web site requests),
+    so a plan keeps condition names but not ConditionType objects. They are taken by get_cnd_types from
+    the session of the provider. The plan cache key includes ids, names and value types of condition types
+
+    Attributes:
+        names - condition names used in the search string in order of appearance
+        value_tables - SQLAlchemy aliases of conditions table that hold values of the names (in the same order)
+        search_tree - parsed expression tree of the search string or None if the parser doesn't support it
+        sql_filter - SQLAlchemy WHERE clause generated from the search string or None
+        is_exact_filter - True if sql_filter does all the filtering and python eval is not needed
+        compiled_search_eval - compiled python code of the search or None if no eval is needed
+    """
+
+    def __init__(self):
+        self.names = []
+        self.value_tables = []
+        self.search_tree = None
+        self.sql_filter = None
+        self.is_exact_filter = False
+        self.compiled_search_eval = None
+
+    def get_cnd_types(self, cnd_types_by_name):
+        """ConditionType-s of the names (in the same order) from {name: ConditionType} of the provider"""
+        return [cnd_types_by_name[name] for name in self.names]
+
+
+class QueryPlanCache(object):
+    """Thread safe bounded LRU cache of QueryPlan-s"""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns cached plan for the key or None"""
+        with self._lock:
+            plan = self._plans.pop(key, None)
+            if plan is not None:
+                self._plans[key] = plan   # the most recently used goes to the end
+            return plan
+
+    def put(self, key, plan):
+        with self._lock:
+            self._plans.pop(key, None)
+            self._plans[key] = plan
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def __len__(self):
+        return len(self._plans)
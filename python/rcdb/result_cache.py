@@ -0,0 +1,148 @@
+"""
+Cache of select_values and select_runs results
+
+Most queries cover closed run periods which conditions never change. With the cache on, the result
+of a query is kept and returned again while the data of its run range is the same:
+
+    db.enable_result_cache()                                       # in memory
+    db.enable_result_cache(path="/tmp/rcdb_results.sqlite")         # + on disk, is shared between processes
+
+    db.select_values(['event_count'], "@is_production", run_min=30000, run_max=39999)   # queries the database
+    db.select_values(['event_count'], "@is_production", run_min=30000, run_max=39999)   # from the cache
+
+Results are keyed by the search string (stripped), selected columns, run range, sort order and aliases.
+Each result is saved with the watermark of its run range (see range_watermark):
+count and max(id) of conditions of the range, their max(created), the number of runs in the range and
+the number of condition types. Before a cached result is returned the watermark is selected again
+(one aggregate query over the run_number index) and compared. So writes to the current run don't
+invalidate results of older run periods, but any new, updated or deleted value of the range does.
+
+Results with run lists (select_values(..., runs=[...])) and with explain=True are not cached.
+
+The disk tier is an SQLite file with pickled results. It is used when an entry is not in memory
+(a new process, or the entry was pushed out of memory by newer ones).
+"""
+
+import hashlib
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, func, and_
+
+from rcdb.model import Condition, ConditionType, Run
+
+
+def range_watermark(connection, run_min, run_max):
+    """ Selects the watermark of conditions of the runs from run_min to run_max (inclusive)
+
+    :return: tuple that changes if a condition of the range is added, updated or deleted,
+             a run of the range is added or deleted, or a condition type is added
+    """
+    conditions = Condition.__table__
+    runs = Run.__table__
+    types = ConditionType.__table__
+
+    in_range = and_(conditions.c.run_number >= run_min, conditions.c.run_number <= run_max)
+    row = connection.execute(select([func.count(conditions.c.id),
+                                     func.max(conditions.c.id),
+                                     func.max(conditions.c.created)]).where(in_range)).first()
+
+    runs_count = connection.execute(select([func.count(runs.c.number)])
+                                    .where(and_(runs.c.number >= run_min, runs.c.number <= run_max))).scalar()
+    types_count = connection.execute(select([func.count(types.c.id)])).scalar()
+
+    return tuple(row) + (runs_count, types_count)
+
+
+class ResultCache(object):
+    """ LRU cache of query results validated by watermarks
+
+    :param max_size: maximum number of results kept in memory
+    :param path: SQLite file of the disk tier. None - memory only
+    """
+
+    def __init__(self, max_size=256, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()     # key => (watermark, value)
+        self._lock = threading.Lock()
+        self._disk = None
+        if path:
+            self._disk = sqlite3.connect(path, check_same_thread=False)
+            self._disk.execute("CREATE TABLE IF NOT EXISTS results "
+                               "(key TEXT PRIMARY KEY, watermark BLOB, value BLOB, saved REAL)")
+            self._disk.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _disk_key(key):
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    def get(self, key, watermark):
+        """ Gets the cached value if it was saved with the same watermark
+
+        :return: value or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._disk is not None:
+                entry = self._get_from_disk(key)
+                if entry is not None:
+                    self._put_to_memory(key, entry)
+
+            if entry is None or entry[0] != watermark:
+                self.misses += 1
+                return None
+
+            self._entries.pop(key)
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, watermark, value):
+        """Saves the value with the watermark of the data it was selected from"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._put_to_memory(key, (watermark, value))
+            if self._disk is not None:
+                self._disk.execute("INSERT OR REPLACE INTO results (key, watermark, value, saved) VALUES (?, ?, ?, ?)",
+                                   (self._disk_key(key),
+                                    sqlite3.Binary(pickle.dumps(watermark, pickle.HIGHEST_PROTOCOL)),
+                                    sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+                                    time.time()))
+                self._disk.commit()
+
+    def clear(self):
+        """Removes all results from memory and disk"""
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM results")
+                self._disk.commit()
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def _put_to_memory(self, key, entry):
+        self._entries[key] = entry
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_from_disk(self, key):
+        row = self._disk.execute("SELECT watermark, value FROM results WHERE key = ?",
+                                 (self._disk_key(key),)).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(bytes(row[0])), pickle.loads(bytes(row[1]))
+        except Exception:
+            return None     # written by an incompatible version
@@ -0,0 +1,89 @@
+"""
+Filtering queries by a list of run numbers
+
+A short list of runs is filtered with bound parameters: runs.number IN (?, ?, ...).
+Long lists (tens of thousands of runs) create huge SQL texts, hit SQLite variables limit and MySQL packet size.
+For them run numbers are loaded into a temporary table and queries select runs from it.
+
+The temporary table lives in the database connection (both MySQL and SQLite drop it on disconnect).
+Several run sets may be used at the same time, each set has its own set_id in the table.
+
+Usage:
+    run_set = RunSet(connection, [1, 2, 3])
+    try:
+        query = query.where(run_set.filter(runs_table.c.number))
+        ...
+    finally:
+        run_set.close()
+"""
+
+import itertools
+
+from sqlalchemy import Table, Column, Integer, MetaData, select, text, and_
+
+# Lists longer than this are loaded to the temporary table
+TEMP_TABLE_THRESHOLD = 500
+
+run_sets_table = Table("rcdb_run_sets", MetaData(),
+                       Column("set_id", Integer, primary_key=True, autoincrement=False),
+                       Column("number", Integer, primary_key=True, autoincrement=False),
+                       prefixes=["TEMPORARY"])
+
+_create_table_sql = text("CREATE TEMPORARY TABLE IF NOT EXISTS rcdb_run_sets ("
+                         "set_id INTEGER NOT NULL, "
+                         "number INTEGER NOT NULL, "
+                         "PRIMARY KEY (set_id, number))")
+
+_set_ids = itertools.count(1)
+
+
+class RunSet(object):
+    """ Set of run numbers to filter queries by
+
+    :param connection: SQLAlchemy connection the queries are executed with
+    :param run_numbers: iterable of run numbers
+    :param threshold: lists longer than threshold are loaded to the temporary table
+    """
+
+    def __init__(self, connection, run_numbers, threshold=TEMP_TABLE_THRESHOLD):
+        self.connection = connection
+        self.run_numbers = sorted(set(int(number) for number in run_numbers))
+        self.set_id = None
+
+        if len(self.run_numbers) > threshold:
+            self.set_id = next(_set_ids)
+            connection.execute(_create_table_sql)
+            connection.execute(run_sets_table.insert(),
+                               [{"set_id": self.set_id, "number": number} for number in self.run_numbers])
+
+    @property
+    def uses_temp_table(self):
+        return self.set_id is not None
+
+    def filter(self, run_number_column):
+        """ Returns where clause that selects the runs of the set
+
+        :param run_number_column: Column with run numbers like Run.number or Condition.run_number
+        """
+        if not self.run_numbers:
+            return run_number_column.in_([])   # selects nothing
+
+        if self.set_id is None:
+            return run_number_column.in_(self.run_numbers)
+
+        numbers = select([run_sets_table.c.number]).where(run_sets_table.c.set_id == self.set_id)
+        return and_(run_number_column >= self.run_numbers[0],
+                    run_number_column <= self.run_numbers[-1],
+                    run_number_column.in_(numbers))
+
+    def close(self):
+        """Removes the run numbers from the temporary table"""
+        if self.set_id is not None:
+            self.connection.execute(run_sets_table.delete().where(run_sets_table.c.set_id == self.set_id))
+            self.set_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
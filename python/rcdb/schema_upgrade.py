@@ -0,0 +1,120 @@
+"""
+Upgrades of RCDB SQL schema
+
+Each upgrade function takes the schema from version N to N+1 and records the new version in schema_versions.
+upgrade_schema applies all needed upgrades in order. Command line: 'rcdb upgrade'
+
+Versions:
+    1 - initial schema
+    2 - unique key on conditions (run_number, condition_type_id). Duplicated conditions
+        (see find_doublegainer_conditions.py) are removed, the latest value is kept
+    3 - file_blobs table with compressed content of configuration files, files.content is nullable.
+        The content of existing files stays in files table until 'rcdb migrate-files' moves it to blobs
+"""
+
+import datetime
+import logging
+
+from sqlalchemy import text, select, func, inspect
+
+from sqlalchemy.schema import CreateTable
+
+import rcdb
+from rcdb.model import Condition, SchemaVersion, ConfigurationFile, FileBlob
+from rcdb.pivot import ConditionsPivot
+from rcdb.log_format import BraceMessage as Lf
+
+log = logging.getLogger("rcdb.schema_upgrade")
+
+
+def get_schema_version(connection):
+    """Gets the latest version from schema_versions table"""
+    versions = SchemaVersion.__table__
+    return connection.execute(select([func.max(versions.c.version)])).scalar()
+
+
+def _add_schema_version(connection, version, comment):
+    connection.execute(SchemaVersion.__table__.insert().values(version=version,
+                                                               created=datetime.datetime.now(),
+                                                               comment=comment))
+
+
+def upgrade_1_to_2(connection):
+    """Adds unique key on conditions (run_number, condition_type_id) removing duplicated conditions"""
+
+    # Keep the latest condition of each (run_number, condition_type_id). The derived table is for MySQL,
+    # which doesn't allow to select from the table that is being deleted from
+    result = connection.execute(text(
+        "DELETE FROM conditions WHERE id NOT IN ("
+        "SELECT keep_id FROM (SELECT MAX(id) AS keep_id FROM conditions "
+        "GROUP BY run_number, condition_type_id) AS keep_ids)"))
+    if result.rowcount:
+        log.warning(Lf("{} duplicated conditions are removed", result.rowcount))
+
+    for index in Condition.__table__.indexes:
+        if index.name == 'run_number_condition_type_id':
+            index.create(connection)
+
+    # The pivot table may have other values of duplicated conditions
+    pivot = ConditionsPivot()
+    if pivot.exists(connection):
+        pivot.invalidate(connection)
+
+    _add_schema_version(connection, 2, "Unique key on conditions (run_number, condition_type_id)")
+
+
+def _make_files_content_nullable(connection):
+    files_columns = {column["name"]: column for column in inspect(connection).get_columns("files")}
+    if files_columns["content"]["nullable"]:
+        return
+
+    if connection.dialect.name == 'mysql':
+        connection.execute(text("ALTER TABLE files MODIFY content TEXT NULL"))
+        return
+
+    # SQLite can't alter columns. The table is recreated. References from files_have_runs are by name,
+    # the new table is renamed to 'files' after the old one is dropped, so the references are kept
+    files_table = ConfigurationFile.__table__
+    column_names = ", ".join(column.name for column in files_table.columns)
+    connection.execute(text(str(CreateTable(files_table).compile(dialect=connection.dialect))
+                            .replace("CREATE TABLE files", "CREATE TABLE files_new", 1)))
+    connection.execute(text("INSERT INTO files_new ({0}) SELECT {0} FROM files".format(column_names)))
+    connection.execute(text("DROP TABLE files"))
+    connection.execute(text("ALTER TABLE files_new RENAME TO files"))
+
+
+def upgrade_2_to_3(connection):
+    """Adds file_blobs table for compressed content of configuration files"""
+    FileBlob.__table__.create(connection, checkfirst=True)
+    _make_files_content_nullable(connection)
+    _add_schema_version(connection, 3, "Compressed content of configuration files in file_blobs table")
+
+
+upgrades = {
+    1: upgrade_1_to_2,
+    2: upgrade_2_to_3,
+}
+
+
+def upgrade_schema(db):
+    """ Upgrades database schema to rcdb.SQL_SCHEMA_VERSION
+
+    :param db: RCDBProvider connected with check_version=False
+    :return: list of versions the schema was upgraded to
+    """
+    connection = db.session.connection()
+    version = get_schema_version(connection)
+    done = []
+
+    try:
+        while version < rcdb.SQL_SCHEMA_VERSION:
+            log.info(Lf("Upgrading schema from version {} to {}", version, version + 1))
+            upgrades[version](connection)
+            version += 1
+            done.append(version)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    return done
@@ -0,0 +1,118 @@
+"""
+Process-wide registry of condition types
+
+Condition types are read by almost every provider call. Before, each provider loaded them once and never
+saw types created by other writers. The registry keeps condition types of a database for all providers
+of the process that are connected with the same connection string (the web site creates a provider per request):
+
+    registry = get_registry(connection_string)
+    version, cnd_types = registry.get_types(connection)
+
+The registry revalidates itself at most every check_interval seconds with one cheap query:
+count and max(id) of condition_types. Types are reloaded only if these have changed.
+create_condition_type of any provider of the process invalidates the registry immediately.
+
+cnd_types are detached ConditionType objects. They are never used directly, each provider merges them
+to its own session (session.merge(load=False) doesn't query the database). version changes every time types
+are reloaded, so the provider knows when to merge them again.
+
+In-memory SQLite databases are separate for each engine. Providers connected to them get their own registry.
+The registry is thread safe.
+"""
+
+import threading
+import time
+
+from sqlalchemy import select, func
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import make_transient_to_detached
+
+from rcdb.model import ConditionType
+
+DEFAULT_CHECK_INTERVAL = 10.0
+"""Seconds between checks if condition types in the database have changed"""
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+class ConditionTypeRegistry(object):
+    """ Condition types of one database
+
+    :param check_interval: seconds between checks if types in the database have changed. 0 - check every time
+    """
+
+    def __init__(self, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.version = 0
+        self._types = None      # Detached ConditionType objects
+        self._stamp = None      # (count, max(id)) of loaded types
+        self._checked_time = 0.0
+        self._lock = threading.Lock()
+
+    def get_types(self, connection):
+        """ Gets condition types. Revalidates or loads them using the connection if needed
+
+        :param connection: SQLAlchemy connection to the database
+        :return: (version, [ConditionType]) ConditionType objects are detached from any session
+        """
+        with self._lock:
+            now = time.time()
+            if self._types is not None and now - self._checked_time < self.check_interval:
+                return self.version, self._types
+
+            table = ConditionType.__table__
+            stamp = tuple(connection.execute(select([func.count(table.c.id), func.max(table.c.id)])).first())
+            if self._types is None or stamp != self._stamp:
+                self._types = self._load(connection)
+                self._stamp = (len(self._types), max([cnd_type.id for cnd_type in self._types] or [None]))
+                self.version += 1
+            self._checked_time = now
+            return self.version, self._types
+
+    def invalidate(self):
+        """Condition types are reloaded with the next get_types"""
+        with self._lock:
+            self._types = None
+            self._stamp = None
+
+    @staticmethod
+    def _load(connection):
+        table = ConditionType.__table__
+        cnd_types = []
+        for row in connection.execute(select([table]).order_by(table.c.id)):
+            cnd_type = ConditionType(id=row[table.c.id],
+                                     name=row[table.c.name],
+                                     value_type=row[table.c.value_type],
+                                     created=row[table.c.created],
+                                     description=row[table.c.description])
+            make_transient_to_detached(cnd_type)
+            cnd_types.append(cnd_type)
+        return cnd_types
+
+
+def _is_in_memory(connection_string):
+    url = make_url(connection_string)
+    return url.drivername.startswith("sqlite") and url.database in (None, "", ":memory:")
+
+
+def get_registry(connection_string):
+    """ Gets the registry shared by all providers with this connection string
+
+    A new registry is returned for in-memory SQLite databases
+    """
+    if _is_in_memory(connection_string):
+        return ConditionTypeRegistry()
+
+    with _registries_lock:
+        registry = _registries.get(connection_string)
+        if registry is None:
+            registry = ConditionTypeRegistry()
+            _registries[connection_string] = registry
+        return registry
+
+
+def clear_registries():
+    """Forgets all shared registries"""
+    with _registries_lock:
+        _registries.clear()
@@ -0,0 +1,359 @@
+"""
+Vectorized evaluation of RCDB search queries with NumPy
+
+When a search query can't be fully done by the database (see rcdb.query_compiler), the rest is evaluated in
+python. Instead of evaluating the query row by row with eval(), the selected values of each condition are
+converted to typed NumPy columns and the parsed expression tree is evaluated as array operations.
+
+Column types are derived from ConditionType.value_type:
+    int   -> int64,  float -> float64, bool -> bool, time -> datetime64[us],
+    string, json, blob -> object
+Missing values (None) are kept in a separate null mask of each column.
+
+Differences from python eval: operations that raise with None in python (None > 1, math.sqrt(None),
+'a' in None, ...) give False for that run instead of raising. This is the same as SQL filtering does.
+
+This module requires numpy.
+"""
+
+import math
+import sys
+
+import numpy as np
+
+from rcdb.model import ConditionType
+from rcdb.query_compiler import Name, Literal, Sequence, BoolOp, Not, Compare, BinOp, Neg, Attribute, Call
+
+NUMBER_KIND = 'number'
+TEXT_KIND = 'text'
+TIME_KIND = 'time'
+
+_classic_division = sys.version_info[0] < 3
+
+_math_functions = {
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'log10': np.log10,
+    'fabs': np.fabs,
+    'floor': np.floor,
+    'ceil': np.ceil,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'asin': np.arcsin,
+    'acos': np.arccos,
+    'atan': np.arctan,
+    'atan2': np.arctan2,
+    'pow': np.power,
+    'hypot': np.hypot,
+}
+
+_math_constants = {
+    'pi': math.pi,
+    'e': math.e,
+}
+
+_text_methods = ('startswith', 'endswith')
+
+
+class NotVectorizable(Exception):
+    """The expression contains something that vectorized evaluation doesn't support"""
+    pass
+
+
+class Column(object):
+    """ Typed column of values
+
+    Attributes:
+        values - numpy array of values. Values where null is True are undefined
+        null - numpy bool array. True means the value is None
+        kind - NUMBER_KIND, TEXT_KIND or TIME_KIND
+    """
+
+    def __init__(self, values, null, kind):
+        self.values = values
+        self.null = null
+        self.kind = kind
+
+
+def make_column(values, value_type):
+    """ Creates typed Column from a list of python values
+
+    :param values: list of values where missing values are None
+    :param value_type: ConditionType.value_type of the values
+    :rtype: Column
+    """
+    null = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+
+    if value_type == ConditionType.INT_FIELD:
+        return Column(np.array([0 if v is None else v for v in values], dtype=np.int64), null, NUMBER_KIND)
+    if value_type == ConditionType.FLOAT_FIELD:
+        return Column(np.array([0.0 if v is None else v for v in values], dtype=np.float64), null, NUMBER_KIND)
+    if value_type == ConditionType.BOOL_FIELD:
+        return Column(np.array([bool(v) for v in values], dtype=bool), null, NUMBER_KIND)
+    if value_type == ConditionType.TIME_FIELD:
+        return Column(np.array(values, dtype='datetime64[us]'), null, TIME_KIND)
+
+    text_values = np.empty(len(values), dtype=object)
+    text_values[:] = values
+    return Column(text_values, null, TEXT_KIND)
+
+
+def _object_map(func, values, null, size):
+    """Applies python func to each not null value. Returns bool array, False where values are null"""
+    result = np.zeros(size, dtype=bool)
+    for i in np.flatnonzero(~null):
+        result[i] = bool(func(values[i]))
+    return result
+
+
+class _Evaluator(object):
+
+    def __init__(self, columns, size):
+        self.columns = columns
+        self.size = size
+
+    def literal_column(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise NotVectorizable()
+        null = np.zeros(self.size, dtype=bool)
+        if isinstance(value, str):
+            values = np.empty(self.size, dtype=object)
+            values[:] = value
+            return Column(values, null, TEXT_KIND)
+        return Column(np.full(self.size, value), null, NUMBER_KIND)
+
+    def value(self, node):
+        """Evaluates value expression to a Column"""
+
+        if isinstance(node, Name):
+            if node.name not in self.columns:
+                raise NotVectorizable()
+            return self.columns[node.name]
+
+        if isinstance(node, Literal):
+            return self.literal_column(node.value)
+
+        if isinstance(node, Attribute):
+            if isinstance(node.value, Name) and node.value.name == 'math' and node.attr in _math_constants:
+                return self.literal_column(_math_constants[node.attr])
+            raise NotVectorizable()
+
+        if isinstance(node, Neg):
+            operand = self.number(self.value(node.operand))
+            return Column(-operand.values, operand.null, NUMBER_KIND)
+
+        if isinstance(node, BinOp):
+            return self.bin_op(node)
+
+        if isinstance(node, Call):
+            return self.call(node)
+
+        raise NotVectorizable()
+
+    def number(self, column):
+        """Checks the column is numeric. Bools are converted to int64 so that True + True == 2"""
+        if column.kind != NUMBER_KIND:
+            raise NotVectorizable()
+        if column.values.dtype == bool:
+            return Column(column.values.astype(np.int64), column.null, NUMBER_KIND)
+        return column
+
+    def bin_op(self, node):
+        left = self.number(self.value(node.left))
+        right = self.number(self.value(node.right))
+        null = left.null | right.null
+
+        with np.errstate(all='ignore'):
+            if node.op == '+':
+                values = left.values + right.values
+            elif node.op == '-':
+                values = left.values - right.values
+            elif node.op == '*':
+                values = left.values * right.values
+            elif node.op == '/':
+                if _classic_division and left.values.dtype.kind in 'iu' and right.values.dtype.kind in 'iu':
+                    values = np.floor_divide(left.values, right.values)     # python 2: 3 / 2 == 1
+                else:
+                    values = np.true_divide(left.values, right.values)
+            elif node.op == '//':
+                values = np.floor_divide(left.values, right.values)
+            elif node.op == '%':
+                values = np.mod(left.values, right.values)
+            elif node.op == '**':
+                values = np.power(left.values.astype(np.float64), right.values)
+            else:
+                raise NotVectorizable()
+
+        # Division by zero raises in python
+        if node.op in ('/', '//', '%'):
+            null = null | (right.values == 0)
+        return Column(values, null, NUMBER_KIND)
+
+    def call(self, node):
+        func = node.func
+        if not isinstance(func, Attribute):
+            raise NotVectorizable()
+
+        if isinstance(func.value, Name) and func.value.name == 'math':
+            if func.attr not in _math_functions:
+                raise NotVectorizable()
+            args = [self.number(self.value(arg)) for arg in node.args]
+            null = np.zeros(self.size, dtype=bool)
+            for arg in args:
+                null = null | arg.null
+            with np.errstate(all='ignore'):
+                values = _math_functions[func.attr](*[arg.values.astype(np.float64) for arg in args])
+            # math domain errors like math.sqrt(-1) raise in python
+            return Column(values, null | ~np.isfinite(values), NUMBER_KIND)
+
+        raise NotVectorizable()
+
+    def compare(self, left_node, op, right_node):
+        if op in ('in', 'not in'):
+            result = self.contains(left_node, right_node)
+            return result if op == 'in' else ~result
+
+        left = self.value(left_node)
+        right = self.value(right_node)
+        if left.kind != right.kind:
+            raise NotVectorizable()
+        any_null = left.null | right.null
+
+        if op in ('==', '!='):
+            if left.kind == TEXT_KIND:
+                equal = np.array(left.values == right.values, dtype=bool)   # None == None is True here too
+            else:
+                equal = (left.values == right.values) & ~any_null
+                equal |= left.null & right.null
+            return equal if op == '==' else ~equal
+
+        if left.kind == TEXT_KIND:
+            values = np.zeros(self.size, dtype=bool)
+            for i in np.flatnonzero(~any_null):
+                values[i] = _compare_scalars(left.values[i], op, right.values[i])
+            return values
+
+        with np.errstate(invalid='ignore'):
+            if op == '<':
+                values = left.values < right.values
+            elif op == '>':
+                values = left.values > right.values
+            elif op == '<=':
+                values = left.values <= right.values
+            else:
+                values = left.values >= right.values
+        return values & ~any_null
+
+    def contains(self, left_node, right_node):
+        """Evaluates 'left in right'"""
+
+        if isinstance(right_node, Sequence):
+            left = self.value(left_node)
+            items = []
+            for item in right_node.items:
+                if not isinstance(item, Literal) or isinstance(item.value, bool):
+                    raise NotVectorizable()
+                items.append(item.value)
+
+            if left.kind == NUMBER_KIND:
+                numbers = [item for item in items if not isinstance(item, str)]
+                return np.isin(left.values, numbers) & ~left.null
+            if left.kind == TEXT_KIND:
+                item_set = set(items)
+                return _object_map(lambda v: v in item_set, left.values, left.null, self.size)
+            raise NotVectorizable()
+
+        # substring search: 'COSMIC' in daq_run
+        right = self.value(right_node)
+        if right.kind != TEXT_KIND or not isinstance(left_node, Literal) or not isinstance(left_node.value, str):
+            raise NotVectorizable()
+        substring = left_node.value
+        return _object_map(lambda v: substring in v, right.values, right.null, self.size)
+
+    def text_method(self, node):
+        """Evaluates daq_run.startswith('...') and alike"""
+        func = node.func
+        if func.attr not in _text_methods or not isinstance(func.value, Name):
+            raise NotVectorizable()
+        column = self.value(func.value)
+        if column.kind != TEXT_KIND:
+            raise NotVectorizable()
+
+        args = []
+        for arg in node.args:
+            if not isinstance(arg, Literal) or not isinstance(arg.value, str):
+                raise NotVectorizable()
+            args.append(arg.value)
+
+        method = func.attr
+        return _object_map(lambda v: getattr(v, method)(*args), column.values, column.null, self.size)
+
+    def truth(self, column):
+        """Python truth value testing of a column values"""
+        if column.kind == NUMBER_KIND:
+            return (column.values != 0) & ~column.null
+        if column.kind == TEXT_KIND:
+            return _object_map(bool, column.values, column.null, self.size)
+        return ~column.null
+
+    def predicate(self, node):
+        """Evaluates node as a boolean expression. Returns numpy bool array"""
+
+        if isinstance(node, BoolOp):
+            result = self.predicate(node.operands[0])
+            for operand in node.operands[1:]:
+                if node.op == 'and':
+                    result = result & self.predicate(operand)
+                else:
+                    result = result | self.predicate(operand)
+            return result
+
+        if isinstance(node, Not):
+            return ~self.predicate(node.operand)
+
+        if isinstance(node, Compare):
+            result = np.ones(self.size, dtype=bool)
+            left = node.left
+            for op, right in node.comparisons:
+                result &= self.compare(left, op, right)
+                left = right
+            return result
+
+        if isinstance(node, Call) and isinstance(node.func, Attribute) and node.func.attr in _text_methods:
+            return self.text_method(node)
+
+        return self.truth(self.value(node))
+
+
+def _compare_scalars(left, op, right):
+    if op == '<':
+        return left < right
+    if op == '>':
+        return left > right
+    if op == '<=':
+        return left <= right
+    return left >= right
+
+
+def evaluate(tree, rows, names, cnd_types, index_offset=0):
+    """ Evaluates search expression tree over all rows at once
+
+    :param tree: expression tree from rcdb.query_compiler.parse
+    :param rows: list of selected rows
+    :param names: condition names used in the tree
+    :param cnd_types: ConditionType-s of the names
+    :param index_offset: index of the first name value in a row (1 if the first column of rows is run number)
+    :return: numpy bool array. True for rows that match the search
+    :raises NotVectorizable: if the expression contains something that is not supported
+    """
+    if tree is None:
+        raise NotVectorizable()
+
+    size = len(rows)
+    columns = {}
+    for i, (name, cnd_type) in enumerate(zip(names, cnd_types)):
+        columns[name] = make_column([row[i + index_offset] for row in rows], cnd_type.value_type)
+
+    return _Evaluator(columns, size).predicate(tree)
@@ -0,0 +1,258 @@
+"""
+Write-behind queue of condition values
+
+During a run the DAQ updates conditions every minute. If the database is slow, the caller waits for it.
+In write-behind mode ConfigurationProvider.upsert_conditions only puts values to the in-process queue
+and returns. A background thread writes the queue to the database every 'interval' seconds or when
+'flush_size' values are waiting:
+
+    db = rcdb.ConfigurationProvider(connection_string)
+    db.enable_write_behind(interval=5, spill_path="/tmp/rcdb_spill.jsonl")
+    ...
+    db.upsert_conditions({run: {"event_count": 1000, "beam_current": 112.5}})   # doesn't wait for the DB
+    ...
+    db.write_behind.flush()     # writes what is queued now
+    db.disconnect()             # closes the queue: stops the thread and writes the rest
+
+Values are coalesced by (run, condition): if a condition is updated several times before the flush,
+only the last value is written.
+
+The queue is bounded by 'max_size' values. Putting a new (run, condition) to the full queue waits for the flush.
+If the background thread is not started, put() flushes the queue itself and raises WriteBehindQueueFull
+if it is still full.
+
+If the database is unreachable (sqlalchemy OperationalError), values are put back to the queue (newer values win).
+If spill_path is given, they are saved to the local file instead, so they survive the process exit. The file
+is read back by the next flush (of this or the next queue with the same spill_path) and is removed after
+values are written to the database.
+Other errors (like a missing run) are bad values, not a bad database. Then runs are written one by one,
+runs that fail are logged and dropped.
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.exc import OperationalError
+
+from rcdb.errors import WriteBehindQueueFull
+from rcdb.log_format import BraceMessage as Lf
+
+log = logging.getLogger("rcdb.write_behind")
+
+_DATETIME_KEY = "$datetime"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {_DATETIME_KEY: value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and _DATETIME_KEY in value:
+        text = value[_DATETIME_KEY]
+        time_format = "%Y-%m-%dT%H:%M:%S.%f" if "." in text else "%Y-%m-%dT%H:%M:%S"
+        return datetime.datetime.strptime(text, time_format)
+    return value
+
+
+def read_spill_file(path):
+    """ Reads values saved by the queue
+
+    :return: OrderedDict {(run_number, condition_name): value}
+    """
+    values = OrderedDict()
+    with open(path) as spill_file:
+        for line in spill_file:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                values[(record["run"], record["name"])] = _decode_value(record["value"])
+    return values
+
+
+def write_spill_file(path, values):
+    """ Saves values {(run_number, condition_name): value} to the file
+
+    The file is written to a temporary file and renamed, so it is never half written
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as spill_file:
+        for (run_number, name), value in values.items():
+            spill_file.write(json.dumps({"run": run_number, "name": name, "value": _encode_value(value)}) + "\n")
+        spill_file.flush()
+        os.fsync(spill_file.fileno())
+    os.rename(temp_path, path)
+
+
+class WriteBehindQueue(object):
+    """ Queue of condition values with a background thread that writes them
+
+    :param write: function that writes {run_number: [(condition_name, value), ...]} to the database
+    :param interval: seconds between flushes
+    :param flush_size: the queue is flushed before the interval, if this number of values are waiting
+    :param max_size: maximum number of values in the queue
+    :param spill_path: the file to save values to, if the database is unreachable. None - keep them in the queue
+    """
+
+    def __init__(self, write, interval=5.0, flush_size=500, max_size=10000, spill_path=None):
+        self._write = write
+        self.interval = interval
+        self.flush_size = flush_size
+        self.max_size = max_size
+        self.spill_path = spill_path
+
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)     # values are added or removed, the queue is closing
+        self._write_lock = threading.Lock()                 # one flush at a time
+        self._thread = None
+        self._closing = False
+
+        if spill_path and os.path.exists(spill_path):
+            log.info(Lf("Spill file '{}' exists. Its values will be written with the next flush", spill_path))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts the background thread"""
+        if self.is_running:
+            return
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="rcdb-write-behind")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, run_number, name, value):
+        """ Puts the value to the queue. Replaces the queued value of the same (run, condition)
+
+        Waits if the queue is full
+        """
+        if self._closing:
+            raise RuntimeError("The write-behind queue is closed")
+
+        key = (run_number, name)
+        with self._lock:
+            while key not in self._pending and len(self._pending) >= self.max_size:
+                self._changed.notify_all()      # wake up the flushing thread
+                if self.is_running:
+                    self._changed.wait(self.interval)
+                else:
+                    # Nobody flushes the queue. Do it in this thread
+                    self._lock.release()
+                    try:
+                        is_written = self.flush()
+                    finally:
+                        self._lock.acquire()
+                    if not is_written and len(self._pending) >= self.max_size:
+                        raise WriteBehindQueueFull("The queue is full and the database is unreachable")
+            self._pending[key] = value
+            if len(self._pending) >= self.flush_size:
+                self._changed.notify_all()
+
+    def flush(self):
+        """ Writes all queued values to the database
+
+        :return: True if values are written. False if the database is unreachable and values are
+                 put back to the queue or saved to the spill file
+        """
+        with self._write_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = OrderedDict()
+                self._changed.notify_all()
+
+            if self.spill_path and os.path.exists(self.spill_path):
+                # Values of the previous failures. The newer values from the queue replace them
+                spilled = read_spill_file(self.spill_path)
+                spilled.update(batch)
+                batch = spilled
+
+            if not batch:
+                return True
+
+            try:
+                self._write_batch(batch)
+            except OperationalError as err:
+                log.warning(Lf("Database is unreachable, {} values are not written: {}", len(batch), err))
+                if self.spill_path:
+                    try:
+                        write_spill_file(self.spill_path, batch)
+                        return False
+                    except Exception:
+                        self._requeue(batch)
+                        raise
+                self._requeue(batch)
+                return False
+
+            if self.spill_path and os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
+            log.debug(Lf("{} values are written", len(batch)))
+            return True
+
+    def _requeue(self, batch):
+        with self._lock:
+            batch.update(self._pending)     # values added during the flush are newer
+            self._pending = batch
+
+    def close(self):
+        """ Stops the background thread and flushes the queue
+
+        :return: the result of the last flush (see flush)
+        """
+        with self._lock:
+            self._closing = True
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.flush()
+
+    def _write_batch(self, batch):
+        values_by_run = OrderedDict()
+        for (run_number, name), value in batch.items():
+            values_by_run.setdefault(run_number, []).append((name, value))
+
+        try:
+            self._write(values_by_run)
+        except OperationalError:
+            raise
+        except Exception as err:
+            # Some values are bad. Write runs one by one and drop the failed ones
+            log.warning(Lf("Error writing values, writing runs one by one: {}", err))
+            for run_number, key_values in values_by_run.items():
+                try:
+                    self._write({run_number: key_values})
+                except OperationalError:
+                    raise
+                except Exception as err:
+                    log.error(Lf("Values of run {} are dropped: {}. Values: {}", run_number, err, key_values))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                deadline = time.time() + self.interval
+                while not self._closing and len(self._pending) < self.flush_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                if self._closing:
+                    return
+
+            try:
+                self.flush()
+            except Exception as err:
+                # The thread must live on. The values stay in the spill file or are logged as dropped
+                log.error(Lf("Write-behind flush failed: {}", err))
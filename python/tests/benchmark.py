@@ -0,0 +1,258 @@
+"""
+Benchmarks of the provider hot paths on a synthetic SQLite database
+
+The database is generated by create_synthetic_database with the given scale: number of runs x number of
+condition types x fill ratio (the part of (run, condition type) pairs that have a value). Condition types
+include the ones used by default aliases (event_count, beam_current, run_type, ...) so alias searches select
+real runs. The same --seed gives the same database.
+
+Each operation is repeated --repeat times. Results (min, median, mean, max seconds) are written as JSON:
+
+    python benchmark.py --runs 10000 --types 100 --fill 0.5 --output rcdb-0.7.json
+    python benchmark.py --runs 10000 --types 100 --fill 0.5 --compare rcdb-0.7.json
+
+--compare prints the ratio to the baseline results and exits with code 1 if some operation is slower
+than --tolerance times the baseline
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+import sqlalchemy
+from flask import g
+
+import rcdb
+from tests.create_synthetic_database import create_synthetic_database, make_condition_types, FIRST_RUN
+
+# The folder with 'python' and 'rcdb_www' subfolders. rcdb_www is imported from there for web_index
+RCDB_HOME = os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+
+def import_web_runs_views():
+    """ Imports the web site (rcdb_www) and its runs views
+
+    :return: (flask app, rcdb_www.runs.views module)
+    """
+    if RCDB_HOME not in sys.path:
+        sys.path.append(RCDB_HOME)
+    import rcdb_www
+    from rcdb_www.runs import views
+    return rcdb_www.app, views
+
+
+def get_condition_type_names(types_count):
+    """Names of the first types_count condition types of the generated database"""
+    return [name for _, name, _, _ in make_condition_types(types_count, random.Random())]
+
+
+def create_benchmark_database(connection_string, runs_count, types_count, fill_ratio, seed=1):
+    """ Creates the database by create_synthetic_database with the same fill_ratio of all condition types
+
+    Configuration files are not created, benchmarks don't use them
+
+    :return: ConfigurationProvider connected to the database
+    """
+    return create_synthetic_database(connection_string, runs_count, types_count, configs_count=0,
+                                     roc_files_per_run=0, distinct_files=0, seed=seed, fill_ratio=fill_ratio,
+                                     force=True)
+
+
+class Benchmark(object):
+    """ Operations to time. Each method bench_<name> does one repetition of the operation """
+
+    def __init__(self, db, runs_count, columns_count, seed=1):
+        self.db = db
+        self.run_min = FIRST_RUN
+        self.run_max = FIRST_RUN + runs_count - 1
+        self.rnd = random.Random(seed)
+        self.column_names = get_condition_type_names(columns_count)
+        self.next_new_run = self.run_max + 1
+        self.selected_runs = None
+
+    # Operations that don't change the database
+    def bench_select_runs(self):
+        self.selected_runs = self.db.select_runs("event_count > 1000000 and beam_current > 2",
+                                                 self.run_min, self.run_max)
+
+    def bench_select_runs_alias(self):
+        self.db.select_runs("@is_production", self.run_min, self.run_max)
+
+    def bench_select_values(self):
+        self.db.select_values(self.column_names, "event_count > 1000000", self.run_min, self.run_max)
+
+    def bench_select_values_all_runs(self):
+        self.db.select_values(self.column_names, "", self.run_min, self.run_max)
+
+    def bench_get_values(self):
+        if self.selected_runs is None:
+            self.bench_select_runs()
+        self.selected_runs.get_values(self.column_names, insert_run_number=True)
+
+    def bench_get_condition(self):
+        for _ in range(100):
+            self.db.get_condition(self.rnd.randint(self.run_min, self.run_max), "event_count")
+
+    def bench_web_index(self):
+        """The queries of the first page of the web site runs index: the page, its conditions, the cached count"""
+        app, views = import_web_runs_views()
+        with app.app_context():
+            g.tdb = self.db
+            runs, _, _ = views.get_runs_page(1, None, None)
+            views.load_run_table_conditions(runs)
+            views.get_runs_count()
+        self.db.session.expunge_all()
+
+    # Operations that add runs after the generated ones
+    def _make_values(self):
+        return {"event_count": self.rnd.randint(0, 100000000),
+                "beam_current": self.rnd.uniform(0, 300),
+                "run_type": "hd_all.tsg",
+                "daq_run": "PHYSICS",
+                "is_valid_run_end": True}
+
+    def bench_add_conditions(self):
+        for _ in range(10):
+            self.db.add_conditions(self.db.create_run(self.next_new_run), self._make_values())
+            self.next_new_run += 1
+
+    def bench_add_conditions_bulk(self):
+        values_by_run = {}
+        for _ in range(100):
+            values_by_run[self.db.create_run(self.next_new_run)] = self._make_values()
+            self.next_new_run += 1
+        self.db.add_conditions_bulk(values_by_run)
+
+    def bench_upsert_conditions(self):
+        run_number = self.rnd.randint(self.run_min, self.run_max)
+        self.db.upsert_conditions({run_number + i: self._make_values() for i in range(100)
+                                   if run_number + i <= self.run_max})
+
+
+# The order operations are run. Read operations go before the ones that add runs
+OPERATIONS = ["select_runs", "select_runs_alias", "select_values", "select_values_all_runs", "get_values",
+              "get_condition", "web_index", "add_conditions", "add_conditions_bulk", "upsert_conditions"]
+
+
+def run_benchmarks(benchmark, operations, repeat):
+    """ Times operations
+
+    :return: {operation: {"repeat": N, "min": seconds, "median": ..., "mean": ..., "max": ...}}
+    """
+    results = {}
+    for name in operations:
+        bench = getattr(benchmark, "bench_" + name)
+        times = []
+        for _ in range(repeat):
+            start = default_timer()
+            bench()
+            times.append(default_timer() - start)
+        times.sort()
+        results[name] = {"repeat": repeat,
+                         "min": times[0],
+                         "median": times[len(times) // 2],
+                         "mean": sum(times) / len(times),
+                         "max": times[-1]}
+    return results
+
+
+def compare_results(results, baseline, tolerance):
+    """ Prints median time ratio to the baseline
+
+    :return: names of operations that are slower than tolerance * baseline
+    """
+    slower = []
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        base_median = baseline["results"][name]["median"]
+        ratio = result["median"] / base_median if base_median else float("inf")
+        is_slower = ratio > tolerance
+        if is_slower:
+            slower.append(name)
+        print("{:<25} {:>10.4f}s {:>10.4f}s {:>7.2f}x{}".format(name, base_median, result["median"], ratio,
+                                                                " SLOWER" if is_slower else ""))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of RCDB provider on a synthetic SQLite database")
+    parser.add_argument("--runs", type=int, default=10000, help="Number of runs")
+    parser.add_argument("--types", type=int, default=100, help="Number of condition types")
+    parser.add_argument("--fill", type=float, default=0.5, help="Part of (run, condition type) that have values")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the database and operations")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of each operation")
+    parser.add_argument("--columns", type=int, default=5, help="Number of columns in select_values")
+    parser.add_argument("--pivot", action="store_true", help="Build conditions pivot table before benchmarks")
+    parser.add_argument("--only", default="", help="Comma separated operations to run. Default - all: "
+                                                   + ", ".join(OPERATIONS))
+    parser.add_argument("--db", default="", help="SQLite file to create. Default - temporary file")
+    parser.add_argument("--output", default="", help="File to write JSON results. Default - print them")
+    parser.add_argument("--compare", default="", help="JSON results of a baseline to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="With --compare, max allowed time ratio")
+    args = parser.parse_args(argv)
+
+    operations = [name.strip() for name in args.only.split(",") if name.strip()] or OPERATIONS
+    for name in operations:
+        if name not in OPERATIONS:
+            parser.error("Unknown operation '{}'".format(name))
+
+    temp_dir = None
+    db_path = args.db
+    if not db_path:
+        temp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(temp_dir, "benchmark.sqlite")
+
+    db = None
+    try:
+        start = default_timer()
+        db = create_benchmark_database("sqlite:///" + db_path, args.runs, args.types, args.fill, args.seed)
+        create_time = default_timer() - start
+        if args.pivot:
+            db.rebuild_pivot()
+
+        benchmark = Benchmark(db, args.runs, args.columns, args.seed)
+        results = run_benchmarks(benchmark, operations, args.repeat)
+    finally:
+        if db is not None:
+            db.disconnect()
+        if temp_dir:
+            shutil.rmtree(temp_dir)
+
+    report = {
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "sql_schema_version": rcdb.SQL_SCHEMA_VERSION,
+        "params": {"runs": args.runs, "types": args.types, "fill": args.fill, "seed": args.seed,
+                   "repeat": args.repeat, "columns": args.columns, "pivot": args.pivot},
+        "create_time": create_time,
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(text + "\n")
+    elif not args.compare:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["params"] != report["params"]:
+            print("Warning: baseline params {} differ from {}".format(baseline["params"], report["params"]))
+        if compare_results(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
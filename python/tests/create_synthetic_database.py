@@ -0,0 +1,393 @@
+"""
+Creates a synthetic production-shaped RCDB database for scale and load testing
+
+    python create_synthetic_database.py sqlite:////tmp/rcdb_synthetic.sqlite
+    python create_synthetic_database.py mysql://rcdb@localhost/rcdb_load --runs 100000 --types 150 --force
+
+What is in the database:
+    runs            - consecutive runs with start and end times, like a few years of data taking
+    condition types - standard ones (DefaultConditions, the ones used by default aliases) and generated ones
+                      of all value types, up to --types
+    conditions      - standard conditions are filled for almost all runs, generated types have own fill ratio.
+                      component_stats and components are JSON of --components DAQ components,
+                      rtvs has '%(config)' - the path of the main config file of the run
+    files           - --configs main config files. Each run is associated with one of them
+                      and --roc-files ROC files (from --distinct-files different contents). Content is
+                      stored in compressed blobs like add_configuration_file does
+
+Rows are written by executemany Core inserts in chunks, not through the provider.
+The same --seed gives the same database (timestamps included).
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import random
+import sys
+from timeit import default_timer
+
+from sqlalchemy import func
+
+import rcdb
+from rcdb import DefaultConditions, file_archiver
+from rcdb.model import Run, Condition, ConditionType, ConfigurationFile, FileBlob
+from rcdb.provider import destroy_all_create_schema
+
+log = logging.getLogger('rcdb.synthetic')
+
+FIRST_RUN = 10000
+START_TIME = datetime.datetime(2016, 1, 15, 8, 0)
+
+# (name, value_type, fill ratio). Values are made by _make_standard_value
+STANDARD_TYPES = [
+    (DefaultConditions.EVENT_COUNT, ConditionType.INT_FIELD, 0.98),
+    (DefaultConditions.EVENT_RATE, ConditionType.FLOAT_FIELD, 0.98),
+    (DefaultConditions.RUN_TYPE, ConditionType.STRING_FIELD, 0.99),
+    (DefaultConditions.RUN_CONFIG, ConditionType.STRING_FIELD, 0.99),
+    (DefaultConditions.RUN_LENGTH, ConditionType.INT_FIELD, 0.97),
+    (DefaultConditions.RUN_START_TIME, ConditionType.TIME_FIELD, 0.99),
+    (DefaultConditions.RUN_END_TIME, ConditionType.TIME_FIELD, 0.97),
+    (DefaultConditions.SESSION, ConditionType.STRING_FIELD, 0.99),
+    (DefaultConditions.USER_COMMENT, ConditionType.STRING_FIELD, 0.7),
+    (DefaultConditions.COMPONENTS, ConditionType.JSON_FIELD, 0.97),
+    (DefaultConditions.COMPONENT_STATS, ConditionType.JSON_FIELD, 0.97),
+    (DefaultConditions.RTVS, ConditionType.JSON_FIELD, 0.99),
+    (DefaultConditions.IS_VALID_RUN_END, ConditionType.BOOL_FIELD, 0.99),
+    ("daq_run", ConditionType.STRING_FIELD, 0.95),
+    ("beam_current", ConditionType.FLOAT_FIELD, 0.95),
+    ("solenoid_current", ConditionType.FLOAT_FIELD, 0.95),
+    ("collimator_diameter", ConditionType.STRING_FIELD, 0.95),
+    ("radiator_type", ConditionType.STRING_FIELD, 0.95),
+    ("target_type", ConditionType.STRING_FIELD, 0.95),
+    ("polarization_angle", ConditionType.FLOAT_FIELD, 0.9),
+    ("status", ConditionType.INT_FIELD, 0.9),
+]
+
+# Generated types cycle these value types
+GENERATED_VALUE_TYPES = [ConditionType.INT_FIELD, ConditionType.FLOAT_FIELD, ConditionType.STRING_FIELD,
+                         ConditionType.BOOL_FIELD, ConditionType.FLOAT_FIELD, ConditionType.JSON_FIELD,
+                         ConditionType.INT_FIELD, ConditionType.TIME_FIELD, ConditionType.BLOB_FIELD]
+
+# Kinds of runs: (weight, run_type, daq_run, beam current range, solenoid on)
+RUN_KINDS = [
+    (60, 'hd_all.tsg', 'PHYSICS', (50.0, 300.0), True),
+    (10, 'hd_all.tsg_ps', 'PHYSICS_PRIMEX', (20.0, 200.0), True),
+    (5, 'hd_all.bcal_fcal_st.tsg', 'PHYSICS_DIRC', (50.0, 250.0), True),
+    (15, 'hd_all.tsg_cosmic', 'COSMIC', (0.0, 0.5), False),
+    (10, 'hd_all.tsg', 'PHYSICS_raw', (2.0, 150.0), True),
+]
+
+ROC_DETECTORS = ["fcal", "bcal", "tof", "tagh", "st", "dirc", "ccal", "cdc", "fdc", "ps"]
+
+# Where values of the type are stored in conditions table
+_VALUE_COLUMNS = {
+    ConditionType.INT_FIELD: "int_value",
+    ConditionType.FLOAT_FIELD: "float_value",
+    ConditionType.BOOL_FIELD: "bool_value",
+    ConditionType.TIME_FIELD: "time_value",
+    ConditionType.STRING_FIELD: "text_value",
+    ConditionType.JSON_FIELD: "text_value",
+    ConditionType.BLOB_FIELD: "text_value",
+}
+
+
+class SyntheticRun(object):
+    """Properties of a generated run that its condition values are made of"""
+
+    def __init__(self, rnd, number, start_time, config_index, components_count):
+        self.number = number
+        self.start_time = start_time
+        self.length = rnd.randint(60, 2 * 3600)
+        self.end_time = start_time + datetime.timedelta(seconds=self.length)
+        self.kind = _choose_weighted(rnd, RUN_KINDS)
+        self.event_rate = rnd.uniform(10.0, 90000.0) if self.kind[2] != 'COSMIC' else rnd.uniform(1.0, 50.0)
+        self.config_index = config_index
+        self.components_count = components_count
+
+
+def _choose_weighted(rnd, items):
+    total = sum(item[0] for item in items)
+    point = rnd.uniform(0, total)
+    for item in items:
+        point -= item[0]
+        if point <= 0:
+            return item
+    return items[-1]
+
+
+def make_config_path(config_index):
+    return "/gluex/CALIB/ALL/config/hd_all/TRG_synthetic_{:04d}.conf".format(config_index)
+
+
+def make_config_content(config_index):
+    """Main config file content with FADC250 sections of the detectors"""
+    lines = ["#! CONFIG FILE:: {}".format(make_config_path(config_index))]
+    for detector in ROC_DETECTORS:
+        lines += ["==========================",
+                  "        " + detector.upper(),
+                  "==========================",
+                  "FADC250_MODE         {}".format(1 + config_index % 8),
+                  "FADC250_COM_DIR      /gluex/CALIB/ALL/fadc250/default",
+                  "FADC250_COM_VER      default",
+                  ""]
+    return "\n".join(lines) + "\n"
+
+
+def make_roc_path(detector, roc_index, version):
+    return "/gluex/CALIB/ALL/fadc250/v{}/roc{}{}_default.cnf".format(version, detector, roc_index)
+
+
+def make_roc_content(rnd, detector, roc_index):
+    """ROC config file content: crate and board thresholds"""
+    lines = ["CRATE roc{}{}".format(detector, roc_index)]
+    for slot in range(3, 19):
+        lines.append("FADC250_SLOT {}".format(slot))
+        lines.append("FADC250_ALLCH_THR " + " ".join(str(rnd.randint(100, 200)) for _ in range(16)))
+        lines.append("FADC250_ALLCH_PED " + " ".join(str(rnd.randint(90, 110)) for _ in range(16)))
+    return "\n".join(lines) + "\n"
+
+
+def _make_component_names(count):
+    names = ["ER1", "EB1", "TS1"]
+    for i in range(count - len(names)):
+        names.append("roc{}{}".format(ROC_DETECTORS[i % len(ROC_DETECTORS)], 1 + i // len(ROC_DETECTORS)))
+    return names[:count]
+
+
+def _make_standard_value(name, run):
+    """Value of a standard condition type for the run"""
+    run_type, daq_run = run.kind[1], run.kind[2]
+    if name == DefaultConditions.EVENT_COUNT:
+        return int(run.event_rate * run.length)
+    if name == DefaultConditions.EVENT_RATE:
+        return run.event_rate
+    if name == DefaultConditions.RUN_TYPE:
+        return run_type
+    if name == DefaultConditions.RUN_CONFIG:
+        return make_config_path(run.config_index).split('/')[-1]
+    if name == DefaultConditions.RUN_LENGTH:
+        return run.length
+    if name == DefaultConditions.RUN_START_TIME:
+        return run.start_time
+    if name == DefaultConditions.RUN_END_TIME:
+        return run.end_time
+    if name == DefaultConditions.SESSION:
+        return "hdops"
+    if name == DefaultConditions.USER_COMMENT:
+        return "Run {} {} ".format(run.number, daq_run.lower()) + "comment " * (run.number % 7)
+    if name == DefaultConditions.COMPONENTS:
+        return json.dumps({component: "ROC" if component.startswith("roc") else component[:2]
+                           for component in _make_component_names(run.components_count)}, sort_keys=True)
+    if name == DefaultConditions.COMPONENT_STATS:
+        events = int(run.event_rate * run.length)
+        stats = {}
+        for i, component in enumerate(_make_component_names(run.components_count)):
+            factor = 1.0 + (i % 5) * 0.01
+            stats[component] = {"evt-rate": run.event_rate * factor,
+                                "data-rate": run.event_rate * factor * 0.0015,
+                                "evt-number": events,
+                                "min-evt-size": 0.0,
+                                "max-evt-size": 100.0 + i,
+                                "average-evt-size": 40.0 + i % 10}
+        return json.dumps(stats, sort_keys=True)
+    if name == DefaultConditions.RTVS:
+        return json.dumps({"%(config)": make_config_path(run.config_index),
+                           "%(rt)": "PHYSICS",
+                           "%(session)": "hdops"}, sort_keys=True)
+    if name == DefaultConditions.IS_VALID_RUN_END:
+        return run.number % 20 != 0
+    if name == "daq_run":
+        return daq_run
+    if name == "beam_current":
+        low, high = run.kind[3]
+        return low + (high - low) * ((run.number * 7919) % 1000) / 1000.0
+    if name == "solenoid_current":
+        return 1200.0 + run.number % 100 if run.kind[4] else 0.0
+    if name == "collimator_diameter":
+        return ['5.0mm hole', '3.4mm hole', 'Blocking'][run.number % 3]
+    if name == "radiator_type":
+        return ['2x10-5 RL', 'JD70-100 58um', 'RETRACTED'][(run.number // 50) % 3]
+    if name == "target_type":
+        return 'FULL & Ready' if (run.number // 200) % 10 else 'EMPTY & Ready'
+    if name == "polarization_angle":
+        return [-1.0, 0.0, 45.0, 90.0, 135.0][(run.number // 10) % 5]
+    if name == "status":
+        return run.number % 4 - 1
+    raise ValueError("No value for '{}'".format(name))
+
+
+def _make_generated_value(rnd, value_type, run):
+    if value_type == ConditionType.INT_FIELD:
+        return rnd.randint(-1000, 1000000)
+    if value_type == ConditionType.FLOAT_FIELD:
+        return rnd.uniform(-100.0, 10000.0)
+    if value_type == ConditionType.STRING_FIELD:
+        return "value_{}".format(rnd.randint(0, 200))
+    if value_type == ConditionType.BOOL_FIELD:
+        return rnd.random() > 0.5
+    if value_type == ConditionType.TIME_FIELD:
+        return run.start_time + datetime.timedelta(seconds=rnd.randint(0, run.length))
+    if value_type == ConditionType.JSON_FIELD:
+        return json.dumps({"mode": rnd.randint(1, 8), "thresholds": [rnd.randint(100, 200) for _ in range(8)]})
+    return "blob-{:08x}".format(rnd.getrandbits(32)) * 8     # BLOB_FIELD
+
+
+def make_condition_types(types_count, rnd):
+    """[(id, name, value_type, fill ratio)]"""
+    types = [(name, value_type, fill) for name, value_type, fill in STANDARD_TYPES[:types_count]]
+    for i in range(types_count - len(types)):
+        value_type = GENERATED_VALUE_TYPES[i % len(GENERATED_VALUE_TYPES)]
+        types.append(("synthetic_{}_{}".format(value_type, i), value_type, rnd.uniform(0.05, 0.9)))
+    return [(type_id, name, value_type, fill) for type_id, (name, value_type, fill) in enumerate(types, 1)]
+
+
+def create_synthetic_database(connection_string, runs_count=100000, types_count=150, configs_count=200,
+                              roc_files_per_run=20, distinct_files=2000, components_count=40, seed=1,
+                              chunk_size=20000, force=False, fill_ratio=None):
+    """ Creates the schema and fills it with synthetic data (see the module docstring)
+
+    :param force: If False and the database has runs, ValueError is raised (the schema is recreated)
+    :param fill_ratio: If given, the fill ratio of all condition types instead of their own ones
+    :return: ConfigurationProvider connected to the database
+    """
+    rnd = random.Random(seed)
+    db = rcdb.ConfigurationProvider(connection_string, check_version=False)
+    if not force:
+        try:
+            has_runs = db.session.query(func.count(Run.number)).scalar()
+        except Exception:
+            db.session.rollback()
+            has_runs = False        # no schema
+        if has_runs:
+            db.disconnect()
+            raise ValueError("The database has runs. Use force=True (--force) to recreate it")
+
+    destroy_all_create_schema(db)
+    connection = db.session.connection()
+    if connection.dialect.name == "sqlite":
+        # The file is created from scratch, durability of each transaction is not needed
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("PRAGMA journal_mode = MEMORY")
+
+    def insert(table, rows):
+        for i in range(0, len(rows), chunk_size):
+            connection.execute(table.insert(), rows[i:i + chunk_size])
+
+    sw = default_timer()
+
+    # Condition types
+    types = make_condition_types(types_count, rnd)
+    if fill_ratio is not None:
+        types = [(type_id, name, value_type, fill_ratio) for type_id, name, value_type, _ in types]
+    insert(ConditionType.__table__,
+           [{"id": type_id, "name": name, "value_type": value_type, "created": START_TIME,
+             "description": "Synthetic condition '{}'".format(name)} for type_id, name, value_type, _ in types])
+
+    # Runs
+    runs = []
+    start_time = START_TIME
+    for number in range(FIRST_RUN, FIRST_RUN + runs_count):
+        run = SyntheticRun(rnd, number, start_time, rnd.randrange(max(configs_count, 1)), components_count)
+        runs.append(run)
+        start_time = run.end_time + datetime.timedelta(seconds=rnd.randint(30, 1800))
+    insert(Run.__table__, [{"number": run.number, "started": run.start_time, "finished": run.end_time}
+                           for run in runs])
+    log.info("{} condition types and {} runs are inserted in {:.1f}s".format(len(types), len(runs),
+                                                                             default_timer() - sw))
+
+    # Conditions
+    conditions_table = Condition.__table__
+    standard_names = set(name for name, _, _ in STANDARD_TYPES)
+    rows = []
+    conditions_count = 0
+    for run in runs:
+        for type_id, name, value_type, fill in types:
+            if rnd.random() >= fill:
+                continue
+            if name in standard_names:
+                value = _make_standard_value(name, run)
+            else:
+                value = _make_generated_value(rnd, value_type, run)
+            row = {"run_number": run.number, "condition_type_id": type_id, "created": run.end_time,
+                   "text_value": None, "int_value": 0, "float_value": 0.0, "bool_value": False, "time_value": None}
+            row[_VALUE_COLUMNS[value_type]] = value
+            rows.append(row)
+        if len(rows) >= chunk_size:
+            connection.execute(conditions_table.insert(), rows)
+            conditions_count += len(rows)
+            rows = []
+    if rows:
+        connection.execute(conditions_table.insert(), rows)
+        conditions_count += len(rows)
+    log.info("{} conditions are inserted in {:.1f}s".format(conditions_count, default_timer() - sw))
+
+    # Files. Main configs, then ROC files: distinct_files contents of (detector, roc) with several versions
+    blobs = {}
+    file_rows = []
+
+    def add_file(path, content):
+        sha256 = file_archiver.get_string_sha256(content)
+        if sha256 not in blobs:
+            blobs[sha256] = FileBlob.make_values(sha256, content)
+        file_rows.append({"id": len(file_rows) + 1, "path": path, "sha256": sha256, "content": None,
+                          "importance": ConfigurationFile.IMPORTANCE_HIGH if not path.endswith(".cnf")
+                          else ConfigurationFile.IMPORTANCE_LOW})
+        return len(file_rows)
+
+    config_file_ids = [add_file(make_config_path(i), make_config_content(i)) for i in range(configs_count)]
+    roc_names = [(detector, roc_index) for roc_index in range(1, 13) for detector in ROC_DETECTORS]
+    roc_file_ids = []       # [ids of versions of the roc file]
+    versions_count = max(1, distinct_files // len(roc_names))
+    for detector, roc_index in roc_names[:distinct_files]:
+        roc_file_ids.append([add_file(make_roc_path(detector, roc_index, version),
+                                      make_roc_content(rnd, detector, roc_index))
+                             for version in range(versions_count)])
+
+    insert(FileBlob.__table__, list(blobs.values()))
+    insert(ConfigurationFile.__table__, file_rows)
+
+    association_rows = []
+    roc_files_per_run = min(roc_files_per_run, len(roc_file_ids))
+    for run in runs:
+        if configs_count:
+            association_rows.append({"files_id": config_file_ids[run.config_index], "run_number": run.number})
+        # Versions change every 500 runs, like calibration updates
+        version = run.number // 500
+        for versions in roc_file_ids[:roc_files_per_run]:
+            association_rows.append({"files_id": versions[version % len(versions)], "run_number": run.number})
+        if len(association_rows) >= chunk_size:
+            insert(ConfigurationFile.runs.property.secondary, association_rows)
+            association_rows = []
+    insert(ConfigurationFile.runs.property.secondary, association_rows)
+    log.info("{} files ({} blobs) are inserted in {:.1f}s".format(len(file_rows), len(blobs), default_timer() - sw))
+
+    db.session.commit()
+    return db
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates a synthetic production-shaped RCDB database. "
+                                                 "All existing RCDB tables are recreated!")
+    parser.add_argument("connection_string", help="Like sqlite:////tmp/rcdb_synthetic.sqlite")
+    parser.add_argument("--runs", type=int, default=100000, help="Number of runs")
+    parser.add_argument("--types", type=int, default=150, help="Number of condition types")
+    parser.add_argument("--configs", type=int, default=200, help="Number of different main config files")
+    parser.add_argument("--roc-files", type=int, default=20, help="Number of ROC config files of each run")
+    parser.add_argument("--distinct-files", type=int, default=2000, help="Number of different ROC file contents")
+    parser.add_argument("--components", type=int, default=40, help="Number of DAQ components in component_stats")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--force", action="store_true", help="Recreate the database even if it has runs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    start = default_timer()
+    try:
+        database = create_synthetic_database(args.connection_string, args.runs, args.types, args.configs,
+                                             args.roc_files, args.distinct_files, args.components, args.seed,
+                                             force=args.force)
+    except ValueError as err:
+        print(err)
+        sys.exit(1)
+    database.disconnect()
+    print("Database is created in {:.1f}s".format(default_timer() - start))
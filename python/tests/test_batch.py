@@ -0,0 +1,116 @@
+import datetime
+import unittest
+
+from sqlalchemy import event
+
+import rcdb
+from rcdb.errors import NoRunFoundError
+from rcdb.model import ConditionType, ConfigurationFile, LogRecord, Run
+from rcdb.provider import destroy_all_create_schema
+
+
+class TestBatch(unittest.TestCase):
+    """ Tests db.batch() makes changes of many calls in one transaction"""
+
+    def setUp(self):
+        self.db = rcdb.ConfigurationProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        self.db.create_condition_type("event_count", ConditionType.INT_FIELD, "Number of events")
+        self.db.create_condition_type("run_type", ConditionType.STRING_FIELD, "Type of the run")
+
+        self.commits = 0
+
+        def count_commit(session):
+            self.commits += 1
+        event.listen(self.db.session, "after_commit", count_commit)
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def test_one_commit(self):
+        """All changes of the batch are committed once"""
+        start_time = datetime.datetime(2017, 1, 1, 10, 0)
+        with self.db.batch():
+            run = self.db.create_run(1)
+            self.db.add_run_start_time(1, start_time)
+            self.db.add_run_end_time(1, start_time + datetime.timedelta(hours=1))
+            self.db.add_conditions(1, [("event_count", 1000), ("run_type", "cosmic")])
+            self.db.add_configuration_file(1, "/some/path", content="one")
+            self.db.add_log_record("", "Batch test", 1)
+            self.assertEqual(self.commits, 0)
+
+        self.assertEqual(self.commits, 1)
+        self.assertIs(self.db.get_run(1), run)
+        self.assertEqual(run.start_time, start_time)
+        self.assertEqual(self.db.get_condition(1, "event_count").value, 1000)
+        self.assertEqual(len(run.files), 1)
+
+    def test_reuses_session_objects(self):
+        """Runs created in the batch are taken from the session, not selected again"""
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and "runs" in statement:
+                statements.append(statement)
+
+        with self.db.batch():
+            run = self.db.create_run(2)
+            event.listen(self.db.engine, "before_cursor_execute", count_statement)
+            try:
+                self.assertIs(self.db.create_run(2), run)
+                self.assertIs(self.db.get_run(2), run)
+            finally:
+                event.remove(self.db.engine, "before_cursor_execute", count_statement)
+        self.assertEqual(statements, [])
+
+    def test_rollback_on_error(self):
+        """An exception in the block rolls back all changes of the batch"""
+        with self.assertRaises(ValueError):
+            with self.db.batch():
+                self.db.create_run(3)
+                self.db.add_conditions(3, [("event_count", 1000)])
+                self.db.add_configuration_file(3, "/some/path", content="one")
+                raise ValueError("Something went wrong")
+
+        self.assertEqual(self.commits, 0)
+        self.assertIsNone(self.db.get_run(3))
+        self.assertEqual(self.db.session.query(ConfigurationFile).count(), 0)
+
+        # The provider is usable after the rollback
+        self.db.create_run(3)
+        self.assertEqual(self.db.session.query(Run).count(), 1)
+
+    def test_error_caught_inside_batch(self):
+        """A failed method doesn't roll back earlier changes of the batch, the batch does it"""
+        with self.db.batch():
+            self.db.create_run(3)
+            self.db.add_conditions(3, [("event_count", 1000)])
+            with self.assertRaises(NoRunFoundError):
+                self.db.add_conditions_bulk({3: [("run_type", "cosmic")], 4: [("run_type", "cosmic")]})
+            with self.assertRaises(NoRunFoundError):
+                self.db.upsert_conditions({4: [("run_type", "cosmic")]})
+            self.assertTrue(self.db.in_batch)
+
+        self.assertEqual(self.commits, 1)
+        self.assertEqual(self.db.get_condition(3, "event_count").value, 1000)
+
+    def test_nested(self):
+        """Only the outermost batch commits"""
+        with self.db.transaction():
+            self.db.create_run(4)
+            with self.db.batch():
+                self.db.create_run(5)
+            self.assertEqual(self.commits, 0)
+            self.assertTrue(self.db.in_batch)
+        self.assertFalse(self.db.in_batch)
+        self.assertEqual(self.commits, 1)
+        self.assertEqual(self.db.session.query(Run).count(), 2)
+
+    def test_no_batch(self):
+        """Without a batch add_configuration_file commits once"""
+        self.db.create_run(6)
+        self.commits = 0
+        self.db.add_configuration_file(6, "/some/path", content="one")
+        self.assertEqual(self.commits, 1)
+        self.assertEqual(self.db.session.query(LogRecord)
+                         .filter(LogRecord.description.like("File added%")).count(), 1)
@@ -0,0 +1,40 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from rcdb.model import Condition
+from tests import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    """ Runs benchmarks on a tiny database, so they are kept working with the provider"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_create_database(self):
+        db = benchmark.create_benchmark_database("sqlite://", 20, 15, 0.5, seed=3)
+        try:
+            self.assertEqual(len(db.get_condition_types()), 15)
+            self.assertEqual(len(db.get_runs(0, 100000)), 20)
+            count = db.session.query(Condition).count()
+            self.assertTrue(0 < count < 20 * 15)
+        finally:
+            db.disconnect()
+
+    def test_run_and_compare(self):
+        output = os.path.join(self.temp_dir, "results.json")
+        self.assertEqual(benchmark.main(["--runs", "30", "--types", "20", "--repeat", "1", "--output", output]), 0)
+        with open(output) as output_file:
+            report = json.load(output_file)
+        self.assertEqual(sorted(report["results"].keys()), sorted(benchmark.OPERATIONS))
+        self.assertEqual(report["params"]["runs"], 30)
+
+        # Everything is "slower" with tolerance 0
+        self.assertEqual(benchmark.main(["--runs", "30", "--types", "20", "--repeat", "1", "--only", "get_condition",
+                                         "--compare", output, "--tolerance", "0"]), 1)
@@ -0,0 +1,124 @@
+import time
+import unittest
+
+from sqlalchemy import event
+
+import rcdb
+from rcdb.model import ConditionType
+from rcdb.provider import destroy_all_create_schema
+from rcdb.condition_cache import ConditionCache
+
+
+class TestConditionCache(unittest.TestCase):
+    """ Tests LRU cache of condition values"""
+
+    def test_lru(self):
+        cache = ConditionCache(max_size=2, ttl=None)
+        cache.put(1, 1, "a")
+        cache.put(2, 1, "b")
+        self.assertEqual(cache.get(1, 1), (True, "a"))   # 1 becomes the most recent
+        cache.put(3, 1, None)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(2, 1), (False, None))
+        self.assertEqual(cache.get(3, 1), (True, None))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_ttl(self):
+        cache = ConditionCache(ttl=0.01)
+        cache.put(1, 1, "a")
+        time.sleep(0.02)
+        self.assertEqual(cache.get(1, 1), (False, None))
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate_runs(self):
+        cache = ConditionCache()
+        cache.put(1, 1, "a")
+        cache.put(1, 2, None)
+        cache.put(2, 1, "b")
+        self.assertEqual(cache.invalidate_runs([1]), ["a"])
+        self.assertEqual(len(cache), 1)
+
+
+class TestProviderConditionCache(unittest.TestCase):
+    """ Tests get_condition and run.get_condition with the condition cache"""
+
+    def setUp(self):
+        self.db = rcdb.RCDBProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        self.db.create_condition_type("event_count", ConditionType.INT_FIELD, "Number of events")
+        self.db.create_condition_type("comment", ConditionType.STRING_FIELD, "Comment")
+        for run_number in range(1, 11):
+            self.db.create_run(run_number)
+            if run_number != 5:
+                self.db.add_condition(run_number, "event_count", run_number * 100)
+
+        self.statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            self.statements.append(statement)
+        event.listen(self.db.engine, "before_cursor_execute", count_statement)
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(self.db.condition_cache)
+        self.assertEqual(self.db.get_condition(1, "event_count").value, 100)
+        self.assertEqual(self.db.get_condition(1, "event_count").value, 100)
+
+    def test_get_condition(self):
+        self.db.enable_condition_cache()
+        self.assertEqual(self.db.get_condition(1, "event_count").value, 100)
+        self.assertIsNone(self.db.get_condition(5, "event_count"))
+        del self.statements[:]
+
+        self.assertEqual(self.db.get_condition(1, "event_count").value, 100)
+        self.assertIsNone(self.db.get_condition(5, "event_count"))
+        self.assertEqual(self.statements, [])
+
+    def test_prefetch(self):
+        count = self.db.prefetch_conditions(["event_count", "comment"], 3, 8)
+        self.assertEqual(count, 12)
+        self.assertEqual(len(self.statements), 1)
+        del self.statements[:]
+
+        for run_number in range(3, 9):
+            cnd = self.db.get_condition(run_number, "event_count")
+            if run_number == 5:
+                self.assertIsNone(cnd)
+            else:
+                self.assertEqual(cnd.value, run_number * 100)
+            self.assertIsNone(self.db.get_condition(run_number, "comment"))
+        self.assertEqual(self.statements, [])
+
+    def test_writes_invalidate(self):
+        self.db.prefetch_conditions(["event_count"], 1, 10)
+
+        self.db.add_condition(1, "event_count", 111, replace=True)
+        self.db.add_conditions_bulk({2: [("event_count", 222)]}, replace=True)
+        self.db.upsert_conditions({3: [("event_count", 333)], 5: [("event_count", 555)]})
+
+        self.assertEqual(self.db.get_condition(1, "event_count").value, 111)
+        self.assertEqual(self.db.get_condition(2, "event_count").value, 222)
+        self.assertEqual(self.db.get_condition(3, "event_count").value, 333)
+        self.assertEqual(self.db.get_condition(5, "event_count").value, 555)
+        self.assertEqual(self.db.get_condition(4, "event_count").value, 400)
+
+    def test_batch_rollback_clears(self):
+        self.db.prefetch_conditions(["event_count"], 1, 10)
+        with self.assertRaises(ValueError):
+            with self.db.batch():
+                self.db.add_condition(1, "event_count", 111, replace=True)
+                self.db.get_condition(1, "event_count")
+                raise ValueError()
+        self.assertEqual(len(self.db.condition_cache), 0)
+        self.assertEqual(self.db.get_condition(1, "event_count").value, 100)
+
+    def test_run_get_condition(self):
+        self.db.prefetch_conditions(["event_count"], 1, 10)
+        run = self.db.get_run(7)
+        del self.statements[:]
+
+        self.assertEqual(run.get_condition_value("event_count"), 700)
+        self.assertEqual(self.statements, [])
+        self.assertIsNone(run.get_condition("unknown_name"))
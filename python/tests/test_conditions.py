@@ -229,3 +229,46 @@ class TestConditions(unittest.TestCase):
 
 
 
+
+    def test_add_conditions_bulk(self):
+        one = self.db.create_condition_type("one", ConditionType.INT_FIELD, "")
+        two = self.db.create_condition_type("two", ConditionType.FLOAT_FIELD, "")
+        three = self.db.create_condition_type("three", ConditionType.STRING_FIELD, "")
+        self.db.create_run(2)
+        run3 = self.db.create_run(3)
+        self.db.add_conditions(2, {"one": 10, "two": 1.5})
+
+        result = self.db.add_conditions_bulk({1: {"one": 1, "three": "hello"},
+                                              2: {"one": "10", "two": 1.5, "three": "world"},
+                                              run3: [("two", 3)]})
+
+        add_list, update_list, ignore_list = result[1]
+        self.assertEqual((set(add_list), update_list, ignore_list), ({one, three}, [], []))
+        add_list, update_list, ignore_list = result[2]
+        self.assertEqual((add_list, update_list, set(ignore_list)), ([three], [], {one, two}))
+        self.assertEqual(result[3], ([two], [], []))
+
+        self.assertEqual(self.db.get_condition(1, "one").value, 1)
+        self.assertEqual(self.db.get_condition(2, "three").value, "world")
+        self.assertEqual(self.db.get_condition(3, "two").value, 3.0)
+
+    def test_add_conditions_bulk_replace(self):
+        self.db.create_condition_type("one", ConditionType.INT_FIELD, "")
+        self.db.create_run(2)
+        self.db.add_conditions_bulk({1: {"one": 1}, 2: {"one": 2}})
+
+        # without replace nothing is written
+        self.assertRaises(rcdb.OverrideConditionValueError, self.db.add_conditions_bulk,
+                          {1: {"one": 1}, 2: {"one": 20}})
+        self.assertEqual(self.db.get_condition(2, "one").value, 2)
+
+        result = self.db.add_conditions_bulk({1: {"one": 1}, 2: {"one": 20}}, replace=True)
+        self.assertEqual([len(lists) for lists in result[2]], [0, 1, 0])
+        self.assertEqual(self.db.get_condition(2, "one").value, 20)
+        self.assertEqual(len(self.db.get_run(2).conditions), 1)
+
+    def test_add_conditions_bulk_failure(self):
+        self.db.create_condition_type("one", ConditionType.INT_FIELD, "")
+        self.assertRaises(rcdb.errors.NoRunFoundError, self.db.add_conditions_bulk, {1: {"one": 1}, 100: {"one": 1}})
+        self.assertRaises(ValueError, self.db.add_conditions_bulk, {1: {"one": "not a number"}})
+        self.assertIsNone(self.db.get_condition(1, "one"))
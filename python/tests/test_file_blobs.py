@@ -0,0 +1,143 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from sqlalchemy import event
+
+import rcdb
+from rcdb import file_archiver
+from rcdb.model import ConfigurationFile, FileBlob
+from rcdb.provider import destroy_all_create_schema
+
+
+class TestFileBlobs(unittest.TestCase):
+    """ Tests content of configuration files is compressed and shared between paths"""
+
+    def setUp(self):
+        self.db = rcdb.ConfigurationProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        self.temp_dir = tempfile.mkdtemp()
+        self.content = "FADC250_CRATE roc1\n" + "FADC250_SLOT 3\nFADC250_TET 110\n" * 200
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.temp_dir)
+
+    def test_compress(self):
+        data = file_archiver.content_to_bytes(self.content)
+        for compression in [file_archiver.COMPRESSION_ZLIB, file_archiver.COMPRESSION_NONE]:
+            compressed = file_archiver.compress(data, compression)
+            self.assertEqual(file_archiver.decompress(compressed, compression), data)
+        self.assertLess(len(file_archiver.compress(data)), len(data) / 5)
+        self.assertRaises(ValueError, file_archiver.compress, data, "rar")
+
+    @unittest.skipIf(file_archiver.lzma is None, "lzma is not available")
+    def test_lzma(self):
+        self.db.file_compression = file_archiver.COMPRESSION_LZMA
+        conf_file = self.db.add_configuration_file(1, "/roc1.cnf", content=self.content)
+        self.assertEqual(conf_file.blob.compression, "lzma")
+        self.assertEqual(conf_file.content, self.content)
+
+    def test_shared_blob(self):
+        """The same content with different paths and runs is stored once"""
+        path = os.path.join(self.temp_dir, "roc1.cnf")
+        with open(path, "w") as roc_file:
+            roc_file.write(self.content)
+
+        file_1 = self.db.add_configuration_file(1, path)
+        file_2 = self.db.add_configuration_file(2, "/other/roc1.cnf", content=self.content)
+        file_3 = self.db.add_configuration_file(3, path)
+
+        self.assertEqual(self.db.session.query(FileBlob).count(), 1)
+        self.assertEqual(self.db.session.query(ConfigurationFile).count(), 2)
+        self.assertIs(file_1, file_3)
+        self.assertEqual(file_1.sha256, file_2.sha256)
+
+        blob = self.db.session.query(FileBlob).one()
+        self.assertEqual(blob.compression, "zlib")
+        self.assertEqual(blob.size, len(self.content))
+        self.assertLess(len(blob.data), blob.size)
+
+        self.db.session.expire_all()
+        self.assertEqual(self.db.get_file(2, "/other/roc1.cnf").content, self.content)
+        self.assertIsNone(self.db.get_file(2, "/other/roc1.cnf")._content)
+
+    def test_add_many(self):
+        """add_configuration_files adds new files, associates existing ones and skips associated"""
+        paths = []
+        for name, content in [("roc1.cnf", self.content), ("roc2.cnf", self.content), ("roc3.cnf", "roc3")]:
+            path = os.path.join(self.temp_dir, name)
+            with open(path, "w") as roc_file:
+                roc_file.write(content)
+            paths.append(path)
+
+        self.db.add_configuration_file(1, paths[0])
+        self.db.add_configuration_file(2, paths[2])
+
+        statements = []
+
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(self.db.engine, "before_cursor_execute", count_statements)
+
+        files = self.db.add_configuration_files(2, paths + [paths[0]])
+        event.remove(self.db.engine, "before_cursor_execute", count_statements)
+
+        self.assertEqual([conf_file.path for conf_file in files], paths)
+        self.assertEqual(len([st for st in statements if st.startswith("SELECT files")]), 1)
+        self.assertEqual(len([st for st in statements if st.startswith("INSERT INTO files_have_runs")]), 1)
+        self.assertEqual(self.db.session.query(FileBlob).count(), 2)
+        self.assertEqual(self.db.session.query(ConfigurationFile).count(), 3)
+
+        run_2 = self.db.get_run(2)
+        self.assertEqual(sorted(conf_file.path for conf_file in run_2.files), paths)
+        self.assertEqual(self.db.get_file(2, paths[1]).content, self.content)
+
+        # Everything is there already
+        self.assertEqual(self.db.add_configuration_files(2, paths), files)
+        self.assertEqual(len(self.db.get_run(2).files), 3)
+
+    @unittest.skipIf(sys.version_info[0] < 3, "python 2 keeps file content as bytes")
+    def test_not_utf8_file(self):
+        """Files that are not valid UTF-8 are stored, newlines are converted as in text mode"""
+        path = os.path.join(self.temp_dir, "roc_latin1.cnf")
+        with open(path, "wb") as roc_file:
+            roc_file.write(b"# Crate caf\xe9\r\nFADC250_SLOT 3\r\n")
+
+        self.db.add_configuration_file(1, path)
+        conf_file = self.db.get_file(1, path)
+        self.assertEqual(conf_file.content, u"# Crate caf\ufffd\nFADC250_SLOT 3\n")
+        self.assertEqual(conf_file.sha256, file_archiver.get_file_sha256(path))
+
+    def test_overwrite(self):
+        self.db.add_configuration_file(1, "/some/path", content="one", overwrite=True)
+        self.db.add_configuration_file(1, "/some/path", content="two", overwrite=True)
+        self.assertEqual(self.db.session.query(ConfigurationFile).count(), 1)
+        self.assertEqual(self.db.session.query(FileBlob).count(), 2)
+        self.assertEqual(self.db.get_file(1, "/some/path").content, "two")
+
+    def test_migrate(self):
+        """Content of old files is moved to blobs"""
+        files_table = ConfigurationFile.__table__
+        self.db.create_run(1)
+        connection = self.db.session.connection()
+        for file_id, path, sha256, content in [(1, "/a", "sha_a", "content a"),
+                                               (2, "/b", "sha_b", "content b"),
+                                               (3, "/c", "sha_a", "content a")]:
+            connection.execute(files_table.insert().values(id=file_id, path=path, sha256=sha256, content=content))
+            connection.execute(ConfigurationFile.runs.property.secondary.insert().values(files_id=file_id,
+                                                                                        run_number=1))
+        self.db.session.commit()
+        self.assertEqual(self.db.get_file(1, "/a").content, "content a")
+
+        self.assertEqual(self.db.migrate_configuration_files(chunk_size=2), (3, 2))
+        self.assertEqual(self.db.session.query(FileBlob).count(), 2)
+        self.assertEqual(self.db.session.query(ConfigurationFile)
+                         .filter(ConfigurationFile._content != None).count(), 0)
+        self.assertEqual([self.db.get_file(1, path).content for path in ["/a", "/b", "/c"]],
+                         ["content a", "content b", "content a"])
+
+        # Nothing to do the second time
+        self.assertEqual(self.db.migrate_configuration_files(), (0, 0))
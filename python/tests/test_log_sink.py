@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import event
+
+import rcdb
+from rcdb.log_sink import BufferedLogSink, FileLogSink, SessionLogSink, load_log_file, read_log_file
+from rcdb.model import ConditionType, LogRecord
+from rcdb.provider import destroy_all_create_schema
+
+
+class TestLogSink(unittest.TestCase):
+    """ Tests where add_log_record writes records"""
+
+    def setUp(self):
+        self.db = rcdb.ConfigurationProvider("sqlite://", check_version=False, user_name="tester")
+        destroy_all_create_schema(self.db)
+        self.db.create_run(1)
+        self.temp_dir = tempfile.mkdtemp()
+
+        self.inserts = []
+
+        def count_insert(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("INSERT INTO logs"):
+                self.inserts.append(executemany)
+        event.listen(self.db.engine, "before_cursor_execute", count_insert)
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.temp_dir)
+
+    def get_descriptions(self):
+        return [record.description for record in self.db.session.query(LogRecord).order_by(LogRecord.id)]
+
+    def test_default(self):
+        self.assertIsInstance(self.db.log_sink, SessionLogSink)
+        self.db.add_log_record("", "one", 1)
+        self.assertEqual(self.get_descriptions(), ["one"])
+        record = self.db.session.query(LogRecord).one()
+        self.assertEqual(record.related_run_number, 1)
+        self.assertEqual(record.user_name, "tester")
+
+    def test_buffered(self):
+        """Records are inserted by one executemany when the session commits"""
+        sink = BufferedLogSink()
+        self.db.set_log_sink(sink)
+        for i in range(5):
+            self.db.add_log_record("runs_1", "record {}".format(i), 1)
+        self.assertEqual(self.inserts, [])
+
+        self.db.create_condition_type("event_count", ConditionType.INT_FIELD, "Number of events")
+        self.assertEqual(self.inserts, [True])
+        self.assertEqual(self.get_descriptions(), ["record {}".format(i) for i in range(5)])
+        self.assertEqual(len(sink.records), 1)      # 'ConditionType created' is logged after the commit
+
+        record = self.db.session.query(LogRecord).first()
+        self.assertEqual(record.related_run_number, 1)
+        self.assertEqual(record.table_ids, "runs_1")
+
+    def test_buffered_max_records(self):
+        sink = BufferedLogSink(max_records=3)
+        self.db.set_log_sink(sink)
+        for i in range(4):
+            self.db.add_log_record("", "record {}".format(i), 1)
+        self.assertEqual(len(self.inserts), 1)
+        self.assertEqual(len(sink.records), 1)
+
+        # Replacing the sink writes the rest
+        self.db.set_log_sink(SessionLogSink())
+        self.assertEqual(len(self.get_descriptions()), 4)
+
+    def test_buffered_rollback(self):
+        """Buffered records of the rolled back transaction are not committed later"""
+        sink = BufferedLogSink()
+        self.db.set_log_sink(sink)
+        with self.assertRaises(ValueError):
+            with self.db.batch():
+                self.db.create_run(2)
+                self.db.add_log_record("", "run 2 created", 2)
+                raise ValueError("Something went wrong")
+        self.assertEqual(sink.records, [])
+
+        self.db.add_log_record("", "next record", 1)
+        self.db.create_run(3)
+        self.assertEqual(self.get_descriptions(), ["next record"])
+
+    def test_file(self):
+        path = os.path.join(self.temp_dir, "logs.jsonl")
+        self.db.set_log_sink(FileLogSink(path))
+        self.db.add_log_record("", "one", 1)
+        self.db.add_log_record("", "two", None)
+        self.assertEqual(self.get_descriptions(), [])
+
+        records = read_log_file(path)
+        self.assertEqual([record["description"] for record in records], ["one", "two"])
+        self.assertEqual(records[0]["user_name"], "tester")
+
+        self.db.set_log_sink(SessionLogSink())
+        self.assertEqual(load_log_file(self.db, path), 2)
+        self.assertEqual(self.get_descriptions(), ["one", "two"])
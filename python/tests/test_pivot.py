@@ -0,0 +1,149 @@
+import datetime
+import unittest
+
+import rcdb
+from rcdb.model import ConditionType, Condition
+from rcdb.provider import destroy_all_create_schema
+from rcdb.pivot import PIVOT_TABLE_NAME
+
+
+class TestPivot(unittest.TestCase):
+    """ Tests materialized pivot table of condition values """
+
+    def setUp(self):
+        self.db = rcdb.RCDBProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        for i in [1, 2, 3, 4, 5, 9]:
+            self.db.create_run(i)
+
+        self.db.create_condition_type("a", ConditionType.INT_FIELD, "Test condition 'a'")
+        self.db.create_condition_type("b", ConditionType.FLOAT_FIELD, "Test condition 'b'")
+        self.db.create_condition_type("c", ConditionType.BOOL_FIELD, "Test condition 'c'")
+        self.db.create_condition_type("d", ConditionType.STRING_FIELD, "Test condition 'd'")
+        self.db.create_condition_type("t", ConditionType.TIME_FIELD, "Test condition 't'")
+
+        for run, a in [(1, 1), (2, 2), (3, 3), (4, 4), (9, 9)]:
+            self.db.add_condition(run, "a", a)
+        for run, b in [(1, 1.01), (2, 7.0/3.0), (3, 2.55), (4, 1.64), (5, 2.32), (9, 2.02)]:
+            self.db.add_condition(run, "b", b)
+        for run, c in [(1, False), (2, True), (3, True), (4, True), (5, False), (9, True)]:
+            self.db.add_condition(run, "c", c)
+        for run, d in [(1, "haha"), (4, "hoho"), (5, "bang"), (9, "mew")]:
+            self.db.add_condition(run, "d", d)
+        self.db.add_condition(3, "t", datetime.datetime(2016, 2, 1, 10, 30))
+
+        self.queries = ["", "a > 1 and d == 'mew'", "c and not d", "b > 2 or a in [1, 4]",
+                        "a > 0 and math.sqrt(a) > 1.5", "d != 'haha'"]
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def pivot_is_used(self):
+        return PIVOT_TABLE_NAME in str(self.db._build_values_query(['a'], "", 0, 100, False, None)[1])
+
+    def assert_same_as_joins(self):
+        names = ['a', 'b', 'c', 'd', 't']
+        for query in self.queries:
+            self.db.use_pivot = True
+            rows = self.db.select_values(names, query).rows
+            self.db.use_pivot = False
+            join_rows = self.db.select_values(names, query).rows
+            self.db.use_pivot = True
+            self.assertEqual(rows, join_rows, query)
+
+    def test_pivot_select(self):
+        self.assertFalse(self.pivot_is_used())
+        self.db.rebuild_pivot()
+        self.assertTrue(self.pivot_is_used())
+        self.assertEqual(self.db.verify_pivot(), [])
+        self.assert_same_as_joins()
+
+    def test_pivot_is_maintained(self):
+        self.db.rebuild_pivot()
+
+        self.db.add_condition(5, "a", 5)
+        self.db.add_condition(4, "d", "hehe", replace=True)
+        self.db.add_conditions(2, {"d": "new", "c": False}, replace=True)
+        self.db.create_condition_type("e", ConditionType.JSON_FIELD, "Test condition 'e'")
+        self.db.add_condition(1, "e", "[1, 2]")
+        self.db.add_conditions_bulk({3: {"d": "bulk"}, 5: {"a": 6}, 9: {"e": "{}"}}, replace=True)
+        self.db.upsert_conditions({4: {"a": 44, "e": "[]"}})
+
+        self.assertTrue(self.pivot_is_used())
+        self.assertEqual(self.db.verify_pivot(), [])
+        self.assert_same_as_joins()
+        self.assertEqual(self.db.select_values(['e'], "d == 'new' or e").rows,
+                         [[1, "[1, 2]"], [2, None], [4, "[]"], [9, "{}"]])
+
+    def test_stale_pivot(self):
+        """Pivot is not used if conditions are added by something that doesn't maintain it"""
+        self.db.rebuild_pivot()
+
+        conditions = Condition.__table__
+        type_id = self.db.get_condition_type("a").id
+        self.db.session.connection().execute(conditions.insert().values(
+            run_number=5, condition_type_id=type_id, int_value=5, float_value=0, bool_value=False))
+        self.assertFalse(self.pivot_is_used())
+        self.assertEqual(self.db.select_values(['a'], "a == 5").rows, [[5, 5]])
+
+        # The next write doesn't make it fresh again. Stale pivot is not maintained
+        self.db.add_condition(1, "d", "hehe", replace=True)
+        self.assertFalse(self.pivot_is_used())
+        self.assertEqual(self.db.verify_pivot(), [(1, 'd', 'haha', 'hehe'), (5, 'a', None, 5)])
+
+        self.db.rebuild_pivot()
+        self.assertTrue(self.pivot_is_used())
+        self.assertEqual(self.db.verify_pivot(), [])
+
+    def test_stale_pivot_update_delete(self):
+        """Updates and deletes by something that doesn't maintain the pivot are not seen by the watermark.
+        verify() finds them"""
+        conditions = Condition.__table__
+        type_id = self.db.get_condition_type("a").id
+
+        self.db.rebuild_pivot()
+        self.db.session.connection().execute(
+            conditions.update().where(conditions.c.run_number == 4).where(conditions.c.condition_type_id == type_id)
+            .values(int_value=40))
+        self.db.session.connection().execute(
+            conditions.delete().where(conditions.c.run_number == 1).where(conditions.c.condition_type_id == type_id))
+        self.assertTrue(self.pivot_is_used())
+        self.assertEqual(self.db.verify_pivot(), [(1, 'a', 1, None), (4, 'a', 4, 40)])
+
+        self.db.rebuild_pivot()
+        self.assertEqual(self.db.verify_pivot(), [])
+        self.assertEqual(self.db.select_values(['a'], "a == 40 or a == 1").rows, [[4, 40]])
+
+    def test_batch_rollback_of_new_type(self):
+        """Condition type created in a rolled back batch leaves the pivot as it was"""
+        self.db.rebuild_pivot()
+
+        with self.assertRaises(ValueError):
+            with self.db.batch():
+                self.db.create_condition_type("e", ConditionType.INT_FIELD, "Test condition 'e'")
+                self.db.add_condition(1, "e", 10)
+                raise ValueError("Something went wrong")
+
+        self.assertIsNone(self.db.session.query(ConditionType).filter(ConditionType.name == "e").first())
+        self.assertTrue(self.pivot_is_used())
+        self.assertEqual(self.db.verify_pivot(), [])
+
+    def test_batch_new_type(self):
+        """Condition type created in a batch makes the pivot stale until it is rebuilt"""
+        self.db.rebuild_pivot()
+
+        with self.db.batch():
+            self.db.create_condition_type("e", ConditionType.INT_FIELD, "Test condition 'e'")
+            self.db.add_condition(1, "e", 10)
+        self.assertFalse(self.pivot_is_used())
+
+        self.db.rebuild_pivot()
+        self.assertTrue(self.pivot_is_used())
+        self.assertEqual(self.db.select_values(['e'], "e").rows, [[1, 10]])
+
+    def test_drop_pivot(self):
+        self.db.rebuild_pivot()
+        self.db.drop_pivot()
+        self.assertFalse(self.pivot_is_used())
+        self.db.add_condition(5, "a", 5)
+        self.assert_same_as_joins()
@@ -0,0 +1,184 @@
+import unittest
+
+import rcdb
+from rcdb import lexer, query_compiler
+from rcdb.model import ConditionType, Condition
+from rcdb.errors import QueryFormatError
+from rcdb.provider import destroy_all_create_schema
+
+
+def compile_filter(query, cnd_types):
+    columns = {ct.name: (ct.get_condition_alias_value_field(Condition), ct) for ct in cnd_types}
+    tree = query_compiler.parse(lexer.tokenize(query))
+    return query_compiler.to_sql_filter(tree, columns)
+
+
+class TestQueryCompiler(unittest.TestCase):
+    """ Tests translation of search queries to SQL """
+
+    def setUp(self):
+        self.db = rcdb.RCDBProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        for i in [1, 2, 3, 4, 5, 9]:
+            self.db.create_run(i)
+
+        self.db.create_condition_type("a", ConditionType.INT_FIELD, "Test condition 'a'")
+        self.db.create_condition_type("b", ConditionType.FLOAT_FIELD, "Test condition 'b'")
+        self.db.create_condition_type("c", ConditionType.BOOL_FIELD, "Test condition 'c'")
+        self.db.create_condition_type("d", ConditionType.STRING_FIELD, "Test condition 'd'")
+
+        for run, a in [(1, 1), (2, 2), (3, 3), (4, 4), (9, 9)]:
+            self.db.add_condition(run, "a", a)
+        for run, b in [(1, 1.01), (2, 7.0/3.0), (3, 2.55), (4, 1.64), (5, 2.32), (9, 2.02)]:
+            self.db.add_condition(run, "b", b)
+        for run, c in [(1, False), (2, True), (3, True), (4, True), (5, False), (9, True)]:
+            self.db.add_condition(run, "c", c)
+        for run, d in [(1, "haha"), (4, "hoho"), (5, "bang"), (9, "mew")]:
+            self.db.add_condition(run, "d", d)
+
+        """
+        run |     a     |     b     |     c     |      d
+        ------------------------------------------------------
+          1 | 1         | 1.01      | False     | haha
+          2 | 2         | 2.333...  | True      | None
+          3 | 3         | 2.55      | True      | None
+          4 | 4         | 1.64      | True      | hoho
+          5 | None      | 2.32      | False     | bang
+          9 | 9         | 2.02      | True      | mew
+        """
+        self.cnd_types = self.db.get_condition_types()
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def test_parse(self):
+        """Queries the compiler doesn't understand are not parsed"""
+        self.assertIsNotNone(query_compiler.parse(lexer.tokenize("a > 1 and (b < 2 or d in ['x', 'y'])")))
+        self.assertIsNotNone(query_compiler.parse(lexer.tokenize("math.sqrt(a) > 1 and d.startswith('h')")))
+        self.assertIsNone(query_compiler.parse(lexer.tokenize("a | 1")))
+        self.assertIsNone(query_compiler.parse(lexer.tokenize("a > (1")))
+
+    def test_exact_translation(self):
+        clause, is_exact = compile_filter("a > 1 and not (b <= 2 or d == 'haha') and c", self.cnd_types)
+        self.assertIsNotNone(clause)
+        self.assertEqual(is_exact, not query_compiler._none_is_orderable)   # python 2: None < 1 is True
+
+    def test_partial_translation(self):
+        """Parts that can't be done in SQL are left to python eval"""
+
+        # 'and' with unknown part is still a valid prefilter
+        clause, is_exact = compile_filter("math.sqrt(a) > 1 and b > 2", self.cnd_types)
+        self.assertIsNotNone(clause)
+        self.assertFalse(is_exact)
+
+        # 'or' with unknown part can't filter anything
+        clause, is_exact = compile_filter("a > 1 or d.startswith('h')", self.cnd_types)
+        self.assertIsNone(clause)
+
+        # substring search and division
+        self.assertIsNone(compile_filter("'o' in d", self.cnd_types)[0])
+        self.assertIsNone(compile_filter("a / 2 > 1", self.cnd_types)[0])
+
+        # string compared to int
+        self.assertIsNone(compile_filter("a == 'x'", self.cnd_types)[0])
+
+    def test_case_insensitive_database(self):
+        """String equality is only a prefilter if database compares strings case insensitive"""
+        columns = {ct.name: (ct.value_field, ct) for ct in self.cnd_types}
+        tree = query_compiler.parse(lexer.tokenize("d == 'mew' and a > 1"))
+        clause, is_exact = query_compiler.to_sql_filter(tree, columns, case_sensitive_text=False)
+        self.assertIsNotNone(clause)
+        self.assertFalse(is_exact)
+
+        tree = query_compiler.parse(lexer.tokenize("d != 'mew'"))
+        clause, is_exact = query_compiler.to_sql_filter(tree, columns, case_sensitive_text=False)
+        self.assertIsNone(clause)
+
+    def select_run_numbers(self, query):
+        return [row[0] for row in self.db.select_values([], query)]
+
+    def test_select_values_none_semantic(self):
+        """SQL filtering treats None values the same way python eval does"""
+        self.assertEqual(self.select_run_numbers("d != 'haha'"), [2, 3, 4, 5, 9])
+        self.assertEqual(self.select_run_numbers("not a == 2"), [1, 3, 4, 5, 9])
+        self.assertEqual(self.select_run_numbers("c and not d"), [2, 3])
+        self.assertEqual(self.select_run_numbers("d not in ['haha', 'mew']"), [2, 3, 4, 5])
+
+    def test_compare_two_conditions_with_none(self):
+        """None == None is True in python, so runs where both values are missing are selected"""
+        self.db.create_condition_type("e", ConditionType.INT_FIELD, "Test condition 'e'")
+        self.db.add_condition(1, "e", 1)
+        self.db.add_condition(9, "e", 5)
+        self.assertEqual(self.select_run_numbers("a == e"), [1, 5])
+        self.assertEqual(self.select_run_numbers("not a == e"), [2, 3, 4, 9])
+
+    def test_select_values_filters(self):
+        self.assertEqual(self.select_run_numbers("1 < a < 4"), [2, 3])
+        self.assertEqual(self.select_run_numbers("a in [1, 9] or c"), [1, 2, 3, 4, 9])
+        self.assertEqual(self.select_run_numbers("-a < -3"), [4, 9])
+        self.assertEqual(self.select_run_numbers("a + b > 5.5 and b < 2.5"), [4, 9])
+
+    def test_select_values_python_fallback(self):
+        self.assertEqual(self.select_run_numbers("a > 0 and math.sqrt(a) > 1.5"), [3, 4, 9])
+        self.assertEqual(self.select_run_numbers("d and 'o' in d"), [4])
+        self.assertEqual(self.select_run_numbers("a > 1 and d and d.startswith('m')"), [9])
+
+    def test_dotted_names_are_checked(self):
+        """Only math functions and text methods are allowed after a dot"""
+        format_query = "d == ('{0._' + '_class_' + '_._' + '_name_' + '_}').format(d)"
+        self.assertRaises(QueryFormatError, self.db.select_runs, format_query)
+        self.assertRaises(QueryFormatError, self.db.select_runs, "d == '{0}'.format(math)")
+        self.assertRaises(QueryFormatError, self.db.select_runs, "a > 0 and math.lower(a)")
+        self.assertEqual(self.select_run_numbers("d and d.lower().endswith('w')"), [9])
+        self.assertEqual(self.select_run_numbers("a > 0 and math.floor(math.sqrt(a)) == 2"), [4])
+
+    def test_select_runs(self):
+        result = self.db.select_runs("a > 1 and d == 'mew'")
+        self.assertEqual([run.number for run in result], [9])
+
+        result = self.db.select_runs("a > 1 and b > 2 and a % 2")
+        self.assertEqual([run.number for run in result], [3, 9])
+        self.assertEqual(result.filter_condition_names, ['a', 'b'])
+
+    def test_plan_cache(self):
+        """Compiled plans are reused until aliases or condition types change"""
+        plan = self.db.get_search_plan("a > 1 and d == 'mew'")
+        self.assertIs(self.db.get_search_plan("a > 1 and d == 'mew'"), plan)
+        self.assertIsNot(self.db.get_search_plan("a > 1 and d == 'haha'"), plan)
+        self.assertEqual(plan.names, ['a', 'd'])
+        self.assertEqual(plan.is_exact_filter, not query_compiler._none_is_orderable)
+        self.assertEqual(plan.compiled_search_eval is None, plan.is_exact_filter)
+
+        self.db.create_condition_type("z", ConditionType.INT_FIELD, "Test condition 'z'")
+        self.assertIsNot(self.db.get_search_plan("a > 1 and d == 'mew'"), plan)
+
+    def test_plan_cache_is_shared_by_clones(self):
+        """Clones use the same plans, condition types are taken from the session of the clone"""
+        plan = self.db.get_search_plan("a > 1 and d == 'mew'")
+        clone = self.db.clone()
+        try:
+            self.assertIs(clone.get_search_plan("a > 1 and d == 'mew'"), plan)
+            self.assertIs(clone.pivot, self.db.pivot)
+            result = clone.select_runs("a > 1 and d == 'mew'")
+            self.assertEqual([run.number for run in result], [9])
+            self.assertEqual([ct.name for ct in result.filter_condition_types], ['a', 'd'])
+            for cnd_type in result.filter_condition_types:
+                self.assertIn(cnd_type, clone.session)
+        finally:
+            clone.disconnect()
+
+    def test_plan_cache_is_bounded(self):
+        cache = query_compiler.QueryPlanCache(max_size=2)
+        cache.put("one", 1)
+        cache.put("two", 2)
+        cache.get("one")
+        cache.put("three", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("two"))
+        self.assertEqual(cache.get("one"), 1)
+
+    def test_lexer_is_built_once(self):
+        list(lexer.tokenize("a > 1"))
+        ply_lexer = lexer._ply_lexer
+        list(lexer.tokenize("b < 2"))
+        self.assertIs(lexer._ply_lexer, ply_lexer)
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import event
+
+import rcdb
+from rcdb.model import ConditionType
+from rcdb.provider import destroy_all_create_schema
+from rcdb.result_cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    """ Tests select_values and select_runs with the result cache"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = rcdb.RCDBProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        self.db.create_condition_type("event_count", ConditionType.INT_FIELD, "Number of events")
+        self.db.create_condition_type("run_type", ConditionType.STRING_FIELD, "Type of the run")
+        for run_number in range(1, 21):
+            self.db.create_run(run_number)
+            self.db.add_conditions(run_number, [("event_count", run_number * 100),
+                                                ("run_type", "prod" if run_number % 2 else "cosmic")])
+        self.statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            self.statements.append(statement)
+        event.listen(self.db.engine, "before_cursor_execute", count_statement)
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.temp_dir)
+
+    def select(self, run_min=1, run_max=10):
+        return self.db.select_values(["event_count"], "run_type == 'prod'", run_min, run_max)
+
+    def test_select_values(self):
+        self.db.enable_result_cache()
+        first = self.select()
+        self.assertNotIn("cached", first.performance)
+
+        del self.statements[:]
+        second = self.select()
+        self.assertTrue(second.performance["cached"])
+        self.assertEqual(second.rows, first.rows)
+        self.assertEqual(second.filter_condition_names, first.filter_condition_names)
+        self.assertEqual(len(self.statements), 3)   # only the watermark
+
+        # The result is a copy, changing it doesn't change the cache
+        second.rows[0][1] = -1
+        self.assertEqual(self.select().rows, first.rows)
+
+    def test_write_invalidates_its_range_only(self):
+        self.db.enable_result_cache()
+        self.select(1, 10)
+        self.select(11, 20)
+
+        self.db.add_condition(3, "event_count", 333, replace=True)
+
+        old_period = self.select(11, 20)
+        self.assertTrue(old_period.performance["cached"])
+        changed = self.select(1, 10)
+        self.assertNotIn("cached", changed.performance)
+        self.assertEqual(changed.rows[1], [3, 333])
+
+    def test_new_run_invalidates(self):
+        self.db.enable_result_cache()
+        self.db.select_values(["event_count"], run_min=1, run_max=30)
+        self.db.create_run(21)
+        result = self.db.select_values(["event_count"], run_min=1, run_max=30)
+        self.assertNotIn("cached", result.performance)
+        self.assertEqual(result.rows[-1], [21, None])
+
+    def test_select_runs(self):
+        self.db.enable_result_cache()
+        first = self.db.select_runs("event_count > 1500", 1, 20)
+        second = self.db.select_runs("event_count > 1500 ", 1, 20)
+        self.assertTrue(second.performance["cached"])
+        self.assertEqual([run.number for run in second], [run.number for run in first])
+        self.assertEqual([run.number for run in second], [16, 17, 18, 19, 20])
+        self.assertEqual(second.filter_condition_types, first.filter_condition_types)
+
+    def test_disk(self):
+        path = os.path.join(self.temp_dir, "results.sqlite")
+        self.db.enable_result_cache(path=path)
+        first = self.select()
+        self.db.disable_result_cache()
+
+        self.db.enable_result_cache(path=path)
+        self.assertEqual(len(self.db.result_cache), 0)
+        second = self.select()
+        self.assertTrue(second.performance["cached"])
+        self.assertEqual(second.rows, first.rows)
+
+    def test_lru(self):
+        cache = ResultCache(max_size=1)
+        cache.put("a", 1, "value a")
+        cache.put("b", 1, "value b")
+        self.assertIsNone(cache.get("a", 1))
+        self.assertEqual(cache.get("b", 1), "value b")
+        self.assertIsNone(cache.get("b", 2))
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import rcdb
+from halld_rcdb.roc_files_pipeline import add_runs_roc_files, read_run_roc_files
+from rcdb.model import ConfigurationFile, FileBlob
+from rcdb.provider import destroy_all_create_schema
+
+
+class TestRocFilesPipeline(unittest.TestCase):
+    """ Tests ROC configuration files of many runs are read by threads and saved by one writer"""
+
+    def setUp(self):
+        self.db = rcdb.ConfigurationProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        self.temp_dir = tempfile.mkdtemp()
+
+        # Common files for 3 ROCs and a user version of the second ROC
+        com_dir = os.path.join(self.temp_dir, "com")
+        user_dir = os.path.join(self.temp_dir, "user")
+        os.mkdir(com_dir)
+        os.mkdir(user_dir)
+        for roc_number in [13, 11, 12]:
+            with open(os.path.join(com_dir, "rocfcal{}_default.cnf".format(roc_number)), "w") as roc_file:
+                roc_file.write("FADC250_CRATE rocfcal{}\nFADC250_TET 110\n".format(roc_number))
+        with open(os.path.join(user_dir, "rocfcal12_hot.cnf"), "w") as roc_file:
+            roc_file.write("FADC250_CRATE rocfcal12\nFADC250_SLOT 3\nFADC250_TET 200\n")
+
+        config = "==========================\n" \
+                 "FCAL\n" \
+                 "==========================\n" \
+                 "FADC250_COM_DIR   {}\n" \
+                 "FADC250_COM_VER   default\n"
+        self.com_config = config.format(com_dir)
+        self.user_config = self.com_config + "FADC250_USER_DIR  {}\nFADC250_USER_VER  hot\n".format(user_dir)
+        self.com_files = [os.path.join(com_dir, "rocfcal{}_default.cnf".format(n)) for n in [11, 12, 13]]
+        self.user_file = os.path.join(user_dir, "rocfcal12_hot.cnf")
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.temp_dir)
+
+    def test_read_run(self):
+        """Files are in a deterministic order, the user file goes before the common file of the ROC"""
+        files = read_run_roc_files(self.user_config)
+        self.assertEqual(list(files.keys()), [self.com_files[0], self.user_file, self.com_files[1], self.com_files[2]])
+        content, sha256 = files[self.user_file]
+        self.assertIn("FADC250_TET 200", content)
+        self.assertEqual(sha256, rcdb.file_archiver.get_file_sha256(self.user_file))
+
+    def test_many_runs(self):
+        jobs = [(run_number, self.user_config if run_number % 2 else self.com_config) for run_number in range(1, 11)]
+        jobs.append((11, "no ROC sections"))
+
+        for threads in [4, 1]:
+            saved_count_by_run = add_runs_roc_files(self.db, jobs, threads=threads)
+            self.assertEqual(list(saved_count_by_run.items()),
+                             [(run_number, 4 if run_number % 2 else 3) for run_number in range(1, 11)] + [(11, 0)])
+
+        # Files and blobs are shared by runs
+        self.assertEqual(self.db.session.query(ConfigurationFile).count(), 4)
+        self.assertEqual(self.db.session.query(FileBlob).count(), 4)
+        self.assertEqual(sorted(conf_file.path for conf_file in self.db.get_run(3).files),
+                         sorted(self.com_files + [self.user_file]))
+        self.assertEqual(len(self.db.get_run(4).files), 3)
+        self.assertEqual(self.db.get_file(4, self.com_files[0]).importance, ConfigurationFile.IMPORTANCE_LOW)
+
+    def test_failed_run(self):
+        """A run that fails is skipped, others are saved"""
+        saved_count_by_run = add_runs_roc_files(self.db, [(1, self.com_config), (2, None), (3, self.com_config)],
+                                                threads=2)
+        self.assertEqual(list(saved_count_by_run.keys()), [1, 3])
@@ -0,0 +1,68 @@
+import unittest
+
+import rcdb
+from rcdb.model import ConditionType, Condition, Run
+from rcdb.provider import destroy_all_create_schema
+from rcdb.run_set import RunSet
+import rcdb.run_set
+
+
+class TestRunSet(unittest.TestCase):
+    """ Tests filtering by long lists of runs """
+
+    def setUp(self):
+        self.db = rcdb.RCDBProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        ct = self.db.create_condition_type("a", ConditionType.INT_FIELD, "Test condition 'a'")
+
+        # Fast fill: 2000 runs, every third run has condition 'a'
+        for i in range(1, 2001):
+            run = Run()
+            run.number = i
+            self.db.session.add(run)
+        self.db.session.flush()
+        for i in range(3, 2001, 3):
+            condition = Condition()
+            condition.run_number = i
+            condition.type = ct
+            condition.value = i
+            self.db.session.add(condition)
+        self.db.session.commit()
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def test_small_set_uses_bound_parameters(self):
+        run_set = RunSet(self.db.session.connection(), [3, 1, 3])
+        self.assertFalse(run_set.uses_temp_table)
+        self.assertEqual(run_set.run_numbers, [1, 3])
+        run_set.close()
+
+    def test_select_values_by_long_run_list(self):
+        runs = list(range(2, 2001, 2))
+        self.assertGreater(len(runs), rcdb.run_set.TEMP_TABLE_THRESHOLD)
+
+        result = self.db.select_values(['a'], "a > 10", runs=runs)
+        self.assertEqual(result.rows, [[i, i] for i in range(12, 2001, 6)])
+
+        rows = list(self.db.select_values_iter(['a'], runs=runs, sort_desc=True, chunk_size=100))
+        self.assertEqual(len(rows), len(runs))
+        self.assertEqual(rows[0], [2000, None])
+        self.assertEqual(rows[-3], [6, 6])
+
+    def test_temp_table_is_cleaned(self):
+        connection = self.db.session.connection()
+        with RunSet(connection, range(1, 1001)) as run_set:
+            self.assertTrue(run_set.uses_temp_table)
+            count = connection.execute("SELECT count(*) FROM rcdb_run_sets").scalar()
+            self.assertEqual(count, 1000)
+
+        count = connection.execute("SELECT count(*) FROM rcdb_run_sets").scalar()
+        self.assertEqual(count, 0)
+
+    def test_get_values_by_long_run_list(self):
+        result = self.db.select_runs(run_min=1, run_max=1500)
+        rows = result.get_values(['a'], insert_run_number=True)
+        self.assertEqual(len(rows), 1500)
+        self.assertEqual(rows[:3], [[1, None], [2, None], [3, 3]])
+        self.assertEqual(rows[-1], [1500, 1500])
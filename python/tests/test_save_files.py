@@ -47,7 +47,7 @@ class TestSaveFiles(unittest.TestCase):
 
         path_4433 = os.path.join(self.this_dir, "large_run.log")
         cf = self.db.add_configuration_file(1, path_4433)
-        content = self.db.session.query(ConfigurationFile.content).filter(ConfigurationFile.id == cf.id).scalar()
+        content = cf.content
         self.assertIn("</coda>", content)
 
 
@@ -0,0 +1,86 @@
+import datetime
+import unittest
+
+from sqlalchemy.exc import IntegrityError
+
+import rcdb
+from rcdb.model import ConditionType, Condition, SchemaVersion, ConfigurationFile, FileBlob
+from rcdb.provider import destroy_all_create_schema
+from rcdb.schema_upgrade import upgrade_schema, get_schema_version
+
+
+class TestSchemaUpgrade(unittest.TestCase):
+    """ Tests upgrade of SQL schema from version 1 and the unique key of conditions"""
+
+    def setUp(self):
+        self.db = rcdb.RCDBProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        self.db.create_run(1)
+        self.db.create_run(2)
+        self.ct = self.db.create_condition_type("a", ConditionType.INT_FIELD, "Test condition 'a'")
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def insert_condition(self, run_number, value):
+        self.db.session.connection().execute(Condition.__table__.insert().values(
+            run_number=run_number, condition_type_id=self.ct.id, int_value=value, float_value=0, bool_value=False))
+
+    def test_unique_key(self):
+        self.insert_condition(1, 10)
+        self.assertRaises(IntegrityError, self.insert_condition, 1, 20)
+
+    def test_upgrade_from_version_1(self):
+        # make version 1 database with duplicated conditions
+        connection = self.db.session.connection()
+        connection.execute("DROP INDEX run_number_condition_type_id")
+        connection.execute(SchemaVersion.__table__.delete())
+        connection.execute(SchemaVersion.__table__.insert().values(version=1))
+        self.insert_condition(1, 10)
+        self.insert_condition(1, 20)
+        self.insert_condition(2, 30)
+        self.db.session.commit()
+
+        self.assertEqual(upgrade_schema(self.db), [2, 3])
+        self.assertEqual(get_schema_version(self.db.session.connection()), rcdb.SQL_SCHEMA_VERSION)
+        self.assertEqual(self.db.select_values(['a']).rows, [[1, 20], [2, 30]])
+        self.assertRaises(IntegrityError, self.insert_condition, 2, 40)
+
+        # nothing to do the second time
+        self.db.session.rollback()
+        self.assertEqual(upgrade_schema(self.db), [])
+
+    def test_upgrade_from_version_2(self):
+        # make version 2 database: no file_blobs and files.content is NOT NULL
+        connection = self.db.session.connection()
+        connection.execute("DROP TABLE file_blobs")
+        connection.execute("DROP TABLE files")
+        connection.execute("CREATE TABLE files (id INTEGER NOT NULL, path TEXT NOT NULL, sha256 VARCHAR(44) NOT NULL, "
+                           "content TEXT NOT NULL, description VARCHAR(255), importance INTEGER DEFAULT '0' NOT NULL, "
+                           "PRIMARY KEY (id))")
+        connection.execute("INSERT INTO files (path, sha256, content) VALUES ('/a.cnf', 'aaa', 'content a')")
+        connection.execute("INSERT INTO files_have_runs (files_id, run_number) VALUES (1, 1)")
+        connection.execute(SchemaVersion.__table__.delete())
+        connection.execute(SchemaVersion.__table__.insert().values(version=2))
+        self.db.session.commit()
+
+        self.assertEqual(upgrade_schema(self.db), [3])
+
+        conf_file = self.db.get_file(1, '/a.cnf')
+        self.assertEqual(conf_file.content, 'content a')
+        self.assertEqual(self.db.session.query(FileBlob).count(), 0)
+
+        # The content is nullable now
+        self.db.session.connection().execute(ConfigurationFile.__table__.insert().values(path='/b', sha256='bbb'))
+        self.db.session.commit()
+
+    def test_upsert_conditions(self):
+        ct_b = self.db.create_condition_type("b", ConditionType.TIME_FIELD, "Test condition 'b'")
+        self.db.add_condition(1, "a", 10)
+
+        time = datetime.datetime(2016, 2, 3, 4, 5, 6)
+        self.db.upsert_conditions({1: {"a": 11, ct_b: time}, self.db.get_run(2): [("a", "12")]})
+
+        self.assertEqual(self.db.select_values(['a', 'b']).rows, [[1, 11, time], [2, 12, None]])
+        self.assertEqual(len(self.db.get_run(1).conditions), 2)
+        self.assertRaises(rcdb.errors.NoRunFoundError, self.db.upsert_conditions, {3: {"a": 1}})
@@ -140,6 +140,13 @@ class TestRun(unittest.TestCase):
         awaited_rows = [[None], ['my only value'], [None], [None]]
         self.assertEqual(rows, awaited_rows)
 
+        # 6. The same run is in the result twice
+        result = self.db.select_runs(run_min=3, run_max=4)
+        result.append(result[0])
+        rows = result.get_values(['a', 'd'], insert_run_number=True)
+        awaited_rows = [[3, 3, None], [4, 4, 'hoho'], [3, 3, None]]
+        self.assertEqual(rows, awaited_rows)
+
     def test_select_runs_sort_order(self):
         """Test sort_desc parameter"""
         result = self.db.select_runs("a>0", sort_desc=True)
@@ -162,10 +169,40 @@ class TestRun(unittest.TestCase):
                         ]
         self.assertEqual(rows, awaited_rows)
 
+    def test_get_values_all_types(self):
+        """Values of different types and the same condition twice"""
 
+        rows = self.db.select_runs(run_min=4, run_max=9).get_values(['b', 'c', 'f', 'a', 'b'], True)
+        awaited_rows = [[4, 1.64, True, 'my only value', 4, 1.64],
+                        [5, 2.32, False, None, None, 2.32],
+                        [9, 2.02, True, None, 9, 2.02],
+                        ]
+        self.assertEqual(rows, awaited_rows)
 
-
-
-
-
-
+    def test_select_runs_statement_count(self):
+        """Number of SQL statements doesn't depend on the number of selected runs"""
+        from sqlalchemy import event
+
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        # make sure condition types and aliases are loaded and runs are not
+        self.db.select_runs("b > 2")
+        for obj in list(self.db.session):
+            if isinstance(obj, (Run, rcdb.model.Condition)):
+                self.db.session.expunge(obj)
+
+        event.listen(self.db.engine, "before_cursor_execute", count_statement)
+        try:
+            result = self.db.select_runs("b > 2.5")
+            self.assertEqual([run.number for run in result], [2, 3])
+            one_run_count = len(statements)
+            del statements[:]
+            result = self.db.select_runs("b > 1")
+            self.assertEqual(len(result), 6)
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", count_statement)
+
+        self.assertEqual(len(statements), one_run_count)
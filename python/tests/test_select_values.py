@@ -2,6 +2,7 @@ import unittest
 
 import rcdb
 import rcdb.model
+from rcdb import query_compiler
 from rcdb.model import Run, ConditionType
 from rcdb.provider import destroy_all_create_schema
 
@@ -111,12 +112,30 @@ class TestRun(unittest.TestCase):
         result = self.db.select_values(['a', 'd'], runs=[9, self.db.get_run(4)], insert_run_number=False)
         self.assertEqual(result.rows, [[4, u'hoho'], [9, u'mew']])
 
-
-
-
-
-
-
-
-
-
+    def test_select_values_iter(self):
+        """Rows yielded by chunks are the same as select_values result"""
+        result = self.db.select_values(['a', 'd'], "c and b > 2")
+        rows = list(self.db.select_values_iter(['a', 'd'], "c and b > 2", chunk_size=1))
+        self.assertEqual(rows, result.rows)
+
+        rows = list(self.db.select_values_iter(['d'], "d and 'o' in d", insert_run_number=False, chunk_size=2))
+        self.assertEqual(rows, [[u'hoho']])
+
+        rows = list(self.db.select_values_iter(['a'], run_min=4, sort_desc=True))
+        self.assertEqual(rows, [[9, 9], [5, None], [4, 4]])
+
+    def test_select_values_explain(self):
+        """explain=True gives SQL, the query plan and row counts"""
+        result = self.db.select_values(['a'], "a > 1 and math.sqrt(a) > 1.5", explain=True)
+        self.assertEqual(result.rows, [[3, 3], [4, 4], [9, 9]])
+        self.assertIn("conditions", result.explain["sql"])
+        self.assertTrue(result.explain["plan"])
+        # python 2 orders None before numbers, so run 5 with a=None is left for python eval
+        self.assertEqual(result.performance["fetched_rows"], 5 if query_compiler._none_is_orderable else 4)
+        self.assertEqual(result.performance["selected_rows"], 3)
+
+        result = self.db.select_runs("a > 1 and math.sqrt(a) > 1.5", explain=True)
+        self.assertEqual([run.number for run in result], [3, 4, 9])
+        self.assertTrue(result.explain["plan"])
+        self.assertEqual(result.performance["selected_rows"], 3)
+        self.assertIsNone(self.db.select_runs("a > 1").explain)
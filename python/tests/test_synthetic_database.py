@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from rcdb.model import Condition, ConditionType, ConfigurationFile
+from tests.create_synthetic_database import create_synthetic_database, make_config_path, FIRST_RUN
+
+
+class TestSyntheticDatabase(unittest.TestCase):
+    """ Tests the generator of synthetic databases at a small scale"""
+
+    def setUp(self):
+        self.db = create_synthetic_database("sqlite://", runs_count=100, types_count=40, configs_count=3,
+                                            roc_files_per_run=5, distinct_files=240, components_count=10, seed=7)
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def test_content(self):
+        self.assertEqual(len(self.db.get_runs(0, FIRST_RUN + 1000)), 100)
+        value_types = set(cnd_type.value_type for cnd_type in self.db.get_condition_types())
+        self.assertEqual(len(value_types), 7)
+
+        run = self.db.get_run(FIRST_RUN + 10)
+        self.assertEqual(run.get_condition_value("event_count"),
+                         int(run.get_condition_value("event_rate") * run.get_condition_value("run_length")))
+        stats = json.loads(self.db.get_condition(run.number, "component_stats").value)
+        self.assertEqual(len(stats), 10)
+
+        # The main config is found by rtvs like walker_add_configuration_files does
+        config_path = json.loads(run.get_condition_value("rtvs"))["%(config)"]
+        main_config = self.db.get_file(run, config_path)
+        self.assertIn("FADC250_COM_DIR", main_config.content)
+        self.assertEqual(len(run.files), 6)
+        self.assertEqual(self.db.session.query(ConfigurationFile).count(), 3 + 240)
+
+        # Queries work on it
+        self.assertTrue(len(self.db.select_runs("@is_production").runs) > 0)
+        self.assertEqual(len(self.db.select_values(["beam_current", "daq_run"], "event_count > 0").rows),
+                         len(self.db.select_runs("event_count > 0").runs))
+
+    def test_seed(self):
+        """The same seed gives the same database"""
+        def dump(db):
+            return [(row.run_number, row.condition_type_id, row.text_value, row.int_value, row.float_value,
+                     row.bool_value, row.time_value, row.created)
+                    for row in db.session.query(Condition).order_by(Condition.id)]
+
+        other = create_synthetic_database("sqlite://", runs_count=100, types_count=40, configs_count=3,
+                                          roc_files_per_run=5, distinct_files=240, components_count=10, seed=7)
+        try:
+            self.assertEqual(dump(self.db), dump(other))
+            self.assertEqual(make_config_path(1), "/gluex/CALIB/ALL/config/hd_all/TRG_synthetic_0001.conf")
+        finally:
+            other.disconnect()
+
+    def test_force(self):
+        """The database with runs is not recreated without force"""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            connection_string = "sqlite:///" + os.path.join(temp_dir, "synthetic.sqlite")
+            create_synthetic_database(connection_string, runs_count=3, types_count=5).disconnect()
+            self.assertRaises(ValueError, create_synthetic_database, connection_string, runs_count=1)
+            db = create_synthetic_database(connection_string, runs_count=1, types_count=5, force=True)
+            self.assertEqual(len(db.get_runs(0, FIRST_RUN + 10)), 1)
+            db.disconnect()
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from sqlalchemy import event
+
+import rcdb
+from rcdb.model import ConditionType
+from rcdb.provider import destroy_all_create_schema
+from rcdb.type_registry import ConditionTypeRegistry, get_registry, clear_registries
+
+
+class TestTypeRegistry(unittest.TestCase):
+    """ Tests condition types are shared by providers of the process"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.connection_string = "sqlite:///" + os.path.join(self.temp_dir, "test.sqlite")
+        self.db = rcdb.ConfigurationProvider(self.connection_string, check_version=False)
+        destroy_all_create_schema(self.db)
+        self.db.create_condition_type("event_count", ConditionType.INT_FIELD, "Number of events")
+        self.db.create_run(1)
+        self.statements = []
+        self.providers = [self.db]
+
+    def tearDown(self):
+        for provider in self.providers:
+            provider.disconnect()
+        clear_registries()
+        shutil.rmtree(self.temp_dir)
+
+    def connect(self):
+        provider = rcdb.ConfigurationProvider(self.connection_string)
+        self.providers.append(provider)
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            self.statements.append(statement)
+        event.listen(provider.engine, "before_cursor_execute", count_statement)
+        return provider
+
+    def get_types_selects(self):
+        return [statement for statement in self.statements if "FROM condition_types" in statement]
+
+    def test_shared(self):
+        """The second provider doesn't load types"""
+        self.db.get_condition_types()
+        other = self.connect()
+        self.assertIs(other.type_registry, self.db.type_registry)
+        self.assertEqual(other.get_condition_type("event_count").name, "event_count")
+        self.assertEqual(self.get_types_selects(), [])
+
+        # Objects belong to the provider session. Commit doesn't make them selected again
+        cnd_type = other.get_condition_type("event_count")
+        self.assertIn(cnd_type, other.session)
+        other.add_condition(1, "event_count", 10)
+        other.add_condition(1, "event_count", 20, replace=True)
+        self.assertIs(other.get_condition_type("event_count"), cnd_type)
+        self.assertEqual(self.get_types_selects(), [])
+
+    def test_created_by_other_provider(self):
+        other = self.connect()
+        self.assertEqual(len(other.get_condition_types()), 1)
+        self.db.create_condition_type("beam_current", ConditionType.FLOAT_FIELD, "Beam current")
+        self.assertEqual(sorted(other.get_condition_types_by_name().keys()), ["beam_current", "event_count"])
+
+    def test_created_by_other_process(self):
+        """Types inserted by others are found by get_condition_type and by the check after check_interval"""
+        other = self.connect()
+        self.assertEqual(len(other.get_condition_types()), 1)
+        for name in ["a", "b"]:
+            other.engine.execute(ConditionType.__table__.insert().values(name=name, value_type="int"))
+
+        self.assertEqual(len(other.get_condition_types()), 1)
+        self.assertEqual(other.get_condition_type("a").name, "a")       # not in the registry, selected
+        self.assertEqual(len(other.get_condition_types()), 3)
+
+        other.engine.execute(ConditionType.__table__.insert().values(name="c", value_type="int"))
+        other.type_registry.check_interval = 0
+        self.assertEqual(len(other.get_condition_types()), 4)
+        self.assertRaises(rcdb.errors.NoConditionTypeFound, other.get_condition_type, "d")
+
+    def test_threads(self):
+        self.db.create_condition_type("beam_current", ConditionType.FLOAT_FIELD, "Beam current")
+        registry = self.db.type_registry
+        registry.invalidate()
+        results = []
+
+        def get_types(provider):
+            results.append(sorted(cnd_type.name for cnd_type in provider.get_condition_types()))
+            provider.disconnect()
+
+        threads = [threading.Thread(target=get_types, args=(self.db.clone(),)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [["beam_current", "event_count"]] * 8)
+        self.assertEqual(registry.version, 1)    # loaded once, by one of the threads
+
+    def test_in_memory(self):
+        """In-memory SQLite databases are different for each connection"""
+        self.assertIsNot(get_registry("sqlite://"), get_registry("sqlite://"))
+        self.assertIs(get_registry(self.connection_string), get_registry(self.connection_string))
+        self.assertIsInstance(get_registry("sqlite:///:memory:"), ConditionTypeRegistry)
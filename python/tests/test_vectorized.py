@@ -0,0 +1,84 @@
+import sys
+import unittest
+
+import rcdb
+from rcdb.model import ConditionType
+from rcdb.provider import destroy_all_create_schema, vector_eval
+
+
+if vector_eval is None:
+    sys.stderr.write("WARNING: numpy is not installed, vectorized select_values tests are skipped\n")
+
+# python 2 divides integers with floor: a / 2 > 1 doesn't select a == 3
+_classic_division = sys.version_info[0] < 3
+
+
+@unittest.skipIf(vector_eval is None, "numpy is not installed")
+class TestVectorizedSelectValues(unittest.TestCase):
+    """ Tests select_values(..., vectorized=True) gives the same result as row by row python eval"""
+
+    def setUp(self):
+        self.db = rcdb.RCDBProvider("sqlite://", check_version=False)
+        destroy_all_create_schema(self.db)
+        for i in [1, 2, 3, 4, 5, 9]:
+            self.db.create_run(i)
+
+        self.db.create_condition_type("a", ConditionType.INT_FIELD, "Test condition 'a'")
+        self.db.create_condition_type("b", ConditionType.FLOAT_FIELD, "Test condition 'b'")
+        self.db.create_condition_type("c", ConditionType.BOOL_FIELD, "Test condition 'c'")
+        self.db.create_condition_type("d", ConditionType.STRING_FIELD, "Test condition 'd'")
+
+        for run, a in [(1, 1), (2, 2), (3, 3), (4, 4), (9, 9)]:
+            self.db.add_condition(run, "a", a)
+        for run, b in [(1, 1.01), (2, 7.0/3.0), (3, 2.55), (4, 1.64), (5, 2.32), (9, 2.02)]:
+            self.db.add_condition(run, "b", b)
+        for run, c in [(1, False), (2, True), (3, True), (4, True), (5, False), (9, True)]:
+            self.db.add_condition(run, "c", c)
+        for run, d in [(1, "haha"), (4, "hoho"), (5, "bang"), (9, "mew")]:
+            self.db.add_condition(run, "d", d)
+
+        """
+        run |     a     |     b     |     c     |      d
+        ------------------------------------------------------
+          1 | 1         | 1.01      | False     | haha
+          2 | 2         | 2.333...  | True      | None
+          3 | 3         | 2.55      | True      | None
+          4 | 4         | 1.64      | True      | hoho
+          5 | None      | 2.32      | False     | bang
+          9 | 9         | 2.02      | True      | mew
+        """
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def assert_selects(self, query, awaited_run_numbers):
+        rows = self.db.select_values(['b', 'd'], query)
+        vectorized_rows = self.db.select_values(['b', 'd'], query, vectorized=True)
+        self.assertEqual(vectorized_rows.rows, rows.rows)
+        self.assertEqual([row[0] for row in vectorized_rows], awaited_run_numbers)
+
+    def test_math_functions(self):
+        self.assert_selects("a > 0 and math.sqrt(a) > 1.5", [3, 4, 9])
+        self.assert_selects("b < math.pi / 1.2", [1, 2, 3, 4, 5, 9])
+
+    def test_arithmetic(self):
+        self.assert_selects("a > 0 and a / 2 > 1", [4, 9] if _classic_division else [3, 4, 9])
+        self.assert_selects("a > 0 and a / 2.0 > 1", [3, 4, 9])
+        self.assert_selects("a > 0 and a % 2 == 1 and b > 2", [3, 9])
+        self.assert_selects("c + c == 2 and a ** 2 > 5", [3, 4, 9])
+
+    def test_strings(self):
+        self.assert_selects("d and 'o' in d", [4])
+        self.assert_selects("a > 1 and d and d.startswith('m')", [9])
+        self.assert_selects("d in ['haha', 'bang'] or a / 3 == 1", [1, 3, 4, 5] if _classic_division else [1, 3, 5])
+
+    def test_none_values(self):
+        """Operations that raise in python for None values don't select the run"""
+        rows = self.db.select_values([], "a / 2 > 0.5", vectorized=True)
+        self.assertEqual([row[0] for row in rows], [2, 3, 4, 9])
+
+        rows = self.db.select_values([], "'a' in d or a / 2 == 1", vectorized=True)
+        self.assertEqual([row[0] for row in rows], [1, 2, 3, 5] if _classic_division else [1, 2, 5])
+
+    def test_empty_result(self):
+        self.assert_selects("a > 100 and math.sqrt(a) > 1", [])
@@ -0,0 +1,160 @@
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sqlalchemy.exc import OperationalError
+
+import rcdb
+from rcdb.errors import WriteBehindQueueFull
+from rcdb.model import ConditionType
+from rcdb.provider import destroy_all_create_schema
+from rcdb.write_behind import WriteBehindQueue, read_spill_file
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+    """ Tests WriteBehindQueue with a test write function"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.spill_path = os.path.join(self.temp_dir, "spill.jsonl")
+        self.written = []
+        self.is_db_down = False
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, values_by_run):
+        if self.is_db_down:
+            raise OperationalError("INSERT", {}, Exception("Can't connect to MySQL server"))
+        for run_number, key_values in values_by_run.items():
+            if run_number < 0:
+                raise ValueError("No run {}".format(run_number))
+        self.written.append(values_by_run)
+
+    def test_coalesce(self):
+        """Only the last value of (run, condition) is written"""
+        queue = WriteBehindQueue(self.write)
+        queue.put(1, "event_count", 10)
+        queue.put(1, "event_count", 20)
+        queue.put(2, "event_count", 5)
+        queue.put(1, "beam_current", 1.5)
+        self.assertEqual(len(queue), 3)
+
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.written, [{1: [("event_count", 20), ("beam_current", 1.5)], 2: [("event_count", 5)]}])
+        self.assertEqual(len(queue), 0)
+
+    def test_background_flush(self):
+        """The thread flushes when flush_size values are queued"""
+        queue = WriteBehindQueue(self.write, interval=60, flush_size=2)
+        queue.start()
+        try:
+            queue.put(1, "event_count", 10)
+            queue.put(2, "event_count", 20)
+            for _ in range(100):
+                if self.written:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(self.written, [{1: [("event_count", 10)], 2: [("event_count", 20)]}])
+        finally:
+            queue.close()
+
+    def test_close_flushes(self):
+        queue = WriteBehindQueue(self.write, interval=60)
+        queue.start()
+        queue.put(1, "event_count", 10)
+        self.assertTrue(queue.close())
+        self.assertFalse(queue.is_running)
+        self.assertEqual(self.written, [{1: [("event_count", 10)]}])
+        self.assertRaises(RuntimeError, queue.put, 1, "event_count", 11)
+
+    def test_requeue_if_db_is_down(self):
+        queue = WriteBehindQueue(self.write)
+        queue.put(1, "event_count", 10)
+        self.is_db_down = True
+        self.assertFalse(queue.flush())
+        queue.put(1, "event_count", 11)    # newer value replaces the one put back
+
+        self.is_db_down = False
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.written, [{1: [("event_count", 11)]}])
+
+    def test_spill(self):
+        """Values are saved to the spill file and are written by the next queue"""
+        start_time = datetime.datetime(2017, 5, 1, 12, 30, 15, 123)
+        queue = WriteBehindQueue(self.write, spill_path=self.spill_path)
+        queue.put(1, "event_count", 10)
+        queue.put(1, "run_start_time", start_time)
+        self.is_db_down = True
+        self.assertFalse(queue.close())
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(list(read_spill_file(self.spill_path).items()),
+                         [((1, "event_count"), 10), ((1, "run_start_time"), start_time)])
+
+        self.is_db_down = False
+        queue = WriteBehindQueue(self.write, spill_path=self.spill_path)
+        queue.put(1, "event_count", 12)
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.written, [{1: [("event_count", 12), ("run_start_time", start_time)]}])
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_bad_run_is_dropped(self):
+        queue = WriteBehindQueue(self.write)
+        queue.put(1, "event_count", 10)
+        queue.put(-1, "event_count", 10)
+        queue.put(2, "event_count", 20)
+        self.assertTrue(queue.flush())
+        self.assertEqual(self.written, [{1: [("event_count", 10)]}, {2: [("event_count", 20)]}])
+
+    def test_full_queue(self):
+        """Without the thread, put to the full queue flushes it or raises if the DB is down"""
+        queue = WriteBehindQueue(self.write, max_size=2)
+        queue.put(1, "a", 1)
+        queue.put(1, "b", 2)
+        queue.put(1, "a", 3)    # coalesced, no flush
+        self.assertEqual(self.written, [])
+        queue.put(1, "c", 4)
+        self.assertEqual(self.written, [{1: [("a", 3), ("b", 2)]}])
+
+        self.is_db_down = True
+        queue.put(1, "d", 5)
+        self.assertRaises(WriteBehindQueueFull, queue.put, 1, "e", 6)
+
+
+class TestProviderWriteBehind(unittest.TestCase):
+    """ Tests ConfigurationProvider in write-behind mode"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = rcdb.ConfigurationProvider("sqlite:///" + os.path.join(self.temp_dir, "test.db"),
+                                             check_version=False)
+        destroy_all_create_schema(self.db)
+        self.db.create_condition_type("event_count", ConditionType.INT_FIELD, "Number of events")
+        self.db.create_condition_type("beam_current", ConditionType.FLOAT_FIELD, "Beam current")
+        self.db.create_run(1)
+
+    def tearDown(self):
+        self.db.disconnect()
+        shutil.rmtree(self.temp_dir)
+
+    def test_upsert(self):
+        self.db.enable_write_behind(interval=60)
+        self.db.upsert_conditions({1: {"event_count": 10, "beam_current": 1.5}})
+        self.db.upsert_conditions({1: {"event_count": "20"}})
+        self.assertIsNone(self.db.get_condition(1, "event_count"))
+        self.assertEqual(len(self.db.write_behind), 2)
+
+        # Values are validated before they are queued
+        self.assertRaises(ValueError, self.db.upsert_conditions, {1: {"event_count": "many"}})
+
+        self.assertTrue(self.db.disable_write_behind())
+        self.db.session.expire_all()
+        self.assertEqual(self.db.get_condition(1, "event_count").value, 20)
+        self.assertEqual(self.db.get_condition(1, "beam_current").value, 1.5)
+
+        # Synchronous again
+        self.db.upsert_conditions({1: {"event_count": 30}})
+        self.assertEqual(self.db.get_condition(1, "event_count").value, 30)
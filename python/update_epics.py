@@ -411,7 +411,8 @@ def update_rcdb_conds(db, run, reason):
     for (key, value) in conditions.items():
         log.debug(Lf("Adding cnd '{}'='{}'", key, value))
 
-    db.add_conditions(run, conditions, True)
+    # One upsert statement, no selects of existing values (this is called each minute)
+    db.upsert_conditions({run: conditions})
 
     log.debug("Committed to DB. End of update_rcdb_conds()")
     return conditions
@@ -1,10 +1,10 @@
 import json
 import logging
-import os
+from multiprocessing.pool import ThreadPool
 
 from rcdb import UpdateContext, UpdateReasons, DefaultConditions
 from halld_rcdb.run_config_parser import HallDMainConfigParseResult
-from halld_rcdb.roc_config_finder import find_roc_configuration_files
+from halld_rcdb.roc_files_pipeline import find_roc_file_paths, read_files
 from rcdb.log_format import BraceMessage as Lf
 from rcdb.model import ConfigurationFile
 from rcdb.provider import RCDBProvider
@@ -14,10 +14,11 @@ from rcdb.provider import RCDBProvider
 log = logging.getLogger('rcdb.update_roc')         # create run configuration standard logger
 
 
-def add_roc_configuration_files(context, parse_result):
+def add_roc_configuration_files(context, parse_result, threads=1):
     """
     Finds and adds ROC configuration files
 
+    :param threads: number of threads that read and hash the files. 1 - read them in this thread
     :return: None
     """
 
@@ -29,18 +30,22 @@ def add_roc_configuration_files(context, parse_result):
     assert isinstance(context.db, RCDBProvider)
     db = context.db
 
-    infos = []
+    file_paths = []
 
     try:
-        infos = find_roc_configuration_files(parse_result)
+        file_paths = find_roc_file_paths(parse_result)
     except Exception as ex:
         log.error("Error finding roc configuration files, '{}'".format(ex))
 
-    for info in infos:
-        log.debug(Lf("Adding roc configuration files for '{}'", info.name))
-        for file_path in info.final_files:
-            if os.path.isfile(file_path) and os.access(file_path, os.R_OK):
-                log.debug(Lf("Adding roc configuration files for '{}'", file_path))
-                db.add_configuration_file(context.run.number,
-                                          file_path,
-                                          importance=ConfigurationFile.IMPORTANCE_LOW)
+    # Files are read (concurrently if threads > 1) and then saved in one transaction
+    pool = ThreadPool(threads) if threads > 1 and len(file_paths) > 1 else None
+    try:
+        files = read_files(file_paths, pool)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    log.debug(Lf("{} roc configuration files are read", len(files)))
+
+    db.add_configuration_files(context.run.number, file_paths, importance=ConfigurationFile.IMPORTANCE_LOW,
+                               read_files=files)
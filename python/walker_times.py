@@ -24,10 +24,17 @@ if __name__ == "__main__":
 
     # get all runs
     runs = db.get_runs(0, sys.maxint)
+    values_by_run = {}
     for run in runs:
         print (run.number)
+        values = {}
         if run.start_time:
-            db.add_condition(run, DefaultConditions.RUN_START_TIME, run.start_time)
+            values[DefaultConditions.RUN_START_TIME] = run.start_time
         if run.end_time:
-            db.add_condition(run, DefaultConditions.RUN_END_TIME, run.end_time)
+            values[DefaultConditions.RUN_END_TIME] = run.end_time
+        if values:
+            values_by_run[run.number] = values
+
+    # write all values in one transaction
+    db.add_conditions_bulk(values_by_run)
 
@@ -1,3 +1,5 @@
+import threading
+
 from rcdb.alias import get_default_aliases_by_name
 from rcdb.model import Run
 from flask import Flask, render_template, g, request, url_for
@@ -5,30 +7,76 @@ import rcdb
 from datetime import datetime
 
 # configuration
-from sqlalchemy.orm import subqueryload
+from sqlalchemy.orm import subqueryload, scoped_session, sessionmaker
 
 DEBUG = True
 SECRET_KEY = 'development key'
 USERNAME = 'admin'
 PASSWORD = 'default'
 SQL_CONNECTION_STRING = "mysql+pymysql://rcdb@127.0.0.1/rcdb"
+SQL_POOL_SIZE = 10          # MySQL connections kept open by the process
+SQL_MAX_OVERFLOW = 10       # connections opened above SQL_POOL_SIZE under load (closed when returned)
+SQL_POOL_RECYCLE = 3600     # seconds. Older connections are reopened (MySQL closes idle ones after wait_timeout)
 
 app = Flask(__name__)
 app.config.from_object(__name__)
+app.jinja_env.globals['datetime_now'] = datetime.now
+
+# The process has one connected provider (engine, connection pool, condition types).
+# Each request gets a clone of it with the session of scoped_session
+_db = None
+_db_connection_string = None
+_db_sessions = None
+_db_lock = threading.Lock()
+
+
+def get_engine_options(connection_string):
+    """Connection pool settings from the config. SQLite doesn't use them"""
+    if not connection_string.startswith("mysql"):
+        return {}
+    return {"pool_size": app.config["SQL_POOL_SIZE"],
+            "max_overflow": app.config["SQL_MAX_OVERFLOW"],
+            "pool_recycle": app.config["SQL_POOL_RECYCLE"]}
+
+
+def get_db():
+    """ Connects the process provider once: creates the engine, checks the schema version and loads condition types
+
+    Connects again if SQL_CONNECTION_STRING is changed
+    """
+    global _db, _db_connection_string, _db_sessions
+
+    connection_string = app.config["SQL_CONNECTION_STRING"]
+    if _db is not None and _db_connection_string == connection_string:
+        return _db
+
+    with _db_lock:
+        if _db is None or _db_connection_string != connection_string:
+            db = rcdb.ConfigurationProvider()
+            db.connect(connection_string, engine_options=get_engine_options(connection_string))
+            db.get_condition_types()
+            db.session.close()
+
+            if _db is not None:
+                _db_sessions.remove()
+                _db.engine.dispose()
+
+            _db_sessions = scoped_session(sessionmaker(bind=db.engine))
+            _db_connection_string = connection_string
+            _db = db
+    return _db
 
 
 @app.before_request
 def before_request():
-    g.tdb = rcdb.ConfigurationProvider()
-    g.tdb.connect(app.config["SQL_CONNECTION_STRING"])
-    app.jinja_env.globals['datetime_now'] = datetime.now
+    db = get_db()
+    g.tdb = db.clone(session=_db_sessions())
 
 
 @app.teardown_request
 def teardown_request(exception):
-    tdb = getattr(g, 'db', None)
-    if tdb:
-        tdb.close()
+    if getattr(g, 'tdb', None) is not None and _db_sessions is not None:
+        _db_sessions.remove()
 
 
 @app.errorhandler(404)
@@ -74,12 +122,12 @@ def url_for_other_page(page):
 app.jinja_env.globals['url_for_other_page'] = url_for_other_page
 app.jinja_env.globals['rcdb_default_alias'] = rcdb.alias.default_aliases
 # register modules
-from runs.views import mod as runs_module
-from logs.views import mod as logs_module
-from files.views import mod as files_module
+from .runs.views import mod as runs_module
+from .logs.views import mod as logs_module
+from .files.views import mod as files_module
 
-from statistics.views import mod as statistics_module
-from conditions.views import mod as conditions_module
+from .statistics.views import mod as statistics_module
+from .conditions.views import mod as conditions_module
 
 
 app.register_blueprint(runs_module)
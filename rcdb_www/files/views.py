@@ -1,5 +1,6 @@
-from flask import Blueprint, request, render_template, flash, g, session, redirect, url_for, Response
+from flask import Blueprint, request, render_template, flash, g, session, redirect, url_for, Response, make_response
 from rcdb.model import ConfigurationFile
+from rcdb_www.http_cache import make_etag, not_modified, set_validators
 #from werkzeug import check_password_hash, generate_password_hash
 
 #from app import db
@@ -15,11 +16,30 @@ def index():
     return render_template("files/index.html", parm="hahaha")
     pass
 
+def get_file_etag(file_db_id):
+    """ETag of the file pages or None if there is no such file.
+
+    add_configuration_file(..., overwrite=True) replaces the content (and sha256) of the same id,
+    so the pages are checked by the browser every time (no-cache) and the ETag changes with sha256
+    """
+    row = g.tdb.session.query(ConfigurationFile.sha256, ConfigurationFile.path) \
+        .filter(ConfigurationFile.id == file_db_id) \
+        .first()
+    return make_etag("files", file_db_id, row.sha256, row.path) if row is not None else None
+
+
 @mod.route('/info/<int:file_db_id>')
 def info(file_db_id):
     #try:
+        etag = get_file_etag(file_db_id)
+        if etag is not None:
+            response = not_modified(etag)
+            if response is not None:
+                return response
+
         file = g.tdb.session.query(ConfigurationFile).filter(ConfigurationFile.id == file_db_id).one()
-        return render_template("files/info.html", file=file)
+        response = make_response(render_template("files/info.html", file=file))
+        return set_validators(response, etag) if etag is not None else response
     # except:
     #     return render_template("files/not_found.html", id=file_db_id)
     # pass
@@ -27,6 +47,16 @@ def info(file_db_id):
 @mod.route('/raw/<int:file_db_id>')
 def raw(file_db_id):
 
-    content = g.tdb.session.query(ConfigurationFile.content).filter(ConfigurationFile.id == file_db_id).scalar()
+    etag = get_file_etag(file_db_id)
+    if etag is not None:
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+    # content is decompressed from the blob if the file is stored in file_blobs
+    file = g.tdb.session.query(ConfigurationFile).filter(ConfigurationFile.id == file_db_id).first()
+    content = file.content if file is not None else None
     resp = Response(response=content, status=200, mimetype="text/plain")
+    if etag is not None:
+        set_validators(resp, etag)
     return resp
\ No newline at end of file
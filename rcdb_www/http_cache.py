@@ -0,0 +1,88 @@
+"""
+HTTP conditional requests for pages that rarely change
+
+Pages of old runs and stored files are mostly the same for every reload. A view computes a cheap ETag
+(and Last-Modified if it has a time) from the database and answers '304 Not Modified' before
+rendering the template if the browser has the same version:
+
+    etag = make_etag("run_info", run_number, stamp)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    ...
+    return set_validators(make_response(render_template(...)), etag, last_modified)
+
+ETags include the version of templates (the newest modification time of template files),
+so pages are rendered again after templates are changed.
+"""
+
+import hashlib
+import os
+from calendar import timegm
+from datetime import datetime
+from time import mktime
+
+from flask import request, current_app
+
+_templates_version = None
+
+
+def get_templates_version():
+    """The newest modification time of the app templates. It is the same for all processes of the app"""
+    global _templates_version
+    if _templates_version is None:
+        newest = 0
+        for folder, _, file_names in os.walk(os.path.join(current_app.root_path, current_app.template_folder)):
+            for file_name in file_names:
+                newest = max(newest, os.path.getmtime(os.path.join(folder, file_name)))
+        _templates_version = int(newest)
+    return _templates_version
+
+
+def make_etag(*parts):
+    """Makes ETag from the parts that identify the page content (names, ids, hashes, times)"""
+    return hashlib.sha1(repr((get_templates_version(),) + parts).encode("utf-8")).hexdigest()
+
+
+def to_http_time(local_time):
+    """ Converts local time (as the times are saved in RCDB) to UTC for Last-Modified header
+
+    :return: naive UTC datetime with no microseconds or None
+    """
+    if local_time is None:
+        return None
+    return datetime.utcfromtimestamp(int(mktime(local_time.timetuple())))
+
+
+def not_modified(etag, last_modified=None):
+    """ Returns '304 Not Modified' response if the browser has the page with the etag, None otherwise
+
+    If-Modified-Since is checked only if the browser doesn't send If-None-Match.
+    The response has the same headers as the page (see set_validators)
+
+    :param last_modified: naive UTC datetime (see to_http_time)
+    """
+    if request.if_none_match:
+        is_same = request.if_none_match.contains(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        is_same = timegm(last_modified.timetuple()) <= timegm(request.if_modified_since.utctimetuple())
+    else:
+        is_same = False
+
+    if not is_same:
+        return None
+
+    response = current_app.response_class(status=304)
+    return set_validators(response, etag, last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    """ Sets ETag, Last-Modified and Cache-Control headers
+
+    Cache-Control is 'no-cache': the browser may keep the page but checks it every time
+    """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -40,3 +40,26 @@ class Pagination(object):
                     yield None
                 yield num
                 last = num
+
+
+class KeysetPagination(object):
+    """ Pages of runs by run number instead of page offsets: 'newer' and 'older' than the shown runs
+
+    Selecting a page costs the same however deep it is. The links are made by the view
+    """
+
+    is_keyset = True
+
+    def __init__(self, per_page, total_count, newer_url=None, older_url=None):
+        self.per_page = per_page
+        self.total_count = total_count
+        self.newer_url = newer_url
+        self.older_url = older_url
+
+    @property
+    def has_prev(self):
+        return self.newer_url is not None
+
+    @property
+    def has_next(self):
+        return self.older_url is not None
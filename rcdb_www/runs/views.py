@@ -5,16 +5,19 @@ from time import mktime, time
 
 import datetime
 
-from flask import Blueprint, request, render_template, flash, g, session, redirect, url_for, Response, jsonify
+from flask import Blueprint, request, render_template, flash, g, session, redirect, url_for, Response, jsonify, \
+    make_response
 # from werkzeug import check_password_hash, generate_password_hash
 import rcdb
 from collections import defaultdict
 from rcdb import DefaultConditions
 from rcdb.model import Run, Condition, ConditionType, ConfigurationFile
 from rcdb.stopwatch import StopWatchTimer
-from rcdb_www.pagination import Pagination
+from rcdb_www.pagination import Pagination, KeysetPagination
+from rcdb_www.http_cache import make_etag, not_modified, set_validators, to_http_time
 from sqlalchemy import func
 from sqlalchemy.orm import subqueryload, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 
 mod = Blueprint('runs', __name__, url_prefix='/runs')
 
@@ -28,6 +31,78 @@ def natural_sort_key(l):
 
 PER_PAGE = 200
 
+RUN_TABLE_CONDITIONS = [DefaultConditions.IS_VALID_RUN_END,
+                        DefaultConditions.EVENT_COUNT,
+                        DefaultConditions.RUN_CONFIG,
+                        DefaultConditions.RUN_TYPE,
+                        DefaultConditions.USER_COMMENT]
+"""Conditions shown by default_run_table.html"""
+
+RUNS_COUNT_CACHE_SECONDS = 60
+_runs_count_cache = {}      # connection string => (time, count)
+
+
+def get_runs_count():
+    """Total number of runs. It is cached for RUNS_COUNT_CACHE_SECONDS, so it is approximate"""
+    cached = _runs_count_cache.get(g.tdb.connection_string)
+    if cached is not None and time() - cached[0] < RUNS_COUNT_CACHE_SECONDS:
+        return cached[1]
+
+    count = g.tdb.session.query(func.count(Run.number)).scalar()
+    _runs_count_cache[g.tdb.connection_string] = (time(), count)
+    return count
+
+
+def load_run_table_conditions(runs):
+    """ Loads only RUN_TABLE_CONDITIONS of the runs by one query
+
+    subqueryload(Run.conditions) loads all conditions including big JSON ones (component_stats, etc.).
+    After this function run.conditions contain only the conditions shown by the run table
+    """
+    cnd_types_by_name = g.tdb.get_condition_types_by_name()
+    type_ids = [cnd_types_by_name[name].id for name in RUN_TABLE_CONDITIONS if name in cnd_types_by_name]
+
+    conditions_by_run = defaultdict(list)
+    if runs and type_ids:
+        numbers = set(run.number for run in runs)
+        query = g.tdb.session.query(Condition) \
+            .filter(Condition.run_number >= min(numbers), Condition.run_number <= max(numbers)) \
+            .filter(Condition.condition_type_id.in_(type_ids))
+        for condition in query:
+            if condition.run_number in numbers:
+                conditions_by_run[condition.run_number].append(condition)
+
+    for run in runs:
+        set_committed_value(run, 'conditions', conditions_by_run[run.number])
+
+
+def get_runs_page(page, before, after):
+    """ Selects PER_PAGE runs in descending order
+
+    :param before: select runs older than this run number (keyset 'Older' link)
+    :param after: select runs newer than this run number (keyset 'Newer' link)
+    :param page: page number for old /page/<page> links (uses OFFSET) if before and after are None
+    :return: (runs, has_newer, has_older)
+    """
+    query = g.tdb.session.query(Run)
+
+    if after is not None:
+        rows = query.filter(Run.number > after).order_by(Run.number.asc()).limit(PER_PAGE + 1).all()
+        if len(rows) > PER_PAGE:
+            return list(reversed(rows[:PER_PAGE])), True, True
+        before = None       # less than a page of newer runs - show the first page
+
+    elif before is not None:
+        query = query.filter(Run.number < before)
+
+    query = query.order_by(Run.number.desc())
+    if after is None and before is None and page > 1:
+        query = query.offset((page - 1) * PER_PAGE)
+
+    rows = query.limit(PER_PAGE + 1).all()
+    has_newer = before is not None or (after is None and page > 1)
+    return rows[:PER_PAGE], has_newer, len(rows) > PER_PAGE
+
 
 @mod.route('/', defaults={'page': 1, 'run_from': -1, 'run_to': -1})
 @mod.route('/page/<int:page>', defaults={'run_from': -1, 'run_to': -1})
@@ -38,7 +113,9 @@ def index(page, run_from, run_to):
     preparation_sw = StopWatchTimer()
 
     condition_types = g.tdb.get_condition_types()
-    query = g.tdb.session.query(Run)
+
+    preparation_sw.stop()
+    query_sw = StopWatchTimer()
 
     # Run range is defined?
     if run_from != -1 and run_to != -1:
@@ -48,26 +125,24 @@ def index(page, run_from, run_to):
         if run_max < run_min:
             run_min, run_max = run_max, run_min
 
-        # Filter query and count results
-        query = query.filter(Run.number >= run_min, Run.number <= run_max)
-        count = g.tdb.session.query(func.count(Run.number)).filter(Run.number >= run_min, Run.number <= run_max).scalar()
-
-        # we don't want pagination in this case, setting page size same/bigger than count
-        per_page = run_max - run_min
+        # we don't want pagination in this case, all runs of the range are shown
+        runs = g.tdb.session.query(Run) \
+            .filter(Run.number >= run_min, Run.number <= run_max) \
+            .order_by(Run.number.desc()) \
+            .all()
+        pagination = KeysetPagination(max(len(runs), 1), len(runs))
     else:
-        count = g.tdb.session.query(func.count(Run.number)).scalar()
-        per_page = PER_PAGE
-
-    # Create pagination
-    pagination = Pagination(page, per_page, count)
-
-    preparation_sw.stop()
-    query_sw = StopWatchTimer()
-    # Get runs from query
-    runs = query.options(subqueryload(Run.conditions))\
-        .order_by(Run.number.desc())\
-        .slice(pagination.item_limit_from, pagination.item_limit_to)\
-        .all()
+        runs, has_newer, has_older = get_runs_page(page,
+                                                   request.args.get('before', type=int),
+                                                   request.args.get('after', type=int))
+        newer_url = older_url = None
+        if has_newer:
+            newer_url = url_for('.index', after=runs[0].number) if runs else url_for('.index')
+        if has_older:
+            older_url = url_for('.index', before=runs[-1].number)
+        pagination = KeysetPagination(PER_PAGE, get_runs_count(), newer_url, older_url)
+
+    load_run_table_conditions(runs)
     query_sw.stop()
     performance = {
         "preparation": preparation_sw.elapsed,
@@ -86,14 +161,38 @@ def index(page, run_from, run_to):
                            performance=performance)
 
 
+def get_conditions_stamp(run_number):
+    """(count, max(id), max(created)) of the run conditions. Changes if a condition is added, updated or deleted"""
+    return g.tdb.session.query(func.count(Condition.id), func.max(Condition.id), func.max(Condition.created)) \
+        .filter(Condition.run_number == run_number) \
+        .one()
+
+
+def get_files_stamp(run_number):
+    """(count, max(files.id)) of the run files"""
+    files_have_runs = Run.files.property.secondary
+    return g.tdb.session.query(func.count(files_have_runs.c.files_id), func.max(files_have_runs.c.files_id)) \
+        .filter(files_have_runs.c.run_number == run_number) \
+        .one()
+
+
 @mod.route('/conditions/<int:run_number>')
 def conditions(run_number):
+    # The page is the same while the run conditions are the same
+    conditions_stamp = tuple(get_conditions_stamp(run_number))
+    etag = make_etag("runs.conditions", run_number, conditions_stamp)
+    last_modified = to_http_time(conditions_stamp[2])
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
     run = g.tdb.session. \
         query(Run). \
         options(subqueryload(Run.conditions)). \
         filter_by(number=int(run_number)).one()
 
-    return render_template("runs/conditions.html", run=run)
+    response = make_response(render_template("runs/conditions.html", run=run))
+    return set_validators(response, etag, last_modified)
 
 
 @mod.route('/info/<int:run_number>')
@@ -102,15 +201,29 @@ def info(run_number):
     :param run_number:
     """
 
+    prev_run = g.tdb.get_prev_run(run_number)
+    next_run = g.tdb.get_next_run(run_number)
+
+    # The page is the same while the run, its conditions, files and neighbours are the same
+    run_times = g.tdb.session.query(Run.start_time, Run.end_time).filter(Run.number == run_number).first()
+    etag = last_modified = None
+    if run_times is not None:
+        conditions_stamp = tuple(get_conditions_stamp(run_number))
+        etag = make_etag("runs.info", run_number, tuple(run_times), conditions_stamp,
+                         tuple(get_files_stamp(run_number)),
+                         prev_run.number if prev_run else None,
+                         next_run.number if next_run else None)
+        last_modified = to_http_time(conditions_stamp[2])
+        response = not_modified(etag, last_modified)
+        if response is not None:
+            return response
+
     run = g.tdb.session \
         .query(Run) \
         .options(subqueryload(Run.conditions)) \
         .filter(Run.number == run_number) \
         .first()
 
-    prev_run = g.tdb.get_prev_run(run_number)
-    next_run = g.tdb.get_next_run(run_number)
-
     if not isinstance(run, Run):
         return render_template("runs/not_found.html", run_number=run_number, prev_run=prev_run, next_run=next_run)
 
@@ -134,18 +247,21 @@ def info(run_number):
         else:
             other_files.append(conf_file)
 
-    return render_template("runs/info.html",
-                           run=run,
-                           conditions=sorted_conditions,
-                           conditions_by_name=conditions_by_name,
-                           component_stats=component_stats,
-                           component_sorted_keys=component_sorted_keys,
-                           DefaultConditions=rcdb.DefaultConditions,
-                           prev_run=prev_run,
-                           next_run=next_run,
-                           important_files=important_files,
-                           other_files=other_files
-                           )
+    response = make_response(render_template("runs/info.html",
+                                             run=run,
+                                             conditions=sorted_conditions,
+                                             conditions_by_name=conditions_by_name,
+                                             component_stats=component_stats,
+                                             component_sorted_keys=component_sorted_keys,
+                                             DefaultConditions=rcdb.DefaultConditions,
+                                             prev_run=prev_run,
+                                             next_run=next_run,
+                                             important_files=important_files,
+                                             other_files=other_files
+                                             ))
+    if etag is None:
+        return response
+    return set_validators(response, etag, last_modified)
 
 
 @mod.route('/elog/<int:run_number>')
@@ -212,6 +328,7 @@ def _parse_run_range(run_range_str):
 def search():
     run_range = request.args.get('rr', '')
     search_query = request.args.get('q', '')
+    is_explain = bool(request.args.get('explain', ''))
 
     run_from_str = request.args.get('runFrom', '')
     run_to_str = request.args.get('runTo', '')
@@ -237,7 +354,7 @@ def search():
         run_to = sys.maxint
 
     try:
-        result = g.tdb.select_runs(search_query, run_to, run_from, sort_desc=True)
+        result = g.tdb.select_runs(search_query, run_to, run_from, sort_desc=True, explain=is_explain)
     except Exception as err:
         flash("Error in performing request: {}".format(err), 'danger')
         return redirect(url_for('.index'))
@@ -253,13 +370,15 @@ def search():
                            run_from=run_from,
                            run_to=run_to if run_to != sys.maxint else -1,
                            search_query=search_query,
-                           performance=result.performance)
+                           performance=result.performance,
+                           explain=result.explain)
 
 
 @mod.route('/search2', methods=['GET'])
 def search2():
     run_range = request.args.get('rr', '')
     search_query = request.args.get('q', '')
+    is_explain = bool(request.args.get('explain', ''))
     columns = request.args.get('c', '')
 
     columns = columns.split(',')
@@ -287,7 +406,7 @@ def search2():
         run_to = sys.maxint
 
     try:
-        result = g.tdb.select_runs(search_query, run_to, run_from, sort_desc=True)
+        result = g.tdb.select_runs(search_query, run_to, run_from, sort_desc=True, explain=is_explain)
     except Exception as err:
         flash("Error in performing request: {}".format(err), 'danger')
         return redirect(url_for('.index'))
@@ -317,6 +436,7 @@ def search2():
                            run_to=run_to if run_to != sys.maxint else -1,
                            search_query=search_query,
                            performance=result.performance,
+                           explain=result.explain,
                            columns=columns)
 
 
@@ -1,3 +1,5 @@
+-- Schema version 1. New databases should be created with create-v03.sql
+
 -- MySQL Script generated by MySQL Workbench
 -- Sat Apr 21 18:34:00 2018
 -- Model: New Model    Version: 1.0
@@ -0,0 +1,144 @@
+-- Creates RCDB MySQL schema version 3 in the current database
+-- The same schema is created by python/create_empty_db.py (rcdb.provider.destroy_all_create_schema)
+--
+-- Version 2 adds unique key on conditions (run_number, condition_type_id), see update-v01-v02.sql
+-- Version 3 adds file_blobs table and nullable files.content, see update-v02-v03.sql
+
+SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0;
+SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0;
+SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='TRADITIONAL,ALLOW_INVALID_DATES';
+
+-- -----------------------------------------------------
+-- Table `condition_types`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `condition_types` (
+  `id` INT(11) NOT NULL AUTO_INCREMENT,
+  `name` VARCHAR(255) NOT NULL,
+  `value_type` VARCHAR(6) NOT NULL,
+  `created` DATETIME NULL DEFAULT NULL,
+  `description` VARCHAR(255) NULL DEFAULT NULL,
+  PRIMARY KEY (`id`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = latin1;
+
+
+-- -----------------------------------------------------
+-- Table `runs`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `runs` (
+  `number` INT(11) NOT NULL,
+  `started` DATETIME NULL DEFAULT NULL,
+  `finished` DATETIME NULL DEFAULT NULL,
+  PRIMARY KEY (`number`),
+  UNIQUE INDEX `number` (`number` ASC))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = latin1;
+
+
+-- -----------------------------------------------------
+-- Table `conditions`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `conditions` (
+  `id` INT(11) NOT NULL AUTO_INCREMENT,
+  `text_value` TEXT NULL DEFAULT NULL,
+  `int_value` INT(11) NOT NULL,
+  `float_value` FLOAT NOT NULL,
+  `bool_value` TINYINT(1) NOT NULL,
+  `time_value` DATETIME NULL DEFAULT NULL,
+  `run_number` INT(11) NULL DEFAULT NULL,
+  `condition_type_id` INT(11) NULL DEFAULT NULL,
+  `created` DATETIME NULL DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  INDEX `condition_type_id` (`condition_type_id` ASC),
+  INDEX `run_number` (`run_number` ASC),
+  UNIQUE INDEX `run_number_condition_type_id` (`run_number` ASC, `condition_type_id` ASC),
+  CONSTRAINT `conditions_ibfk_1`
+    FOREIGN KEY (`condition_type_id`)
+    REFERENCES `condition_types` (`id`),
+  CONSTRAINT `conditions_ibfk_2`
+    FOREIGN KEY (`run_number`)
+    REFERENCES `runs` (`number`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = latin1;
+
+
+-- -----------------------------------------------------
+-- Table `files`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `files` (
+  `id` INT(11) NOT NULL AUTO_INCREMENT,
+  `path` TEXT NOT NULL,
+  `sha256` VARCHAR(44) NOT NULL,
+  `content` TEXT NULL DEFAULT NULL,
+  `description` VARCHAR(255) NULL DEFAULT NULL,
+  `importance` INT(11) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`id`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = latin1;
+
+
+-- -----------------------------------------------------
+-- Table `file_blobs`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `file_blobs` (
+  `sha256` VARCHAR(44) NOT NULL,
+  `compression` VARCHAR(8) NOT NULL,
+  `size` INT(11) NOT NULL,
+  `data` LONGBLOB NOT NULL,
+  PRIMARY KEY (`sha256`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = latin1;
+
+
+-- -----------------------------------------------------
+-- Table `files_have_runs`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `files_have_runs` (
+  `files_id` INT(11) NULL DEFAULT NULL,
+  `run_number` INT(11) NULL DEFAULT NULL,
+  INDEX `files_id` (`files_id` ASC),
+  INDEX `run_number` (`run_number` ASC),
+  CONSTRAINT `files_have_runs_ibfk_1`
+    FOREIGN KEY (`files_id`)
+    REFERENCES `files` (`id`),
+  CONSTRAINT `files_have_runs_ibfk_2`
+    FOREIGN KEY (`run_number`)
+    REFERENCES `runs` (`number`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = latin1;
+
+
+-- -----------------------------------------------------
+-- Table `logs`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `logs` (
+  `id` INT(11) NOT NULL AUTO_INCREMENT,
+  `table_ids` VARCHAR(255) NULL DEFAULT NULL,
+  `description` TEXT NULL DEFAULT NULL,
+  `related_run` INT(11) NULL DEFAULT NULL,
+  `created` DATETIME NULL DEFAULT NULL,
+  `user_name` VARCHAR(255) NULL DEFAULT NULL,
+  PRIMARY KEY (`id`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = latin1;
+
+
+-- -----------------------------------------------------
+-- Table `schema_versions`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `schema_versions` (
+  `version` INT(11) NOT NULL,
+  `created` DATETIME NULL DEFAULT NULL,
+  `comment` VARCHAR(255) NULL DEFAULT NULL,
+  PRIMARY KEY (`version`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = latin1;
+
+
+INSERT INTO `schema_versions` (`version`, `created`, `comment`)
+VALUES (3, NOW(), 'Created by create-v03.sql');
+
+
+SET SQL_MODE=@OLD_SQL_MODE;
+SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;
+SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS;
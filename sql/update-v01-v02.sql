@@ -0,0 +1,17 @@
+-- Upgrades RCDB MySQL schema from version 1 to version 2
+-- The same is done by 'rcdb upgrade' command (python/rcdb/schema_upgrade.py)
+--
+-- Version 2 adds unique key on conditions (run_number, condition_type_id)
+-- Duplicated conditions (see python/find_doublegainer_conditions.py) are removed, the latest value is kept
+-- (!) Back up the database first (!)
+
+DELETE FROM `conditions` WHERE `id` NOT IN (
+  SELECT `keep_id` FROM (
+    SELECT MAX(`id`) AS `keep_id` FROM `conditions` GROUP BY `run_number`, `condition_type_id`
+  ) AS `keep_ids`
+);
+
+CREATE UNIQUE INDEX `run_number_condition_type_id` ON `conditions` (`run_number`, `condition_type_id`);
+
+INSERT INTO `schema_versions` (`version`, `created`, `comment`)
+VALUES (2, NOW(), 'Unique key on conditions (run_number, condition_type_id)');
@@ -0,0 +1,20 @@
+-- Upgrades RCDB MySQL schema from version 2 to version 3
+-- The same is done by 'rcdb upgrade' command (python/rcdb/schema_upgrade.py)
+--
+-- Version 3 adds file_blobs table with compressed content of configuration files.
+-- Files with the same content (sha256) share one blob, files table maps paths and runs to blobs.
+-- files.content becomes nullable. It is NULL for files which content is in file_blobs.
+-- Content of existing files is moved to blobs by 'rcdb migrate-files' (it can be done later)
+
+CREATE TABLE IF NOT EXISTS `file_blobs` (
+  `sha256` VARCHAR(44) NOT NULL,
+  `compression` VARCHAR(8) NOT NULL,
+  `size` INT(11) NOT NULL,
+  `data` LONGBLOB NOT NULL,
+  PRIMARY KEY (`sha256`))
+ENGINE = InnoDB;
+
+ALTER TABLE `files` MODIFY `content` TEXT NULL;
+
+INSERT INTO `schema_versions` (`version`, `created`, `comment`)
+VALUES (3, NOW(), 'Compressed content of configuration files in file_blobs table');